@@ -0,0 +1,12 @@
+"""
+Micro-benchmarks for the turing, broker and parser hot paths.
+
+Run from the repository root with `python -m benchmarks --help`.
+"""
+from os import path
+import sys
+
+# the bot is run from inside `slamfan/`, so its packages import as top-level
+_SLAMFAN = path.join(path.dirname(path.dirname(path.abspath(__file__))), "slamfan")
+if _SLAMFAN not in sys.path:
+    sys.path.insert(0, _SLAMFAN)
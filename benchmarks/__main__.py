@@ -0,0 +1,93 @@
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, UTC
+from json import dump, load
+import platform
+import sys
+
+from . import broker, parser, turing
+from .harness import BENCHMARKS, SCALES
+from .compare import compare
+
+def __run(argv: Namespace) -> int:
+    scale = SCALES[argv.scale]
+    selected = argv.only or list(BENCHMARKS)
+
+    output = {
+        "meta": {
+            "time": datetime.now(UTC).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": argv.scale,
+            "seed": argv.seed,
+        },
+        "results": {},
+    }
+
+    for name in selected:
+        print(f"running {name}...", flush=True)
+        output["results"][name] = BENCHMARKS[name](scale, argv.seed)
+        for metric, v in output["results"][name].items():
+            print(f"  {metric}: {v['value']:.4g} {v['unit']}")
+
+    with open(argv.output, "w") as f:
+        dump(output, f, indent=2)
+    print(f"results written to {argv.output}")
+
+    if argv.baseline is None:
+        return 0
+
+    with open(argv.baseline) as f:
+        return __report(load(f), output, argv.threshold)
+
+def __compare(argv: Namespace) -> int:
+    with open(argv.baseline) as f:
+        baseline = load(f)
+    with open(argv.current) as f:
+        current = load(f)
+    return __report(baseline, current, argv.threshold)
+
+def __report(baseline, current, threshold: float) -> int:
+    if baseline["meta"].get("scale") != current["meta"].get("scale"):
+        print("warning: comparing results from different scales")
+
+    report, regressions = compare(baseline, current, threshold)
+    print("\n".join(report))
+
+    if len(regressions) > 0:
+        print(f"{len(regressions)} regression(s) beyond {threshold:.0%}")
+        return 1
+
+    return 0
+
+def __main() -> int:
+    arg = ArgumentParser(prog="python -m benchmarks",
+                         description="micro-benchmarks for the turing, broker and parser hot paths")
+    sub = arg.add_subparsers(dest="mode", required=True)
+
+    run = sub.add_parser("run", help="run the benchmarks and write the results as json")
+    run.add_argument("--scale", "-s", choices=sorted(SCALES), default="quick",
+                     help="workload sizes to use")
+    run.add_argument("--seed", type=int, default=1337,
+                     help="seed for the synthetic workloads")
+    run.add_argument("--only", action="append", choices=sorted(BENCHMARKS),
+                     help="run only the named benchmark(s)")
+    run.add_argument("--output", "-o", default="bench_output.json",
+                     help="file to write the results to")
+    run.add_argument("--baseline", "-b",
+                     help="saved results to compare against after running")
+    run.add_argument("--threshold", "-t", type=float, default=0.10,
+                     help="fractional slowdown that counts as a regression")
+    run.set_defaults(fn=__run)
+
+    cmp = sub.add_parser("compare", help="compare two saved result files")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--threshold", "-t", type=float, default=0.10,
+                     help="fractional slowdown that counts as a regression")
+    cmp.set_defaults(fn=__compare)
+
+    argv = arg.parse_args()
+    return argv.fn(argv)
+
+if __name__ == "__main__":
+    sys.exit(__main())
@@ -0,0 +1,104 @@
+from time import perf_counter
+from tempfile import TemporaryDirectory, gettempdir
+from datetime import datetime
+from uuid import UUID
+from os import path, makedirs, replace, remove
+import sqlite3
+import asyncio
+
+from brokers.database import DatabaseBroker
+
+from .harness import Scale, Metrics, benchmark, metric
+from .workloads import ChatWorkload
+
+async def _ingest(db: str, scale: Scale, seed: int) -> float:
+    work = ChatWorkload(seed)
+    messages = [(work.channels[i % len(work.channels)], i, msg)
+                for i, msg in enumerate(work.messages(scale.ingest_messages))]
+
+    # the broker's background work never finishes on its own; leaving
+    # its context stops it, so the task group can exit
+    async with asyncio.TaskGroup() as tg, \
+               DatabaseBroker(tg, db, save_delay=0, publish_interval=0) as dbm:
+        for channel in work.channels:
+            await dbm.init_corpus(channel)
+
+        start = perf_counter()
+        for channel, uid, msg in messages:
+            await dbm.add_twitch_message(channel, uid, msg, UUID(int=uid), datetime.now())
+        # until they are saved and learned from, not just handed in
+        await dbm.flush()
+        elapsed = perf_counter() - start
+
+    return len(messages) / elapsed
+
+@benchmark("broker_ingest")
+def broker_ingest(scale: Scale, seed: int) -> Metrics:
+    """
+    `DatabaseBroker.add_twitch_message` throughput, from handing messages
+    in until they are saved and published into the models, with the
+    moderation delay and publish batching disabled, against an in-memory
+    and an on-disk database.
+    """
+    results: Metrics = {}
+    results["memory_per_sec"] = metric(asyncio.run(_ingest(":memory:", scale, seed)), "msg/s", True)
+
+    with TemporaryDirectory() as d:
+        results["disk_per_sec"] = metric(asyncio.run(_ingest(path.join(d, "ingest.sqlite"), scale, seed)), "msg/s", True)
+
+    return results
+
+def _synthetic_database(rows: int, seed: int) -> str:
+    """
+    Build (or reuse) a database with `rows` synthetic messages. Building
+    a million rows takes a while, so the file is cached between runs.
+    """
+    cache = path.join(gettempdir(), "slamfan-bench")
+    makedirs(cache, exist_ok=True)
+    target = path.join(cache, f"connect-{rows}-{seed}.sqlite")
+    if path.exists(target):
+        return target
+
+    async def schema(db: str) -> None:
+        async with asyncio.TaskGroup() as tg, DatabaseBroker(tg, db):
+            pass
+
+    building = target + ".building"
+    if path.exists(building):
+        remove(building)
+
+    asyncio.run(schema(building))
+    conn = sqlite3.connect(building, detect_types=sqlite3.PARSE_DECLTYPES)
+    with conn:
+        conn.executemany("""INSERT INTO TwitchMessages(
+                                Channel,
+                                User,
+                                Message,
+                                MessageTime
+                            ) VALUES (?, ?, ?, ?)""", ChatWorkload(seed).rows(rows))
+    conn.close()
+    replace(building, target)
+    return target
+
+@benchmark("broker_connect")
+def broker_connect(scale: Scale, seed: int) -> Metrics:
+    """
+    Startup time of `DatabaseBroker.connect`, until every corpus has
+    loaded (`connect` itself returns before), on a synthetic database.
+    """
+    db = _synthetic_database(scale.connect_rows, seed)
+
+    async def run() -> float:
+        async with asyncio.TaskGroup() as tg:
+            start = perf_counter()
+            async with DatabaseBroker(tg, db) as dbm:
+                for channel in ChatWorkload(seed).channels:
+                    await dbm.corpus_ready(channel)
+                elapsed = perf_counter() - start
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    return {
+        "seconds": metric(elapsed, "s", False),
+        "rows_per_sec": metric(scale.connect_rows / elapsed, "rows/s", True),
+    }
@@ -0,0 +1,35 @@
+from typing import Any, Dict, List, Tuple
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> Tuple[List[str], List[str]]:
+    """
+    Compare two result files. Returns a report (one line per metric)
+    and the subset of lines that are regressions, i.e. metrics that got
+    worse by more than `threshold` (a fraction, e.g. 0.1 for 10%).
+    """
+    report: List[str] = []
+    regressions: List[str] = []
+
+    for bench, metrics in sorted(current["results"].items()):
+        base_metrics = baseline["results"].get(bench)
+        if base_metrics is None:
+            report.append(f"{bench}: new benchmark, no baseline")
+            continue
+
+        for name, cur in sorted(metrics.items()):
+            base = base_metrics.get(name)
+            if base is None or base["value"] == 0:
+                report.append(f"{bench}.{name}: {cur['value']:.4g} {cur['unit']} (no baseline)")
+                continue
+
+            change = (cur["value"] - base["value"]) / base["value"]
+            worse = -change if cur["higher_is_better"] else change
+            line = (f"{bench}.{name}: {base['value']:.4g} -> {cur['value']:.4g} {cur['unit']} "
+                    f"({change:+.1%})")
+
+            if worse > threshold:
+                line += " REGRESSION"
+                regressions.append(line)
+
+            report.append(line)
+
+    return report, regressions
@@ -0,0 +1,58 @@
+from typing import Any, Callable, Dict, Iterable, List
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class Scale:
+    """
+    Sizes used by the benchmarks. `quick` is meant for a laptop
+    sanity check, `full` for numbers worth comparing.
+    """
+    corpus_sizes: tuple
+    corpus_adds: int
+    generate_corpus: int
+    generate_samples: int
+    ingest_messages: int
+    connect_rows: int
+    parse_lines: int
+
+SCALES: Dict[str, Scale] = {
+    "quick": Scale(corpus_sizes=(1_000, 5_000),
+                   corpus_adds=100,
+                   generate_corpus=5_000,
+                   generate_samples=200,
+                   ingest_messages=500,
+                   connect_rows=50_000,
+                   parse_lines=50_000),
+    "full": Scale(corpus_sizes=(1_000, 10_000, 50_000),
+                  corpus_adds=200,
+                  generate_corpus=50_000,
+                  generate_samples=1_000,
+                  ingest_messages=2_000,
+                  connect_rows=1_000_000,
+                  parse_lines=500_000),
+}
+
+Metrics = Dict[str, Dict[str, Any]]
+BenchmarkFn = Callable[[Scale, int], Metrics]
+
+BENCHMARKS: Dict[str, BenchmarkFn] = {}
+
+def benchmark(name: str) -> Callable[[BenchmarkFn], BenchmarkFn]:
+    """
+    Register a benchmark. The function is called with the scale and
+    seed, and returns a mapping of metric name to `metric(...)`.
+    """
+    def wrap(fn: BenchmarkFn) -> BenchmarkFn:
+        BENCHMARKS[name] = fn
+        return fn
+    return wrap
+
+def metric(value: float, unit: str, higher_is_better: bool) -> Dict[str, Any]:
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+def percentiles(samples: Iterable[float], points: Iterable[int] = (50, 90, 99)) -> Dict[int, float]:
+    ordered: List[float] = sorted(samples)
+    if len(ordered) == 0:
+        return {p: 0.0 for p in points}
+
+    return {p: ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] for p in points}
@@ -0,0 +1,53 @@
+from time import perf_counter
+import asyncio
+
+from twitch import TwitchBot
+
+from .harness import Scale, Metrics, benchmark, metric
+from .workloads import ChatWorkload
+
+class _Named(object):
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.id = 0
+
+class _Channel(_Named):
+    def get_chatter(self, login: str) -> _Named:
+        return _Named(login)
+
+class _ParseBot(TwitchBot):
+    """
+    `TwitchBot` that never connects: channel lookups, user lookups and
+    event dispatch are replaced so only the parsing is measured.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("benchmark", "!", [])
+        self.dispatched = 0
+
+    def get_channel(self, name: str) -> _Channel:
+        return _Channel(name)
+
+    async def fetch_users(self, names=None, ids=None, token=None, force=False):
+        return [_Named(x) for x in names or []]
+
+    def run_event(self, event_name, *args):
+        self.dispatched += 1
+
+@benchmark("raw_data_parse")
+def raw_data_parse(scale: Scale, seed: int) -> Metrics:
+    """
+    `TwitchBot.event_raw_data` parse rate over a mix of PRIVMSG,
+    CLEARMSG, CLEARCHAT and USERNOTICE lines.
+    """
+    lines = ChatWorkload(seed).irc_lines(scale.parse_lines)
+
+    async def run() -> float:
+        bot = _ParseBot()
+        start = perf_counter()
+        for line in lines:
+            await bot.event_raw_data(line)
+        return perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    return {"lines_per_sec": metric(len(lines) / elapsed, "lines/s", True)}
@@ -0,0 +1,78 @@
+from time import perf_counter
+import asyncio
+import random
+
+from turing import Corpus
+
+from .harness import Scale, Metrics, benchmark, metric, percentiles
+from .workloads import ChatWorkload
+
+@benchmark("corpus_add")
+def corpus_add(scale: Scale, seed: int) -> Metrics:
+    """
+    `Corpus.add` throughput, measured on top of corpora of increasing size,
+    growing and as a sliding window of that size (every add also retracts).
+    """
+    results: Metrics = {}
+    for size in scale.corpus_sizes:
+        for prefix, window in (("", None), ("windowed_", size)):
+            work = ChatWorkload(seed)
+            corpus = Corpus(work.messages(size), max_messages=window)
+            extra = work.messages(scale.corpus_adds)
+
+            start = perf_counter()
+            for msg in extra:
+                corpus.add(msg)
+            elapsed = perf_counter() - start
+
+            results[f"{prefix}adds_per_sec@{size}"] = metric(len(extra) / elapsed, "msg/s", True)
+    return results
+
+@benchmark("generate_text")
+def generate_text(scale: Scale, seed: int) -> Metrics:
+    """
+    `Corpus.generate_text` latency percentiles on a fixed corpus.
+    """
+    random.seed(seed)
+    corpus = Corpus(ChatWorkload(seed).messages(scale.generate_corpus))
+
+    async def run():
+        samples = []
+        for _ in range(scale.generate_samples):
+            start = perf_counter()
+            await corpus.generate_text()
+            samples.append(perf_counter() - start)
+        return samples
+
+    samples = asyncio.run(run())
+    results: Metrics = {f"p{p}_ms": metric(v * 1000, "ms", False) for p, v in percentiles(samples).items()}
+    results["per_sec"] = metric(len(samples) / sum(samples), "msg/s", True)
+    return results
+
+@benchmark("generate_candidates")
+def generate_candidates(scale: Scale, seed: int) -> Metrics:
+    """
+    Best-of-N candidate batches: per-batch latency for each generator,
+    after the first (compiling) batch.
+    """
+    from turing import GeneratorBackend
+
+    random.seed(seed)
+    messages = ChatWorkload(seed).messages(scale.generate_corpus)
+    results: Metrics = {}
+    for flavor in (GeneratorBackend.MARKOVIFY, GeneratorBackend.NUMPY):
+        corpus = Corpus(messages, flavor=flavor)
+
+        async def run():
+            await corpus.generate_candidates(1)
+            samples = []
+            for _ in range(max(1, scale.generate_samples // 20)):
+                start = perf_counter()
+                await corpus.generate_candidates(256)
+                samples.append(perf_counter() - start)
+            return samples
+
+        samples = asyncio.run(run())
+        name = flavor.name.lower()
+        results[f"{name}_batch256_ms"] = metric(1000 * sum(samples) / len(samples), "ms", False)
+    return results
@@ -0,0 +1,96 @@
+from random import Random
+from itertools import accumulate
+from datetime import datetime, timedelta
+from hashlib import sha384
+from uuid import UUID
+from typing import Iterator, List, Tuple
+
+_EMOTES = ("Kappa", "PogChamp", "LUL", "KEKW", "monkaS", "OMEGALUL", "Pog",
+           "PepeHands", "catJAM", "Sadge", "5Head", "EZ", "GG", "ResidentSleeper")
+
+_SYLLABLES = ("ka", "lo", "mi", "ra", "to", "ne", "su", "vi", "pa", "de",
+              "go", "an", "el", "or", "us", "ti", "ba", "ze", "qu", "hy")
+
+class ChatWorkload(object):
+    """
+    Seeded generator of synthetic twitch chat. Word frequencies follow
+    a zipf-like distribution and emotes are over-represented, which is
+    roughly what real chat looks like. The same seed always produces the
+    same stream of messages.
+    """
+
+    def __init__(self, seed: int = 1337, vocabulary: int = 5000,
+                 channels: Tuple[str, ...] = ("alpha", "bravo", "charlie"),
+                 users: int = 2000):
+        """
+        :paramref: `seed`: random seed for the whole workload
+        :paramref: `vocabulary`: number of distinct non-emote words
+        :paramref: `channels`: channel names messages are spread over
+        :paramref: `users`: number of distinct chatters
+        """
+        self.__rng = Random(seed)
+        self.__channels = channels
+        self.__users = users
+
+        words = set()
+        while len(words) < vocabulary:
+            words.add("".join(self.__rng.choice(_SYLLABLES) for _ in range(self.__rng.randint(1, 4))))
+
+        self.__words: List[str] = list(_EMOTES) + sorted(words)
+        self.__cum_weights = list(accumulate(1.0 / (rank + 1) for rank in range(len(self.__words))))
+        self.__start = datetime(2023, 1, 1)
+
+    @property
+    def channels(self) -> Tuple[str, ...]:
+        return self.__channels
+
+    def message(self) -> str:
+        length = min(int(self.__rng.expovariate(1 / 6)) + 1, 40)
+        return " ".join(self.__rng.choices(self.__words, cum_weights=self.__cum_weights, k=length))
+
+    def messages(self, count: int) -> List[str]:
+        return [self.message() for _ in range(count)]
+
+    def rows(self, count: int) -> Iterator[Tuple[str, str, str, datetime]]:
+        """
+        Rows shaped like `TwitchMessages` (channel, user hash, message, time)
+        """
+        hashes = [sha384(str(x).encode()).hexdigest() for x in range(self.__users)]
+        for i in range(count):
+            yield (self.__rng.choice(self.__channels),
+                   self.__rng.choice(hashes),
+                   self.message(),
+                   self.__start + timedelta(seconds=i))
+
+    def irc_lines(self, count: int) -> List[str]:
+        """
+        Raw TMI lines, mostly PRIVMSG with a sprinkling of CLEARMSG,
+        CLEARCHAT and USERNOTICE traffic.
+        """
+        lines = []
+        for i in range(count):
+            channel = self.__rng.choice(self.__channels)
+            uid = self.__rng.randrange(self.__users)
+            login = f"user{uid}"
+            msg_id = UUID(int=self.__rng.getrandbits(128))
+            ts = int((self.__start + timedelta(seconds=i)).timestamp() * 1000)
+            kind = self.__rng.random()
+
+            if kind < 0.90:
+                lines.append(f"@badge-info=;badges=;color=#FF0000;display-name={login};emotes=;first-msg=0;"
+                             f"flags=;id={msg_id};mod=0;returning-chatter=0;room-id=1;subscriber=0;"
+                             f"tmi-sent-ts={ts};turbo=0;user-id={uid};user-type= "
+                             f":{login}!{login}@{login}.tmi.twitch.tv PRIVMSG #{channel} :{self.message()}")
+            elif kind < 0.94:
+                lines.append(f"@login={login};room-id=;target-msg-id={msg_id};tmi-sent-ts={ts} "
+                             f":tmi.twitch.tv CLEARMSG #{channel} :{self.message()}")
+            elif kind < 0.97:
+                lines.append(f"@ban-duration={self.__rng.choice((60, 600, 3600))};room-id=1;"
+                             f"target-user-id={uid};tmi-sent-ts={ts} "
+                             f":tmi.twitch.tv CLEARCHAT #{channel} :{login}")
+            else:
+                lines.append(f"@badge-info=;badges=;color=;display-name={login};emotes=;flags=;id={msg_id};"
+                             f"login={login};mod=0;msg-id=resub;msg-param-cumulative-months=3;room-id=1;"
+                             f"subscriber=1;system-msg=resub;tmi-sent-ts={ts};user-id={uid};user-type= "
+                             f":tmi.twitch.tv USERNOTICE #{channel} :{self.message()}")
+        return lines
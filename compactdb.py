@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+"""
+Archive old messages out of the bot's database, fold archives back
+into the per-channel model snapshots, or compress the messages left.
+
+    python compactdb.py archive bot.sqlite --older-than-days 90
+    python compactdb.py archive bot.sqlite --channel-dir channels
+    python compactdb.py fold bot.sqlite archive/somechannel/*.jsonl.gz
+    python compactdb.py compress bot.sqlite
+"""
+from argparse import ArgumentParser, Namespace
+from datetime import timedelta
+from glob import glob
+from sqlite3 import connect
+from time import perf_counter
+from os import path
+import sys
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "slamfan"))
+
+from brokers.maintenance import compact, build_snapshots, archived_messages, compress_messages
+from brokers.schema import attach_core
+
+def __archive(argv: Namespace) -> None:
+    start = perf_counter()
+    if argv.channel_dir is None:
+        databases = [argv.database]
+    else:
+        databases = sorted(glob(path.join(argv.channel_dir, "*.sqlite")))
+    before = sum(path.getsize(x) for x in databases)
+
+    archived = {}
+    for database in databases:
+        archived.update(compact(database, argv.archive_dir, timedelta(days=argv.older_than_days),
+                                per_month=not argv.per_channel, snapshots=not argv.no_snapshots,
+                                vacuum=not argv.no_vacuum, repeat_cap=argv.repeat_cap,
+                                core=argv.database if argv.channel_dir is not None else None))
+
+    for target, count in sorted(archived.items()):
+        print(f"{target}: {count:,} messages")
+
+    print(f"archived {sum(archived.values()):,} messages in {perf_counter() - start:.1f}s, "
+          f"database {before:,} -> {sum(path.getsize(x) for x in databases):,} bytes")
+
+def __fold(argv: Namespace) -> None:
+    db = connect(argv.database)
+    try:
+        extra = archived_messages(db, argv.archives, argv.channel)
+        print(f"read {sum(len(x) for x in extra.values()):,} archived messages")
+        build_snapshots(db, sorted(extra), extra)
+    finally:
+        db.close()
+
+def __compress(argv: Namespace) -> None:
+    if argv.channel_dir is None:
+        databases = [argv.database]
+    else:
+        databases = sorted(glob(path.join(argv.channel_dir, "*.sqlite")))
+    before = sum(path.getsize(x) for x in databases)
+
+    start = perf_counter()
+    for database in databases:
+        db = connect(database, timeout=60)
+        try:
+            if argv.channel_dir is not None:
+                attach_core(db, argv.database)
+
+            for channel, (text, stored) in sorted(compress_messages(db).items()):
+                print(f"{channel}: {text:,} -> {stored:,} bytes of text")
+
+            if not argv.no_vacuum:
+                db.execute("VACUUM")
+        finally:
+            db.close()
+
+    print(f"compressed in {perf_counter() - start:.1f}s, "
+          f"database {before:,} -> {sum(path.getsize(x) for x in databases):,} bytes")
+
+if __name__ == "__main__":
+    arg = ArgumentParser(description="archive and compact the bot's message history")
+    sub = arg.add_subparsers(dest="mode", required=True)
+
+    archive = sub.add_parser("archive", help="move old messages into compressed archive files")
+    archive.add_argument("database")
+    archive.add_argument("--older-than-days", type=float, default=90.0,
+                         help="archive messages older than this")
+    archive.add_argument("--archive-dir", default="archive",
+                         help="directory to write <channel>/<yyyy-mm>.jsonl.gz files to")
+    archive.add_argument("--per-channel", action="store_true",
+                         help="one archive file per channel instead of per channel and month")
+    archive.add_argument("--no-snapshots", action="store_true",
+                         help="do not refresh model snapshots before archiving")
+    archive.add_argument("--no-vacuum", action="store_true",
+                         help="do not VACUUM the database afterwards")
+    archive.add_argument("--channel-dir",
+                         help="the bot's --channel-dir: compact each channel's own database")
+    archive.add_argument("--repeat-cap", type=int,
+                         help="most copies of one repeated message the snapshots count")
+    archive.set_defaults(fn=__archive)
+
+    fold = sub.add_parser("fold", help="rebuild model snapshots from the hot table plus archives")
+    fold.add_argument("database")
+    fold.add_argument("archives", nargs="+")
+    fold.add_argument("--channel", help="only fold this channel's messages")
+    fold.set_defaults(fn=__fold)
+
+    compress = sub.add_parser("compress", help="compress the plain messages, training dictionaries as needed")
+    compress.add_argument("database")
+    compress.add_argument("--channel-dir",
+                          help="the bot's --channel-dir: compress each channel's own database")
+    compress.add_argument("--no-vacuum", action="store_true",
+                          help="do not VACUUM the database afterwards")
+    compress.set_defaults(fn=__compress)
+
+    argv = arg.parse_args()
+    argv.fn(argv)
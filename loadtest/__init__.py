@@ -0,0 +1,13 @@
+"""
+End-to-end load testing against local stand-ins for twitch chat (TMI)
+and the helix API.
+
+Run from the repository root with `python -m loadtest --help`.
+"""
+from os import path
+import sys
+
+# the bot is run from inside `slamfan/`, so its packages import as top-level
+_SLAMFAN = path.join(path.dirname(path.dirname(path.abspath(__file__))), "slamfan")
+if _SLAMFAN not in sys.path:
+    sys.path.insert(0, _SLAMFAN)
@@ -0,0 +1,84 @@
+from argparse import ArgumentParser, Namespace
+from json import dumps
+import asyncio
+import sys
+
+from . import traffic
+from .driver import run_load_test
+from .irc import FakeTMIServer
+from .helix import HelixStub
+
+def __schedule(argv: Namespace) -> traffic.Schedule:
+    if argv.replay is not None:
+        with open(argv.replay) as f:
+            return traffic.recorded(f, argv.rate)
+
+    return traffic.synthetic([f"chan{i}" for i in range(argv.channels)], argv.rate, argv.duration,
+                             seed=argv.seed, clearmsg=argv.clearmsg, timeout=argv.timeout,
+                             usernotice=argv.usernotice, moderation_delay=argv.moderation_delay)
+
+def __drive(argv: Namespace) -> int:
+    result = asyncio.run(run_load_test(__schedule(argv), save_delay=argv.save_delay,
+                                       emit_delay=(argv.emit_min, argv.emit_max)))
+    out = dumps(result, indent=2)
+    print(out)
+
+    if argv.output is not None:
+        with open(argv.output, "w") as f:
+            f.write(out)
+
+    return 0
+
+async def __serve(argv: Namespace) -> None:
+    schedule = __schedule(argv)
+    async with FakeTMIServer(argv.host, argv.irc_port) as irc, HelixStub(argv.host, argv.helix_port) as helix:
+        print(f"--tmi-url {irc.url} --helix-url {helix.url}")
+        print(f"waiting for {len(schedule.channels)} channel(s) to be joined...")
+        await irc.wait_joined(schedule.channels)
+        await irc.replay(schedule)
+        print(f"replayed {len(schedule.events)} lines; bots sent {len(irc.outbound)} message(s)")
+
+def __main() -> int:
+    arg = ArgumentParser(prog="python -m loadtest",
+                         description="load test the bot against local TMI and helix stand-ins")
+    sub = arg.add_subparsers(dest="mode", required=True)
+
+    for name, help in (("drive", "run the turing bot in-process against the stand-ins and measure it"),
+                       ("serve", "only run the stand-ins, for a bot started with --tmi-url/--helix-url")):
+        p = sub.add_parser(name, help=help)
+        p.add_argument("--channels", "-c", type=int, default=10,
+                       help="number of synthetic channels")
+        p.add_argument("--rate", "-r", type=float, default=100.0,
+                       help="lines per second, over all channels")
+        p.add_argument("--duration", "-d", type=float, default=30.0,
+                       help="seconds of synthetic chat")
+        p.add_argument("--replay", help="file of recorded raw TMI lines to replay instead")
+        p.add_argument("--seed", type=int, default=1337)
+        p.add_argument("--clearmsg", type=float, default=0.02,
+                       help="fraction of messages deleted by a moderator")
+        p.add_argument("--timeout", type=float, default=0.01,
+                       help="fraction of messages whose author is timed out")
+        p.add_argument("--usernotice", type=float, default=0.02,
+                       help="fraction of lines that are resub notices")
+        p.add_argument("--moderation-delay", type=float, default=1.0,
+                       help="seconds between a message and its moderation")
+
+    drive = sub.choices["drive"]
+    drive.add_argument("--save-delay", type=int, default=2,
+                       help="the broker's moderation delay, in seconds")
+    drive.add_argument("--emit-min", type=int, default=1)
+    drive.add_argument("--emit-max", type=int, default=3)
+    drive.add_argument("--output", "-o", help="also write the results to this file")
+    drive.set_defaults(fn=__drive)
+
+    serve = sub.choices["serve"]
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--irc-port", type=int, default=6667)
+    serve.add_argument("--helix-port", type=int, default=6668)
+    serve.set_defaults(fn=lambda argv: asyncio.run(__serve(argv)) or 0)
+
+    argv = arg.parse_args()
+    return argv.fn(argv)
+
+if __name__ == "__main__":
+    sys.exit(__main())
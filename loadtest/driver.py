@@ -0,0 +1,135 @@
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from os import path
+from re import compile as regex
+from typing import Any, Dict, List
+import sqlite3
+import asyncio
+
+from brokers.database import DatabaseBroker
+from twitch import TwitchBot, Admin, Turing, StreamWatcher
+
+from benchmarks.harness import percentiles
+from .irc import FakeTMIServer
+from .helix import HelixStub
+from .traffic import Schedule
+
+_TOKEN = regex(r"\blt(\d+)$")
+
+async def _watch_database(db: str, persisted: Dict[int, float], stop: asyncio.Event, interval: float) -> None:
+    """
+    Poll the database on a separate connection, recording when each
+    sequenced message first shows up.
+    """
+    conn = sqlite3.connect(db)
+    last = 0
+    try:
+        while True:
+            rows = conn.execute("SELECT Id, Message FROM TwitchMessages WHERE Id > ? ORDER BY Id", (last,)).fetchall()
+            now = perf_counter()
+            for rid, msg in rows:
+                last = rid
+                match = _TOKEN.search(msg or "")
+                if match is not None:
+                    persisted.setdefault(int(match.group(1)), now)
+
+            if stop.is_set():
+                return
+
+            await asyncio.sleep(interval)
+    finally:
+        conn.close()
+
+def _ms(samples: List[float]) -> Dict[str, float]:
+    return {f"p{p}_ms": round(v * 1000, 3) for p, v in percentiles(samples).items()}
+
+async def run_load_test(schedule: Schedule, save_delay: int = 2, emit_delay: tuple = (1, 3),
+                        settle: float = 5.0, poll_interval: float = 0.05) -> Dict[str, Any]:
+    """
+    Run the turing bot and its database broker in this process, pointed
+    at a fake TMI server and helix stub, replay `schedule` into it and
+    measure what comes out the other end.
+
+    :paramref: `save_delay`: the broker's moderation delay, in seconds
+    :paramref: `emit_delay`: range of seconds between generated messages
+    :paramref: `settle`: seconds to keep measuring after the replay ends
+    """
+    channels = schedule.channels
+    persisted: Dict[int, float] = {}
+    stop = asyncio.Event()
+
+    with TemporaryDirectory() as d:
+        db = path.join(d, "loadtest.sqlite")
+
+        async with FakeTMIServer() as irc, HelixStub(tokens={"ansf": "ansf"}) as helix, \
+                   asyncio.TaskGroup() as tg, DatabaseBroker(tg, db, save_delay=save_delay) as dbm, \
+                   StreamWatcher(tg, dbm) as streams:
+            admin = Admin("loadtest")
+            bot = TwitchBot("ansf", "!", channels, irc_url=irc.url, api_url=helix.url)
+            bot.add_cog(admin)
+            bot.add_cog(Turing("loadtest", dbm, tg, streams, msg_delay=emit_delay))
+
+            watcher = tg.create_task(_watch_database(db, persisted, stop, poll_interval))
+
+            async with bot:
+                await irc.wait_joined(channels)
+
+                start = perf_counter()
+                await irc.replay(schedule)
+                replayed = perf_counter() - start
+
+                await asyncio.sleep(save_delay + settle)
+                stop.set()
+                await watcher
+                elapsed = perf_counter() - start
+
+                # stop the turing loops, and let them notice, before the bot disconnects
+                for cog in bot.cogs.values():
+                    cog.die()
+                await asyncio.sleep(1.5)
+
+            admin.die_event.set()
+
+    sent = irc.sent
+    cancelled = schedule.cancelled
+    delivered = [persisted[x] - sent[x] for x in persisted if x in sent and x not in cancelled]
+    leaked = [x for x in cancelled if x in persisted]
+    expected = [x for x in sent if x not in cancelled]
+
+    per_channel: Dict[str, List[float]] = {}
+    for out in irc.outbound:
+        per_channel.setdefault(out.channel, []).append(out.at)
+    gaps = [b - a for times in per_channel.values() for a, b in zip(times, times[1:])]
+
+    arrivals = sorted(persisted.values())
+    window = arrivals[-1] - arrivals[0] if len(arrivals) > 1 else 0.0
+
+    return {
+        "channels": len(channels),
+        "replay": {
+            "events": len(schedule.events),
+            "seconds": round(replayed, 3),
+            "lines_per_sec": round(len(schedule.events) / replayed, 1) if replayed > 0 else 0,
+            "behind_schedule_s": round(replayed - schedule.duration, 3),
+        },
+        "ingest": {
+            "sent": len(expected),
+            "persisted": len(delivered),
+            "lost": len(expected) - len([x for x in expected if x in persisted]),
+            "per_sec": round(len(arrivals) / window, 1) if window > 0 else 0,
+            "latency": _ms(delivered),
+            "latency_over_delay": _ms([x - save_delay for x in delivered]),
+        },
+        "moderation": {
+            "targeted": len(cancelled),
+            "leaked": len(leaked),
+            "cancelled_pct": round(100 * (1 - len(leaked) / len(cancelled)), 2) if len(cancelled) > 0 else 100.0,
+        },
+        "emission": {
+            "messages": len(irc.outbound),
+            "per_sec": round(len(irc.outbound) / elapsed, 3),
+            "channels_emitting": len(per_channel),
+            "gap": _ms(gaps),
+        },
+        "helix_requests": dict(helix.requests),
+    }
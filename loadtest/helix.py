@@ -0,0 +1,123 @@
+from datetime import datetime, UTC
+from hashlib import sha1
+from time import time
+from typing import Dict, Iterable, Set
+
+from aiohttp import web
+
+class HelixStub(object):
+    """
+    Local stand-in for the helix API. Answers token validation,
+    `fetch_users` and `fetch_streams`; everything else is a 404.
+
+    Users named `user<N>` get the id `N`, which is what the synthetic
+    chat uses for its `user-id` tags.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 tokens: Dict[str, str] | None = None, live: Iterable[str] | None = None):
+        """
+        :paramref: `tokens`: access token to login name; unknown tokens
+                             validate as a login equal to the token
+        :paramref: `live`: channels reported as live; all of them if `None`
+        """
+        self.__host = host
+        self.__port = port
+        self.__tokens = tokens or {}
+        self.__live: Set[str] | None = None if live is None else set(live)
+        self.__runner: web.AppRunner | None = None
+        self.requests: Dict[str, int] = {}
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.__host}:{self.__port}"
+
+    def set_live(self, channel: str, live: bool = True) -> None:
+        if self.__live is None:
+            self.__live = set()
+
+        if live:
+            self.__live.add(channel)
+        else:
+            self.__live.discard(channel)
+
+    async def __aenter__(self) -> 'HelixStub':
+        app = web.Application()
+        app.router.add_get("/oauth2/validate", self.__validate)
+        app.router.add_get("/helix/users", self.__users)
+        app.router.add_get("/helix/streams", self.__streams)
+        self.__runner = web.AppRunner(app)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, self.__host, self.__port)
+        await site.start()
+        self.__port = self.__runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, *e) -> None:
+        await self.__runner.cleanup()
+
+    def __count(self, name: str) -> None:
+        self.requests[name] = self.requests.get(name, 0) + 1
+
+    @staticmethod
+    def __user_id(login: str) -> int:
+        if login.startswith("user") and login[4:].isdigit():
+            return int(login[4:])
+        return 1_000_000 + int(sha1(login.encode()).hexdigest()[:8], 16)
+
+    @staticmethod
+    def __json(data) -> web.Response:
+        return web.json_response(data, headers={"Ratelimit-Remaining": "800",
+                                                "Ratelimit-Reset": str(int(time()) + 60)})
+
+    async def __validate(self, request: web.Request) -> web.Response:
+        self.__count("validate")
+        token = request.headers.get("Authorization", "").split(" ")[-1]
+        login = self.__tokens.get(token, token)
+        return self.__json({"client_id": "loadtest", "login": login,
+                            "user_id": str(self.__user_id(login)),
+                            "scopes": ["chat:read", "chat:edit"], "expires_in": 5_000_000})
+
+    async def __users(self, request: web.Request) -> web.Response:
+        self.__count("users")
+        logins = request.query.getall("login", [])
+        ids = request.query.getall("id", [])
+        logins += [f"user{x}" for x in ids]
+
+        created = datetime(2020, 1, 1, tzinfo=UTC).isoformat().replace("+00:00", "Z")
+        return self.__json({"data": [{
+            "id": str(self.__user_id(x)),
+            "login": x,
+            "display_name": x,
+            "type": "",
+            "broadcaster_type": "",
+            "description": "",
+            "profile_image_url": "",
+            "offline_image_url": "",
+            "view_count": 0,
+            "created_at": created,
+        } for x in logins]})
+
+    async def __streams(self, request: web.Request) -> web.Response:
+        self.__count("streams")
+        logins = [x for x in request.query.getall("user_login", [])
+                  if self.__live is None or x in self.__live]
+
+        started = datetime.now(UTC).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+        return self.__json({"data": [{
+            "id": str(self.__user_id(x) + 7),
+            "user_id": str(self.__user_id(x)),
+            "user_login": x,
+            "user_name": x,
+            "game_id": "13389",
+            "game_name": "Age of Empires II",
+            "type": "live",
+            "title": "load test",
+            "viewer_count": 100,
+            "started_at": started,
+            "language": "en",
+            "thumbnail_url": "",
+            "tag_ids": [],
+            "tags": [],
+            "is_mature": False,
+        } for x in logins], "pagination": {}})
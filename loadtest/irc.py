@@ -0,0 +1,149 @@
+from time import time, perf_counter
+from dataclasses import dataclass
+from typing import Dict, List, Set
+import asyncio
+
+from aiohttp import web, WSMsgType
+
+from .traffic import Schedule
+
+@dataclass
+class Outbound:
+    """
+    A PRIVMSG sent by a connected bot.
+    """
+    at: float
+    nick: str
+    channel: str
+    text: str
+
+class FakeTMIServer(object):
+    """
+    Local stand-in for twitch's chat websocket (TMI). Speaks just enough
+    IRC for twitchio to log in and join channels, records everything the
+    bots say, and replays a `Schedule` of chat traffic to joined clients.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.__host = host
+        self.__port = port
+        self.__runner: web.AppRunner | None = None
+        self.__joined: Dict[str, Set[web.WebSocketResponse]] = {}
+        self.__nicks: Dict[web.WebSocketResponse, str] = {}
+        self.__join_event = asyncio.Event()
+        self.outbound: List[Outbound] = []
+        self.sent: Dict[int, float] = {}
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.__host}:{self.__port}/"
+
+    async def __aenter__(self) -> 'FakeTMIServer':
+        app = web.Application()
+        app.router.add_get("/", self.__handle)
+        self.__runner = web.AppRunner(app)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, self.__host, self.__port)
+        await site.start()
+        self.__port = self.__runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, *e) -> None:
+        for ws in list(self.__nicks):
+            await ws.close()
+        await self.__runner.cleanup()
+
+    async def wait_joined(self, channels: List[str], clients: int = 1) -> None:
+        """
+        Block until at least `clients` connections have joined every channel
+        """
+        while not all(len(self.__joined.get(x, ())) >= clients for x in channels):
+            self.__join_event.clear()
+            await self.__join_event.wait()
+
+    async def __send(self, ws: web.WebSocketResponse, *lines: str) -> None:
+        try:
+            await ws.send_str("".join(f"{x}\r\n" for x in lines))
+        except ConnectionError:
+            pass
+
+    async def __handle(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.__nicks[ws] = "justinfan"
+
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+
+                for line in msg.data.split("\r\n"):
+                    if line:
+                        await self.__command(ws, line)
+        finally:
+            self.__nicks.pop(ws, None)
+            for members in self.__joined.values():
+                members.discard(ws)
+
+        return ws
+
+    async def __command(self, ws: web.WebSocketResponse, line: str) -> None:
+        if line.startswith("@"):
+            line = line.split(" ", 1)[1]
+
+        parts = line.split(" ", 2)
+        nick = self.__nicks.get(ws, "justinfan")
+
+        match parts[0]:
+            case "NICK":
+                nick = self.__nicks[ws] = parts[1].strip()
+                await self.__send(ws,
+                                  f":tmi.twitch.tv 001 {nick} :Welcome, GLHF!",
+                                  f":tmi.twitch.tv 002 {nick} :Your host is tmi.twitch.tv",
+                                  f":tmi.twitch.tv 003 {nick} :This server is rather new",
+                                  f":tmi.twitch.tv 004 {nick} :-",
+                                  f":tmi.twitch.tv 375 {nick} :-",
+                                  f":tmi.twitch.tv 372 {nick} :You are in a maze of twisty passages.",
+                                  f":tmi.twitch.tv 376 {nick} :>")
+            case "CAP":
+                await self.__send(ws, f":tmi.twitch.tv CAP * ACK {parts[-1]}")
+            case "JOIN":
+                channel = parts[1].strip().lstrip("#")
+                self.__joined.setdefault(channel, set()).add(ws)
+                await self.__send(ws,
+                                  f":{nick}!{nick}@{nick}.tmi.twitch.tv JOIN #{channel}",
+                                  f":{nick}.tmi.twitch.tv 353 {nick} = #{channel} :{nick}",
+                                  f":{nick}.tmi.twitch.tv 366 {nick} #{channel} :End of /NAMES list",
+                                  f"@badge-info=;badges=;color=;display-name={nick};emote-sets=0;mod=0;subscriber=0;user-type= "
+                                  f":tmi.twitch.tv USERSTATE #{channel}",
+                                  f"@emote-only=0;followers-only=-1;r9k=0;room-id=1;slow=0;subs-only=0 "
+                                  f":tmi.twitch.tv ROOMSTATE #{channel}")
+                self.__join_event.set()
+            case "PART":
+                self.__joined.get(parts[1].strip().lstrip("#"), set()).discard(ws)
+            case "PING":
+                await self.__send(ws, "PONG :tmi.twitch.tv")
+            case "PRIVMSG":
+                self.outbound.append(Outbound(perf_counter(), nick, parts[1].lstrip("#"), parts[2][1:]))
+
+    async def broadcast(self, channel: str, line: str) -> None:
+        for ws in list(self.__joined.get(channel, ())):
+            await self.__send(ws, line)
+
+    async def replay(self, schedule: Schedule) -> None:
+        """
+        Send every event of `schedule` at its offset from now. Send times
+        (on the `perf_counter` clock) of sequenced messages are kept in
+        `sent`, keyed by sequence number.
+        """
+        start = perf_counter()
+        for event in schedule.events:
+            delay = start + event.offset - perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            now = perf_counter()
+            if event.seq is not None and event.kind == "PRIVMSG":
+                self.sent[event.seq] = now
+
+            await self.broadcast(event.channel, event.line.replace("{ts}", str(int(time() * 1000))))
@@ -0,0 +1,120 @@
+from dataclasses import dataclass, field
+from random import Random
+from uuid import UUID
+from re import compile as regex
+from typing import Iterable, List
+
+from benchmarks.workloads import ChatWorkload
+
+_CHANNEL = regex(r" (?:PRIVMSG|CLEARMSG|CLEARCHAT|USERNOTICE|JOIN|PART) #([^\s]+)")
+_TS = regex(r"tmi-sent-ts=\d+")
+
+@dataclass(order=True)
+class ChatEvent:
+    """
+    A single line of chat traffic, to be sent `offset` seconds after
+    the replay starts. `{ts}` in the line is replaced by the send time
+    in milliseconds.
+    """
+    offset: float
+    channel: str = field(compare=False)
+    line: str = field(compare=False)
+    kind: str = field(compare=False, default="PRIVMSG")
+    seq: int | None = field(compare=False, default=None)
+
+@dataclass
+class Schedule:
+    events: List[ChatEvent]
+    cancelled: set = field(default_factory=set)
+
+    @property
+    def duration(self) -> float:
+        return self.events[-1].offset if len(self.events) > 0 else 0.0
+
+    @property
+    def channels(self) -> List[str]:
+        return sorted({x.channel for x in self.events})
+
+def token(seq: int) -> str:
+    """
+    Marker appended to synthetic messages so they can be found
+    again once they reach the database.
+    """
+    return f"lt{seq}"
+
+def synthetic(channels: Iterable[str], rate: float, duration: float, seed: int = 1337,
+              clearmsg: float = 0.02, timeout: float = 0.01, usernotice: float = 0.02,
+              moderation_delay: float = 2.0, users: int = 500) -> Schedule:
+    """
+    Build synthetic chat for `channels`, `rate` lines per second in
+    total for `duration` seconds.
+
+    :paramref: `clearmsg`: fraction of messages deleted by a moderator
+    :paramref: `timeout`: fraction of messages whose author is timed out
+    :paramref: `usernotice`: fraction of lines that are resub notices
+    :paramref: `moderation_delay`: seconds between a message and its moderation
+    """
+    channels = list(channels)
+    rng = Random(seed)
+    work = ChatWorkload(seed, channels=tuple(channels), users=users)
+    events: List[ChatEvent] = []
+    cancelled = set()
+
+    for seq in range(int(rate * duration)):
+        offset = seq / rate
+        channel = channels[seq % len(channels)]
+        uid = rng.randrange(users)
+        login = f"user{uid}"
+        msg_id = UUID(int=rng.getrandbits(128))
+        roll = rng.random()
+
+        if roll < usernotice:
+            events.append(ChatEvent(offset, channel,
+                                    f"@badge-info=;badges=;color=;display-name={login};emotes=;flags=;id={msg_id};"
+                                    f"login={login};mod=0;msg-id=resub;msg-param-cumulative-months=3;room-id=1;"
+                                    f"subscriber=1;system-msg=resub;tmi-sent-ts={{ts}};user-id={uid};user-type= "
+                                    f":tmi.twitch.tv USERNOTICE #{channel} :{work.message()}",
+                                    "USERNOTICE"))
+            continue
+
+        events.append(ChatEvent(offset, channel,
+                                f"@badge-info=;badges=;color=#FF0000;display-name={login};emotes=;first-msg=0;"
+                                f"flags=;id={msg_id};mod=0;returning-chatter=0;room-id=1;subscriber=0;"
+                                f"tmi-sent-ts={{ts}};turbo=0;user-id={uid};user-type= "
+                                f":{login}!{login}@{login}.tmi.twitch.tv PRIVMSG #{channel} :{work.message()} {token(seq)}",
+                                "PRIVMSG", seq))
+
+        roll = rng.random()
+        if roll < clearmsg:
+            cancelled.add(seq)
+            events.append(ChatEvent(offset + moderation_delay, channel,
+                                    f"@login={login};room-id=;target-msg-id={msg_id};tmi-sent-ts={{ts}} "
+                                    f":tmi.twitch.tv CLEARMSG #{channel} :deleted",
+                                    "CLEARMSG", seq))
+        elif roll < clearmsg + timeout:
+            cancelled.add(seq)
+            events.append(ChatEvent(offset + moderation_delay, channel,
+                                    f"@ban-duration=600;room-id=1;target-user-id={uid};tmi-sent-ts={{ts}} "
+                                    f":tmi.twitch.tv CLEARCHAT #{channel} :{login}",
+                                    "CLEARCHAT", seq))
+
+    events.sort()
+    return Schedule(events, cancelled)
+
+def recorded(lines: Iterable[str], rate: float) -> Schedule:
+    """
+    Replay recorded raw TMI lines (one per line) at `rate` lines per
+    second. Timestamps are rewritten to the replay time.
+    """
+    events: List[ChatEvent] = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        match = _CHANNEL.search(line)
+        if match is None:
+            continue
+
+        kind = line[match.start():].split()[0]
+        events.append(ChatEvent(len(events) / rate, match.group(1),
+                                _TS.sub("tmi-sent-ts={ts}", line),
+                                kind))
+    return Schedule(events)
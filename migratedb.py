@@ -1,95 +1,130 @@
-from sys import argv
+#!/usr/bin/python3
+"""
+Bulk import of exported chat logs (csv) and bot settings (json)
+into the bot's database.
+
+    python migratedb.py chat.csv settings.json [--snapshots]
+"""
+from argparse import ArgumentParser, Namespace
 from csv import reader
-from sqlite3 import connect
+from sqlite3 import connect, Connection
 from hashlib import sha384
 from json import load
 from datetime import datetime
 from zoneinfo import ZoneInfo
+from functools import lru_cache
+from itertools import islice
+from time import perf_counter
+from typing import Iterable, Iterator, List, Tuple
+from os import path
+import sys
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "slamfan"))
+
+from brokers.schema import create_tables, create_indexes, drop_indexes, create_search, drop_search
+from brokers.maintenance import build_snapshots
+from brokers.codec import MessageCodec
+
+@lru_cache(maxsize=1 << 16)
+def user_hash(user_id: str) -> str:
+    return sha384(user_id.encode()).hexdigest()
+
+def messages(rows: Iterable[List[str]]) -> Iterator[Tuple[str, str, str, datetime]]:
+    for channel, user_id, _, time, msg in rows:
+        if len(msg) == 0:
+            continue
+
+        yield (channel, user_hash(user_id), msg, datetime.fromisoformat(time))
+
+def import_messages(db: Connection, csv_path: str, chunk: int) -> int:
+    """
+    Stream the csv into `TwitchMessages`, `chunk` rows per transaction.
+    """
+    total = 0
+    start = perf_counter()
+    with open(csv_path, "r", newline="") as f:
+        rows = messages(reader(f))
+        while True:
+            batch = list(islice(rows, chunk))
+            if len(batch) == 0:
+                break
+
+            with db:
+                db.executemany("""
+                    INSERT INTO TwitchMessages
+                        (
+                            Channel,
+                            User,
+                            Message,
+                            MessageTime
+                        )
+                    VALUES (?, ?, ?, ?)
+                    """, batch)
+
+            total += len(batch)
+            elapsed = perf_counter() - start
+            print(f"\r{total:,} messages, {total / elapsed:,.0f} rows/s", end="", flush=True)
+
+    print()
+    return total
 
-def create_tables(db):
-    db.execute("""
-    CREATE TABLE IF NOT EXISTS TwitchMessages(
-        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
-        Channel     TEXT,
-        User        TEXT,
-        Message     TEXT,
-        MessageTime DATETIME
-    )""")
-    db.execute("""
-    CREATE TABLE IF NOT EXISTS TwitchBannedWords(
-        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
-        Word        TEXT,
-        AddTime     DATETIME
-    )""")
-    db.execute("""
-    CREATE TABLE IF NOT EXISTS TwitchBanned(
-        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
-        Channel     TEXT,
-        User        TEXT,
-        BanTime     DATETIME,
-        UnbanTime   DATETIME
-    )""")
-    db.execute("""
-    CREATE TABLE IF NOT EXISTS TwitchStreams(
-        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
-        VOD         TEXT,
-        Channel     TEXT,
-        StartTime   DATETIME,
-        EndTime     DATETIME
-    )
-    """)
-    db.execute("""
-    CREATE TABLE IF NOT EXISTS TwitchClips(
-        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
-        ClipLink    TEXT,
-        Channel     TEXT,
-        StartTime   DATETIME,
-        EndTime     DATETIME
-    )
-    """)
-    db.commit()
-
-def insert_msg(db, it):
-
-    channel, user_id, msg_id, time, msg = it
-    if len(msg) == 0:
-        return
-    db.execute("""
-        INSERT INTO TwitchMessages
-            (
+def import_settings(db: Connection, settings_path: str) -> int:
+    with open(settings_path, "r") as f:
+        settings = load(f)
+
+    channel = settings["channel"]
+    epoch = datetime.fromtimestamp(0, ZoneInfo("UTC"))
+    with db:
+        db.executemany("""
+            INSERT INTO TwitchBanned(
                 Channel,
                 User,
-                Message,
-                MessageTime
-            )
-        VALUES (?, ?, ?, ?)
-            """,
-            (
-                channel,
-                sha384(user_id.encode()).hexdigest(),
-                msg,
-                datetime.fromisoformat(time)
-            )
-        )
-
-with connect(f"{argv[1].split('.')[0]}.sqlite") as db:
+                BanTime
+            ) VALUES (?, ?, ?)
+        """, ((channel, user_hash(f"{x}"), epoch) for x in settings["ignored_users"]))
+
+    return len(settings["ignored_users"])
+
+def __main(argv: Namespace) -> None:
+    target = argv.output or f"{path.splitext(argv.csv)[0]}.sqlite"
+    db = connect(target)
+
+    # Nothing here is worth protecting mid-import: if it dies, start over
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("PRAGMA temp_store = MEMORY")
+    db.execute(f"PRAGMA cache_size = -{argv.cache_mb * 1024}")
+
     create_tables(db)
-    with open(argv[1], "r") as f:
-        csv = reader(f) 
-        for row in csv:
-            insert_msg(db, row)
+    drop_indexes(db)
+    drop_search(db)
 
-    with open(argv[2], "r") as f:
-        settings = load(f)
-        bans = settings["ignored_users"]
-        channel = settings["channel"]
-        for ban in bans:
-            db.execute("""
-                INSERT INTO TwitchBanned(
-                    Channel,
-                    User,
-                    BanTime
-                ) VALUES (?, ?, ?)
-            """, (channel, sha384(f"{ban}".encode()).hexdigest(), datetime.fromtimestamp(0, ZoneInfo("UTC"))))
+    start = perf_counter()
+    total = import_messages(db, argv.csv, argv.chunk)
+    bans = import_settings(db, argv.settings) if argv.settings else 0
+    print(f"imported {total:,} messages and {bans:,} ignored users in {perf_counter() - start:.1f}s")
+
+    start = perf_counter()
+    create_indexes(db)
+    create_search(db, MessageCodec(db).decode)
+    db.execute("ANALYZE")
+    print(f"built indexes in {perf_counter() - start:.1f}s")
+
+    db.execute("PRAGMA journal_mode = DELETE")
+    db.execute("PRAGMA synchronous = FULL")
+
+    if argv.snapshots:
+        build_snapshots(db)
 
+    db.close()
 
+if __name__ == "__main__":
+    arg = ArgumentParser(description="bulk import chat logs into the bot's database")
+    arg.add_argument("csv", help="chat log: channel, user id, message id, time, message")
+    arg.add_argument("settings", nargs="?", help="bot settings json with `channel` and `ignored_users`")
+    arg.add_argument("--output", "-o", help="database to import into (default: <csv name>.sqlite)")
+    arg.add_argument("--chunk", type=int, default=50_000, help="rows per insert batch")
+    arg.add_argument("--cache-mb", type=int, default=256, help="sqlite page cache during the import")
+    arg.add_argument("--snapshots", action="store_true",
+                     help="also prebuild per-channel model snapshots so the bot starts warm")
+    __main(arg.parse_args())
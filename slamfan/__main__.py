@@ -1,6 +1,9 @@
 #!/usr/bin/python3
 from argparse import ArgumentParser, Namespace
+from contextlib import AsyncExitStack
 from enum import Enum
+from time import perf_counter
+from typing import Any, Dict, Tuple
 import asyncio
 
 
@@ -9,9 +12,18 @@ def __add_bot_args(parser: ArgumentParser) -> ArgumentParser:
     parser.add_argument("--channel", "-c",
                         dest="channels",
                         action="append", type=str,
-                        required=True,
                         help="channels to watch")
 
+    parser.add_argument("--channels-file",
+                        action="store", type=str, dest='channels_file',
+                        default=getenv("CHANNELS_FILE"),
+                        help='file listing more channels to watch, one per line; re-read on SIGHUP with --workers')
+
+    parser.add_argument("--workers", "-w",
+                        action="store", type=int, dest='workers',
+                        default=getenv("WORKERS", 1),
+                        help='split the channels across this many processes, by consistent hashing')
+
     parser.add_argument("--robo-access-token", "-rat",
                         action="store", type=str, dest='robo_token',
                         required=getenv("ROBO_TOKEN") is None, 
@@ -36,51 +48,282 @@ def __add_bot_args(parser: ArgumentParser) -> ArgumentParser:
                         default=getenv("SUPER_USER"),
                         help='the super user account for the bots')
 
+    parser.add_argument("--tmi-url",
+                        action="store", type=str, dest='tmi_url',
+                        default=getenv("TMI_URL"),
+                        help='chat websocket to connect to instead of twitch (e.g. a load-test server)')
+
+    parser.add_argument("--helix-url",
+                        action="store", type=str, dest='helix_url',
+                        default=getenv("HELIX_URL"),
+                        help='API server to use instead of twitch (e.g. a load-test server)')
+
+    parser.add_argument("--metrics-port", "-mp",
+                        action="store", type=int, dest='metrics_port',
+                        default=getenv("METRICS_PORT"),
+                        help='port to serve prometheus metrics on; disabled if unset')
+
+    parser.add_argument("--metrics-host", "-mh",
+                        action="store", type=str, dest='metrics_host',
+                        default=getenv("METRICS_HOST", "127.0.0.1"),
+                        help='address to serve prometheus metrics on')
+
+    parser.add_argument("--archive-after-days",
+                        action="store", type=float, dest='archive_after_days',
+                        default=getenv("ARCHIVE_AFTER_DAYS"),
+                        help='archive messages older than this many days, once a day; disabled if unset')
+
+    parser.add_argument("--archive-dir",
+                        action="store", type=str, dest='archive_dir',
+                        default=getenv("ARCHIVE_DIR", "archive"),
+                        help='directory to write archived messages to')
+
+    parser.add_argument("--channel-dir",
+                        action="store", type=str, dest='channel_dir',
+                        default=getenv("CHANNEL_DIR"),
+                        help="keep each channel's messages in its own database in this directory; "
+                             "the main database keeps the rest")
+
+    parser.add_argument("--compress-messages",
+                        action="store_true", dest='compress_messages',
+                        default=bool(getenv("COMPRESS_MESSAGES")),
+                        help='store new messages compressed, with a dictionary trained per channel')
+
+    parser.add_argument("--corpus-window-messages",
+                        action="store", type=int, dest='corpus_messages',
+                        default=getenv("CORPUS_WINDOW_MESSAGES"),
+                        help='only model the most recent N messages per channel; unbounded if unset')
+
+    parser.add_argument("--corpus-window-days",
+                        action="store", type=float, dest='corpus_days',
+                        default=getenv("CORPUS_WINDOW_DAYS"),
+                        help='only model messages from the last N days per channel; unbounded if unset')
+
+    parser.add_argument("--corpus-streams",
+                        action="store", type=int, dest='corpus_streams',
+                        default=getenv("CORPUS_STREAMS"),
+                        help='only model messages from the last N streams per channel; unbounded if unset')
+
+    parser.add_argument("--repeat-window",
+                        action="store", type=float, dest='repeat_window',
+                        default=getenv("REPEAT_WINDOW", 300),
+                        help='seconds within which exact repeats are counted rather than saved again; 0 disables')
+
+    parser.add_argument("--repeat-cap",
+                        action="store", type=int, dest='repeat_cap',
+                        default=getenv("REPEAT_CAP"),
+                        help='most copies of one repeated message the model learns from; unbounded if unset')
+
+    parser.add_argument("--ingest-capacity",
+                        action="store", type=int, dest='ingest_capacity',
+                        default=getenv("INGEST_CAPACITY", 50000),
+                        help='most chat messages being ingested at once')
+
+    parser.add_argument("--shed",
+                        action="store", type=str, dest='shed',
+                        choices=("sample", "drop"),
+                        default=getenv("SHED", "sample"),
+                        help='what to do with new messages when ingestion is past 80%% of capacity')
+
+    parser.add_argument("--generator",
+                        action="store", type=str, dest='generator',
+                        choices=["markovify", "numpy"],
+                        default=getenv("GENERATOR", "markovify"),
+                        help='text generator; numpy samples candidate batches much faster')
+
+    parser.add_argument("--candidates",
+                        action="store", type=int, dest='candidates',
+                        default=getenv("CANDIDATES", 20),
+                        help='messages generated per emitted message, the best of which is sent')
+
+    parser.add_argument("--stall-threshold",
+                        action="store", type=float, dest='stall_threshold',
+                        default=getenv("STALL_THRESHOLD", 0.25),
+                        help='seconds the event loop may be blocked before the culprit is logged')
+
+    parser.add_argument("--gc-tuning",
+                        action="store_true", dest='gc_tuning',
+                        default=bool(getenv("GC_TUNING")),
+                        help='freeze loaded corpora out of the garbage collector and collect less often')
+
+    parser.add_argument("--profile-dir",
+                        action="store", type=str, dest='profile_dir',
+                        default=getenv("PROFILE_DIR", "profiles"),
+                        help='where !profile and SIGUSR2 write their results')
+
+    parser.set_defaults(shard=None, shards=1, home=True)
+
     return parser
 
-async def __bot_main(argv: Namespace):
-    from brokers import DatabaseBroker, DashboardBroker
-    from twitch import Admin, Turing, Trivia
-    from twitch import TwitchBot
+async def __enter_concurrently(managers: Dict[str, Tuple[AsyncExitStack, Any]]) -> None:
+    """
+    Enter async context managers all at once, timing each, and register
+    each one's exit on its stack as if they had been entered in order.
+    """
+    from metrics import REGISTRY
+    stages = REGISTRY.get("slamfan_startup_stage_seconds")
+    entered = set()
+
+    async def enter(name: str, manager: Any) -> None:
+        start = perf_counter()
+        await manager.__aenter__()
+        entered.add(name)
+        elapsed = perf_counter() - start
+        stages.labels(name).set(elapsed)
+        print(f"{name}: up in {elapsed:.2f}s")
+
     try:
         async with asyncio.TaskGroup() as tg:
+            for name, (_, manager) in managers.items():
+                tg.create_task(enter(name, manager), name=f"startup.{name}")
+    finally:
+        for name, (stack, manager) in managers.items():
+            if name in entered:
+                stack.push_async_exit(manager.__aexit__)
+
+async def __bot_main(argv: Namespace):
+    from brokers import DatabaseBroker, DashboardBroker, ShedPolicy
+    from twitch import Admin, Turing, Trivia, TriviaSources
+    from twitch import TwitchBot, SendQueue, StreamWatcher
+    from metrics import MetricsServer, LoopWatchdog
+    from metrics.stats import collect as collect_stats, report as stats_report
+    from metrics.profiling import Profiler, ProfileMode
+    from metrics import gc_tuning
+    from functools import partial
+    import signal
+    from turing import GeneratorBackend
+    from datetime import timedelta
+
+    gc_tuning.instrument()
+    if argv.gc_tuning:
+        gc_tuning.tune()
+
+    try:
+        archive_after = timedelta(days=argv.archive_after_days) if argv.archive_after_days else None
+        corpus_age = timedelta(days=argv.corpus_days) if argv.corpus_days else None
+        home = [argv.superuser.lower()] if argv.home else []
+        # a worker only gets its share of each account's limit; channels
+        # are not split, so theirs stay whole
+        sends, per = SendQueue.ACCOUNT_LIMIT
+        account_limit = (max(1, sends // argv.shards), per)
+        # The database opens first, but its corpora load in the background
+        # while the dashboard and both bots connect; each channel's Turing
+        # loop starts once that channel's corpus is ready.
+        async with asyncio.TaskGroup() as tg, \
+                   LoopWatchdog(tg, threshold=argv.stall_threshold) as watchdog, \
+                   MetricsServer(tg, argv.metrics_host, argv.metrics_port), \
+                   DatabaseBroker(tg, argv.database, archive_after=archive_after,
+                                  archive_dir=argv.archive_dir,
+                                  corpus_messages=argv.corpus_messages,
+                                  corpus_age=corpus_age,
+                                  repeat_window=argv.repeat_window,
+                                  repeat_cap=argv.repeat_cap,
+                                  ingest_capacity=argv.ingest_capacity,
+                                  shed=ShedPolicy(argv.shed),
+                                  flavor=GeneratorBackend[argv.generator.upper()],
+                                  gc_freeze=argv.gc_tuning,
+                                  corpus_streams=argv.corpus_streams,
+                                  channel_dir=argv.channel_dir,
+                                  compress=argv.compress_messages,
+                                  channels=home + argv.channels) as dbm, \
+                   SendQueue(tg, account_limit=account_limit) as outbound, \
+                   StreamWatcher(tg, dbm) as streams:
             su = argv.superuser.lower()
-            dbm = DatabaseBroker(tg, argv.database)
-            await dbm.connect()
+            stats = partial(collect_stats, dbm, watchdog)
+
+            # local equivalent of !stats
+            async def dump_stats() -> None:
+                print(stats_report(await stats()), flush=True)
 
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, lambda: tg.create_task(dump_stats(), name="stats"))
+
+            # local equivalent of !profile: the first signal samples for
+            # a minute, a second one ends it early
+            profiler = Profiler(argv.profile_dir)
+
+            async def toggle_profile() -> None:
+                if profiler.running:
+                    profiler.stop()
+                    return
+                path, top = await profiler.run(ProfileMode.SAMPLE, 60.0)
+                print(f"profile: {path}: {top}", flush=True)
+
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR2, lambda: tg.create_task(toggle_profile(), name="profile"))
 
             while True:
-                am = Admin(su)
+                # Survives warm restarts: the dashboard client and the
+                # trivia sources' HTTP sessions. The database broker, and
+                # with it the corpora, survives every restart.
+                async with AsyncExitStack() as process:
+                    dash = DashboardBroker(tg)
+                    sources = TriviaSources()
+                    starting = {"dashboard": (process, dash), "trivia": (process, sources)}
+
+                    while True:
+                        am = Admin(su, stats, profiler)
+
+                        # Turing Bot
+                        ansf: TwitchBot = TwitchBot(argv.turing_token, '!', home + argv.channels,
+                                                    irc_url=argv.tmi_url, api_url=argv.helix_url,
+                                                    outbound=outbound)
+                        ansf.add_cog(am)
+                        ansf.add_cog(Turing(su, dbm, tg, streams, candidates=argv.candidates))
 
-                # Turing Bot
-                ansf: TwitchBot = TwitchBot(argv.turing_token, '!', [su] + argv.channels)
-                ansf.add_cog(am)
-                ansf.add_cog(Turing(su, dbm, tg))
+                        # robo
+                        robo: TwitchBot = TwitchBot(argv.robo_token, '!', argv.channels,
+                                                    irc_url=argv.tmi_url, api_url=argv.helix_url,
+                                                    outbound=outbound)
+                        robo.add_cog(am)
+                        robo.add_cog(Trivia(su, dash, dbm, tg, sources, streams))
 
-                # robo
-                async with DashboardBroker(tg) as dash, Trivia(su, dash, dbm, tg) as trivia:
-                    robo: TwitchBot = TwitchBot(argv.robo_token, '!', argv.channels)
-                    robo.add_cog(am)
-                    robo.add_cog(trivia)
+                        async with AsyncExitStack() as bots:
+                            starting.update(robo=(bots, robo), ansf=(bots, ansf))
+                            await __enter_concurrently(starting)
+                            starting = {}
 
-                    async with robo, ansf:
-                        await am.die_event.wait()
+                            await am.die_event.wait()
 
-                        if am.restart_event.is_set():
-                            continue
+                        if not am.restart_event.is_set():
+                            return
 
-                        return
+                        if am.cold_restart:
+                            break
+
+                        print("warm restart")
+
+                print("cold restart")
+                dbm.reload_banned_words()
 
     except asyncio.CancelledError:
         print("cancelled")
 
 def __main():
     from argparse import ArgumentParser as ap
+    from shard import Supervisor
     arg = ap(description="")
     __add_bot_args(arg)
-    argv = arg.parse_args()
+    argv = Supervisor.worker_argv(arg.parse_args())
+
+    if argv.shard is not None:
+        print(f"shard {argv.shard}: {', '.join(argv.channels) or '(home only)'}")
+        try:
+            asyncio.run(__bot_main(argv))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if not argv.channels and argv.channels_file is None:
+        arg.error("at least one --channel or a --channels-file is required")
 
     print("crtl+c to exit")
+    if argv.workers > 1:
+        Supervisor(argv, argv.workers).run()
+        return
+
+    if argv.channels_file is not None:
+        argv.channels = Supervisor(argv, 1).channels()
     asyncio.run(__bot_main(argv))
 
 if __name__ == "__main__":
@@ -1,2 +1,3 @@
 from .database import DatabaseBroker
-from .dashboard import DashboardBroker
\ No newline at end of file
+from .dashboard import DashboardBroker
+from .ingest import ShedPolicy
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""
+Compressed storage of chat messages.
+
+Chat lines are short and say the same emotes, names and phrases over
+and over, which plain deflate cannot exploit in a line of 40 bytes. So
+each channel gets a preset dictionary (see `zlib.compressobj`) trained
+from its recent messages, and a message is stored as raw deflate against
+it. Dictionaries are versioned rows of `MessageDictionaries`; a row's
+`Codec` is the version it was compressed with (NULL for plain text), so
+retraining never touches what is already stored.
+"""
+import zlib
+from collections import Counter as Tally, deque
+from datetime import datetime, UTC
+from sqlite3 import Connection
+from typing import Any, Deque, Dict, Iterable, List, Sequence, Tuple
+
+from metrics import Counter
+
+_BYTES = Counter("slamfan_message_stored_bytes",
+                 "Bytes of message text saved, as sent ('text') and as stored ('stored')",
+                 ("form",))
+
+# deflate looks back at most 32KB, so a longer dictionary is never read
+DICTIONARY_SIZE = 32 * 1024
+
+# raw deflate: no header or checksum, which would be a quarter of a line
+_WBITS = -15
+
+def train(messages: Iterable[str], size: int = DICTIONARY_SIZE) -> bytes:
+    """
+    A preset dictionary for messages like these: their most common words,
+    and lines repeated whole, by how many bytes they would save. The
+    most valuable go last, where deflate reaches them with the shortest
+    distances.
+    """
+    tally = Tally()
+    lines = Tally()
+    for msg in messages:
+        lines[msg] += 1
+        for word in msg.split():
+            tally[word] += 1
+
+    value = Tally({word + " ": n * len(word) for word, n in tally.items() if n > 1})
+    value.update({line + " ": n * len(line) for line, n in lines.items() if n > 1})
+
+    picked: List[bytes] = []
+    total = 0
+    for piece, _ in value.most_common():
+        encoded = piece.encode()
+        if total + len(encoded) > size:
+            continue
+
+        picked.append(encoded)
+        total += len(encoded)
+        if total > size - 8:
+            break
+
+    picked.reverse()
+    return b"".join(picked)
+
+class MessageCodec(object):
+    """
+    Encodes messages with each channel's newest dictionary, and decodes
+    them with whichever one they were stored with. Dictionaries are read
+    from (and stored to) `db` as they are needed; `decode` may run in
+    other threads for versions passed to `require` first.
+    """
+
+    # training samples kept per channel
+    SAMPLES = 10000
+    # fewest samples worth training on
+    MIN_SAMPLES = 1000
+    # how old a dictionary gets before it is retrained, in seconds
+    RETRAIN_AFTER = 7 * 24 * 60 * 60
+
+    def __init__(self, db: Connection) -> None:
+        self.__db = db
+        # version -> dictionary
+        self.__dictionaries: Dict[int, bytes] = {}
+        # channel -> (version, compressor primed with that dictionary, when it was trained)
+        self.__compressors: Dict[str, Tuple[int, Any, datetime]] = {}
+        self.__samples: Dict[str, Deque[str]] = {}
+        self.__loaded = False
+
+    def __load_latest(self) -> None:
+        if self.__loaded:
+            return
+
+        for version, channel, dictionary, built in self.__db.execute("""
+                SELECT Id, Channel, Dictionary, BuildTime
+                FROM MessageDictionaries
+                WHERE Id IN (SELECT MAX(Id) FROM MessageDictionaries GROUP BY Channel)"""):
+            self.__dictionaries[version] = dictionary
+            self.__prime(channel, version, dictionary, built)
+        self.__loaded = True
+
+    def __prime(self, channel: str, version: int, dictionary: bytes, built: datetime | str) -> None:
+        if isinstance(built, str):
+            built = datetime.fromisoformat(built)
+        if built.tzinfo is None:
+            built = built.replace(tzinfo=UTC)
+
+        compressor = zlib.compressobj(9, zlib.DEFLATED, _WBITS, 9, zlib.Z_DEFAULT_STRATEGY, dictionary)
+        self.__compressors[channel] = (version, compressor, built)
+
+    def require(self, versions: Iterable[int | None], db: Connection | None = None) -> None:
+        """
+        Read the dictionaries for these versions, if they are not yet;
+        through `db` rather than the codec's own connection if given (e.g.
+        in another thread).
+        """
+        db = self.__db if db is None else db
+        missing = {x for x in versions if x is not None and x not in self.__dictionaries}
+        for version in missing:
+            row = db.execute("SELECT Dictionary FROM MessageDictionaries WHERE Id = ?", (version,)).fetchone()
+            if row is None:
+                raise KeyError(f"no message dictionary {version}")
+            self.__dictionaries[version] = row[0]
+
+    def decode(self, message: str | bytes, version: int | None, db: Connection | None = None) -> str:
+        """
+        A stored message as text; its dictionary is read if need be,
+        through `db` if given (see `require`).
+        """
+        if version is None:
+            return message
+
+        dictionary = self.__dictionaries.get(version)
+        if dictionary is None:
+            self.require((version,), db)
+            dictionary = self.__dictionaries[version]
+        return zlib.decompressobj(_WBITS, dictionary).decompress(message).decode()
+
+    def encode(self, channel: str, msg: str) -> Tuple[str | bytes, int | None]:
+        """
+        The message as stored, and the dictionary version it needs; as
+        plain text if the channel has no dictionary yet, or if that is
+        no bigger.
+        """
+        self.__load_latest()
+        self.observe(channel, (msg,))
+
+        text = msg.encode()
+        _BYTES.labels("text").inc(len(text))
+        compressor = self.__compressors.get(channel)
+        if compressor is not None:
+            version, base, _ = compressor
+            c = base.copy()
+            data = c.compress(text) + c.flush()
+            if len(data) < len(text):
+                _BYTES.labels("stored").inc(len(data))
+                return data, version
+
+        _BYTES.labels("stored").inc(len(text))
+        return msg, None
+
+    def observe(self, channel: str, messages: Sequence[str]) -> None:
+        """
+        Keep recent messages of the channel to train its next dictionary.
+        """
+        samples = self.__samples.get(channel)
+        if samples is None:
+            samples = self.__samples[channel] = deque(maxlen=self.SAMPLES)
+        samples.extend(messages[-self.SAMPLES:])
+
+    def due(self) -> List[Tuple[str, List[str]]]:
+        """
+        Channels whose dictionary should be (re)trained, with the samples
+        to train it on.
+        """
+        self.__load_latest()
+        now = datetime.now(UTC)
+        out = []
+        for channel, samples in self.__samples.items():
+            current = self.__compressors.get(channel)
+            if len(samples) < self.MIN_SAMPLES:
+                continue
+            if current is None or (now - current[2]).total_seconds() >= self.RETRAIN_AFTER:
+                out.append((channel, list(samples)))
+        return out
+
+    def add(self, channel: str, dictionary: bytes) -> int:
+        """
+        Store a newly trained dictionary, and encode the channel's
+        messages with it from now on. Returns its version.
+        """
+        built = datetime.now(UTC)
+        with self.__db:
+            version = self.__db.execute("""INSERT INTO MessageDictionaries(
+                                               Channel,
+                                               Dictionary,
+                                               BuildTime
+                                           ) VALUES (?, ?, ?)""", (channel, dictionary, built)).lastrowid
+
+        self.__dictionaries[version] = dictionary
+        self.__prime(channel, version, dictionary, built)
+        return version
+
+def decode_rows(codec: MessageCodec, rows: Iterable[Sequence], words: Iterable[str]) -> List[tuple]:
+    """
+    Rows starting `Message, Codec` as rows starting with the text,
+    dropping compressed ones containing any of `words` (the banned ones,
+    which sql can only look for in plain text).
+    """
+    words = [x.lower() for x in words]
+    out = []
+    for row in rows:
+        if row[1] is None:
+            out.append((row[0], *row[2:]))
+            continue
+
+        text = codec.decode(row[0], row[1])
+        lowered = text.lower()
+        if not any(w in lowered for w in words):
+            out.append((text, *row[2:]))
+    return out
@@ -13,6 +13,8 @@ class DashboardBroker(Client):
         TODO
         """
         self.__player_states = {}
+        # player -> condition notified whenever their state changes
+        self.__changes: Dict[str, asyncio.Condition] = {}
         self.__task_group = tg
         super().__init__()
 
@@ -26,6 +28,25 @@ class DashboardBroker(Client):
         if packet.status != self.__player_states[packet.name]:
             self.__player_states[packet.name] = packet.status
 
+            changed = self.__changes.get(packet.name)
+            if changed is not None:
+                async with changed:
+                    changed.notify_all()
+
+    async def wait_until_idle(self, player: str, timeout: float | None = None) -> bool:
+        """
+        Wait for `player` to be idle (see `player_is_idle`), woken by the
+        dashboard's own state updates rather than polling. Returns at once
+        if they already are; `False` if `timeout` seconds pass first.
+        """
+        changed = self.__changes.setdefault(player, asyncio.Condition())
+        async with changed:
+            try:
+                await asyncio.wait_for(changed.wait_for(lambda: self.player_is_idle(player)), timeout)
+            except TimeoutError:
+                return False
+        return True
+
     def player_is_idle(self, player: str) -> bool:
         match self.__player_states.get(player, -1):
             case PlayerStatusType.UNDEFINED \
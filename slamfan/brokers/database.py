@@ -1,11 +1,59 @@
 import asyncio
 from hashlib import sha384
+from os import path, listdir, makedirs
+from sqlite3 import Connection
 from uuid import UUID
-from datetime import datetime, timedelta
-from typing import Dict, Awaitable, Any
-from turing import Corpus
+from datetime import datetime, timedelta, UTC
+from typing import Dict, Awaitable, Any, Iterable, List, Tuple
+from time import perf_counter
+from functools import partial, lru_cache
+from zlib import error as ZlibError
+from turing import Corpus, GeneratorBackend
+from metrics import Counter, Gauge, Histogram
+from metrics import gc_tuning
 
-from aiorwlock import RWLock
+from .schema import create_tables, create_indexes, create_search, create_channel_tables, attach_core, \
+                    mirror, repeat_weight, search_phrase, \
+                    CORPUS_QUERY, CORPUS_STREAMS_QUERY, CORPUS_WINDOW_QUERY, SNAPSHOT_QUERY, SEARCH_QUERY, SEARCH_SCAN_QUERY
+from .repeats import RepeatTable
+from .codec import MessageCodec, decode_rows, train
+from .ingest import IngestPipeline, PendingMessage, ShedPolicy
+
+
+_INGESTED = Counter("slamfan_ingest_messages",
+                    "Chat messages received for ingestion",
+                    ("channel",))
+_COLLAPSED = Counter("slamfan_ingest_collapsed_messages",
+                     "Repeated messages counted onto an earlier row instead of saved",
+                     ("channel",))
+_PUBLISH_LATENCY = Histogram("slamfan_model_publish_seconds",
+                             "Time taken to build and publish a new model version")
+_PUBLISH_BATCH = Histogram("slamfan_model_publish_batch_messages",
+                           "Messages added per published model version",
+                           buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+_DB_WRITE_LATENCY = Histogram("slamfan_db_write_seconds",
+                              "Time taken to write and commit a batch of messages")
+_DB_WRITE_BATCH = Histogram("slamfan_db_write_batch_rows",
+                            "Rows written per database commit",
+                            buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+_STARTUP = Gauge("slamfan_startup_stage_seconds",
+                 "Time taken by each startup stage (corpus.<channel> per corpus)",
+                 ("stage",))
+
+# corpora loaded after startup (channels joined) are frozen together, a
+# while after the first of them, rather than one full collection each
+LATE_FREEZE_DELAY = 60
+
+@lru_cache(maxsize=1 << 16)
+def _user_hash(uid: int) -> str:
+    # hashed for every message, and the same chatters keep talking
+    return sha384(str(uid).encode()).hexdigest()
+
+def _message_time(value: datetime | str | None) -> datetime | None:
+    # DATETIME has no registered converter, so these mostly come back as text
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
 
 class DatabaseBroker(object):
     """
@@ -13,32 +61,147 @@ class DatabaseBroker(object):
     a cache of corpus objects for less queries.
     """
 
-    def __init__(self, tg, db: str = ":memory:", save_delay=30, **kwargs) -> None:
+    def __init__(self, tg, db: str = ":memory:", save_delay=30,
+                 archive_after: timedelta | None = None, archive_dir: str = "archive",
+                 compact_interval: float = 24 * 60 * 60,
+                 corpus_messages: int | None = None, corpus_age: timedelta | None = None,
+                 repeat_window: float = 300, repeat_cap: int | None = None,
+                 flavor: GeneratorBackend = GeneratorBackend.MARKOVIFY,
+                 publish_interval: float = 1.0,
+                 ingest_capacity: int = 50000, shed: ShedPolicy = ShedPolicy.SAMPLE,
+                 gc_freeze: bool = False, corpus_streams: int | None = None,
+                 channel_dir: str | None = None, compress: bool = False,
+                 channels: Iterable[str] | None = None, **kwargs) -> None:
         """
-        TODO
+        :paramref: `tg`: task group to run background work in
+        :paramref: `db`: path of the sqlite database
+        :paramref: `save_delay`: seconds a message waits (and can be
+                                 moderated) before it is saved
+        :paramref: `archive_after`: if set, messages older than this are
+                                    periodically moved to `archive_dir`
+        :paramref: `compact_interval`: seconds between archival runs
+        :paramref: `corpus_messages`: if set, each channel's model only
+                                      keeps this many recent messages
+        :paramref: `corpus_age`: if set, each channel's model only keeps
+                                 messages younger than this
+        :paramref: `repeat_window`: seconds within which an exact repeat is
+                                    counted onto the first copy's row rather
+                                    than saved again; 0 to disable
+        :paramref: `repeat_cap`: most copies of one message the model counts
+        :paramref: `flavor`: the text generator each channel's corpus uses
+        :paramref: `publish_interval`: seconds saved messages are batched
+                                       for before a new model version is
+                                       published
+        :paramref: `ingest_capacity`: most messages being ingested at once
+                                      (mostly those waiting out `save_delay`)
+        :paramref: `shed`: what to do with new messages past 80% of that
+        :paramref: `gc_freeze`: freeze the corpora out of the garbage
+                                collector's sight once loaded, at startup
+                                or later (see `metrics.gc_tuning`)
+        :paramref: `corpus_streams`: if set, each channel's model is built
+                                     from its last this many streams (or
+                                     everything, before one is recorded)
+        :paramref: `channel_dir`: if set, each channel's messages are kept
+                                  in `<channel_dir>/<channel>.sqlite`, open
+                                  while the channel is, and `db` (a file)
+                                  holds the rest; existing messages move
+                                  over as each channel is first opened
+        :paramref: `compress`: store new messages compressed, with a
+                               dictionary per channel trained from its
+                               recent messages (see `codec`)
+        :paramref: `channels`: if set, only these channels' corpora load
+                               at startup (a shard's own), rather than
+                               every channel with messages; any other
+                               loads when first asked for (`init_corpus`)
         """
         self.__db_str = db
         self.__save_delay = save_delay
-        self.__cache_lock = RWLock()
+        # channel -> row id -> [message, time, weight] waiting to be
+        # published into its model; a row's repeats fold into its weight
+        self.__batches: Dict[str, Dict[int, list]] = {}
+        # channel -> task publishing its batch
+        self.__publishing: Dict[str, asyncio.Task] = {}
         self.__task_group = tg
+        self.__archive_after = archive_after
+        self.__archive_dir = archive_dir
+        self.__compact_interval = compact_interval
+        self.__corpus_messages = corpus_messages
+        self.__corpus_age = corpus_age
+        self.__corpus_streams = corpus_streams
+        # channel -> its TwitchStreams session, while live
+        self.__live_streams: Dict[str, int] = {}
+        self.__channel_dir = channel_dir
+        # channel -> connection to its own database, while open
+        self.__channels: Dict[str, Connection] = {}
+        # channel -> its database being opened, in the executor
+        self.__opening: Dict[str, asyncio.Future] = {}
+        self.__compress = compress
+        self.__owned = None if channels is None else sorted({x.lower() for x in channels})
+        self.__repeats = RepeatTable(repeat_window)
+        self.__repeat_cap = repeat_cap
+        self.__flavor = flavor
+        self.__publish_interval = publish_interval
+        self.__gc_freeze = gc_freeze
+        # set once the corpora there at startup are loaded
+        self.__started = False
+        # the pending freeze of corpora loaded since, if any
+        self.__freezing: asyncio.Task | None = None
+        self.__background: list[asyncio.Task] = []
+        # channel -> task loading its corpus; done once the corpus is ready
+        self.__loading: Dict[str, asyncio.Task] = {}
+        # corpora are built in executor threads; a couple at a time is
+        # plenty under the GIL
+        self.__load_slots = asyncio.Semaphore(2)
 
-    def __aenter__(self) -> 'DatabaseBroker':
-        pass
+        # cleared while maintenance owns the database file
+        self.__writable = asyncio.Event()
+        self.__writable.set()
 
-    def __aexit__(self, *e) -> None:
-        pass
+        self.__ingest = IngestPipeline(tg, self.__filter, self.__persist, delay=save_delay,
+                                       capacity=ingest_capacity, policy=shed)
 
-    def __new_task(self, fn: Awaitable, name: str):
-        self.__task_group.create_task(fn, name=f"db_{name}")
+    async def __aenter__(self) -> 'DatabaseBroker':
+        await self.connect()
+        return self
 
-    async def __add_message(self, channel: str, uid: int, msg: str, msg_time: datetime):
-        try:
-            add_to_db = True
-            delay = 0
-            uid_hash = sha384(str(uid).encode()).hexdigest()
-            while delay < self.__save_delay:
-                await asyncio.sleep(1)
-                delay += 1
+    async def __aexit__(self, *e) -> None:
+        await self.__ingest.__aexit__(*e)
+        for task in self.__background + list(self.__loading.values()):
+            task.cancel()
+
+        for channel in list(self.__channels):
+            self.detach(channel)
+
+    def __new_task(self, fn: Awaitable, name: str) -> asyncio.Task:
+        return self.__task_group.create_task(fn, name=f"db_{name}")
+
+    def __banned(self, msg: str) -> bool:
+        # as `LIKE` and the full-text index match them, ignoring case
+        msg = msg.lower()
+        return any(word in msg for word in self.__banned_words)
+
+    def __filter(self, pending: PendingMessage) -> None:
+        pending.uid_hash = _user_hash(pending.uid)
+        # still saved, but never learned from
+        pending.train = not self.__banned(pending.msg)
+
+    async def __persist(self, batch: List[PendingMessage]) -> None:
+        # Opening may yield to compaction, which owns the files until it
+        # is done; wait it out again until both hold at once. The rest
+        # runs without yielding, so a batch is written as one.
+        while True:
+            await self.__writable.wait()
+            await self.__open(x.channel for x in batch)
+            if self.__writable.is_set():
+                break
+
+        start = perf_counter()
+        staged = []
+        # connection -> compressed messages to mirror for search
+        touched: Dict[Connection, List[Tuple[int, str]]] = {}
+        for pending in batch:
+            channel, msg, msg_time = pending.channel, pending.msg, pending.msg_time
+            add_to_db = pending.train
 
             query = self.__conn.execute("""SELECT User
                                            FROM TwitchBanned
@@ -50,64 +213,135 @@ class DatabaseBroker(object):
                                               (UnbanTime == NULL OR UnbanTime > ?)
                                                 AND
                                               BanTime < ?
-                                            """, (channel, uid_hash, msg_time, msg_time)).fetchall()
+                                            """, (channel, pending.uid_hash, msg_time, msg_time)).fetchall()
             if len(query) > 0:
                 add_to_db = False
 
-            if add_to_db:
-                query = self.__conn.execute("""SELECT Word FROM TwitchBannedWords""").fetchall()
-                for word in query:
-                    if word in msg:
-                        add_to_db = False
-
-            self.__conn.execute("""INSERT INTO TwitchMessages(
-                                            Channel,
-                                            User,
-                                            Message,
-                                            MessageTime
-                                        ) VALUES (?, ?, ?, ?)
-                                    """, (channel, uid_hash, msg, msg_time))
-            self.__conn.commit()
-
-            if add_to_db:
-                async with self.__cache_lock.writer_lock:
-                    self.__datasets[channel].add(msg)
+            # Only messages that make it into the corpus are collapsed; a
+            # copy from anyone but the first sender is counted as theirs
+            repeat = self.__repeats.repeat(channel, msg) if add_to_db else None
+
+            messages = self.__messages(channel)
+            touched.setdefault(messages, [])
+            if repeat is not None:
+                row_id = repeat[0]
+                messages.execute("UPDATE TwitchMessages SET Repeats = Repeats + 1 WHERE Id = ?", (row_id,))
+                if pending.uid_hash != repeat[3]:
+                    messages.execute("""INSERT INTO TwitchMessageRepeats(Message, User, Repeats) VALUES (?, ?, 1)
+                                        ON CONFLICT(Message, User) DO UPDATE SET Repeats = Repeats + 1
+                                     """, (row_id, pending.uid_hash))
+                _COLLAPSED.labels(channel).inc()
+            else:
+                stored, version = self.__codec.encode(channel, msg) if self.__compress else (msg, None)
+                cursor = messages.execute("""INSERT INTO TwitchMessages(
+                                                Channel,
+                                                User,
+                                                Message,
+                                                Codec,
+                                                MessageTime,
+                                                Stream
+                                            ) VALUES (?, ?, ?, ?, ?, ?)
+                                        """, (channel, pending.uid_hash, stored, version, msg_time,
+                                              self.__live_streams.get(channel)))
+                row_id = cursor.lastrowid
+                if version is not None and self.__searchable:
+                    touched[messages].append((row_id, msg))
+                if add_to_db:
+                    self.__repeats.record(channel, pending.uid_hash, msg, row_id)
+
+            # past the cap a repeat is only counted, not learned from
+            if add_to_db and (repeat is None or self.__repeat_cap is None or repeat[1] <= self.__repeat_cap):
+                staged.append((channel, row_id, msg, msg_time))
+
+        for messages, compressed in touched.items():
+            if len(compressed) > 0:
+                mirror(messages, compressed)
+            messages.commit()
+        _DB_WRITE_LATENCY.observe(perf_counter() - start)
+        _DB_WRITE_BATCH.observe(len(batch))
 
+        for x in staged:
+            self.__stage(*x)
+
+    def __stage(self, channel: str, row_id: int, msg: str, msg_time: datetime) -> None:
+        batch = self.__batches.get(channel)
+        if batch is None:
+            batch = self.__batches[channel] = {}
+            self.__publishing[channel] = self.__new_task(self.__publish(channel), f"publish.{channel}")
+
+        # repeats of a row staged in the same batch become one weighted add
+        entry = batch.get(row_id)
+        if entry is None:
+            batch[row_id] = [msg, msg_time, 1]
+        else:
+            entry[2] += 1
+
+    async def __publish(self, channel: str) -> None:
+        # Each model version is copy-on-write, so build one per batch
+        # rather than per message. Generation keeps using the version it
+        # started with; nothing here waits for it.
+        try:
+            await asyncio.sleep(self.__publish_interval)
+            await self.corpus_ready(channel)
         except asyncio.CancelledError:
-            return
+            pass
+        finally:
+            # words banned since these were filtered
+            del self.__publishing[channel]
+            batch = [x for x in self.__batches.pop(channel).values() if not self.__banned(x[0])]
+            if len(batch) == 0 or channel not in self.__datasets:
+                # read by the corpus load, or shut down mid-load
+                return
+
+            start = perf_counter()
+            self.__datasets[channel].extend((x[0] for x in batch), (x[1] for x in batch), (x[2] for x in batch))
+            _PUBLISH_LATENCY.observe(perf_counter() - start)
+            _PUBLISH_BATCH.observe(len(batch))
 
     async def add_twitch_message(self, channel: str, uid: int, msg: str, msg_id: UUID, msg_time: datetime) -> None:
-        self.__task_group.create_task(self.__add_message(channel, uid, msg, msg_time),
-                                      name=f"twitch.{channel}.{uid}.{msg_id}")
+        _INGESTED.labels(channel).inc()
+        await self.__ingest.submit(channel, uid, msg, msg_id, msg_time)
+
+    async def flush(self) -> None:
+        """
+        Wait until every message handed in so far has been saved (or
+        dropped), and is in its channel's model.
+        """
+        await self.__ingest.drain()
+        while len(self.__publishing) > 0:
+            await asyncio.wait(list(self.__publishing.values()))
 
     async def twitch_remove_message(self, channel: str, msg_id: UUID):
-        map(lambda x: x.cancel(), filter(lambda x: f"twitch.{channel}" in x.get_name() and f"{msg_id}" in x.get_name(), asyncio.all_tasks()))
+        self.__ingest.cancel(channel, msg_id=msg_id)
 
     async def twitch_ban(self, channel: str, uid: int, timestamp: datetime):
+        await self.__writable.wait()
         self.__conn.execute("""
                 INSERT INTO TwitchBanned(
                     Channel,
                     User,
                     BanTime
-                ) VALUES (?, ?, ?)""", (channel, sha384(str(uid).encode()).hexdigest(), timestamp))
+                ) VALUES (?, ?, ?)""", (channel, _user_hash(uid), timestamp))
 
         self.__conn.commit()
 
-        map(lambda x: x.cancel(), filter(lambda x: x.get_name().startswith(f"twitch.{channel}.{uid}"), asyncio.all_tasks()))
+        self.__ingest.cancel(channel, uid=uid)
 
     async def twitch_timeout(self, channel: str, uid: int, timestamp: datetime, duration: int):
+        await self.__writable.wait()
         self.__conn.execute("""INSERT INTO TwitchBanned(
                                     Channel,
                                     User,
                                     BanTime,
                                     UnbanTime
                                 ) VALUES (?, ?, ?, ?)
-                                """, (channel, sha384(str(uid).encode()).hexdigest(), timestamp, timestamp + timedelta(seconds=duration)))
+                                """, (channel, _user_hash(uid), timestamp, timestamp + timedelta(seconds=duration)))
         self.__conn.commit()
 
-        map(lambda x: x.cancel(), filter(lambda x: x.get_name().startswith(f"twitch.{channel}.{uid}"), asyncio.all_tasks()))
+        self.__ingest.cancel(channel, uid=uid)
 
     async def twitch_unban(self, channel: str, uid: int, timestamp: datetime):
+        await self.__writable.wait()
         self.__conn.execute("""UPDATE TwitchBanned SET
                                     UnbanTime = ?
                                 WHERE (
@@ -115,17 +349,56 @@ class DatabaseBroker(object):
                                     User = ?,
                                     UnbanTime = NULL
                                 )
-                                """, (timestamp, channel, sha384(str(uid).encode()).hexdigest()))
+                                """, (timestamp, channel, _user_hash(uid)))
+        self.__conn.commit()
+
+    async def stream_started(self, channel: str, twitch_id: str, started: datetime) -> int:
+        """
+        Record that a channel is live, continuing the session if this is
+        a stream already recorded (e.g. before a restart). Any other
+        session of the channel still open (one a previous run never saw
+        end) is closed. Messages saved from now on are tagged with the
+        session. Returns its id.
+        """
+        await self.__writable.wait()
+        self.__conn.execute("""UPDATE TwitchStreams SET EndTime = ?
+                               WHERE Channel = ? AND EndTime IS NULL AND TwitchId IS NOT ?""",
+                            (started, channel, twitch_id))
+        row = self.__conn.execute("SELECT Id FROM TwitchStreams WHERE Channel = ? AND TwitchId = ?",
+                                  (channel, twitch_id)).fetchone()
+        if row is not None:
+            session = row[0]
+            self.__conn.execute("UPDATE TwitchStreams SET EndTime = NULL WHERE Id = ?", (session,))
+        else:
+            session = self.__conn.execute("""INSERT INTO TwitchStreams(
+                                                 Channel,
+                                                 TwitchId,
+                                                 StartTime
+                                             ) VALUES (?, ?, ?)""", (channel, twitch_id, started)).lastrowid
         self.__conn.commit()
 
+        self.__live_streams[channel] = session
+        return session
+
+    async def stream_ended(self, channel: str, ended: datetime) -> None:
+        """
+        Record that a channel is offline, closing any open session.
+        """
+        await self.__writable.wait()
+        self.__conn.execute("UPDATE TwitchStreams SET EndTime = ? WHERE Channel = ? AND EndTime IS NULL",
+                            (ended, channel))
+        self.__conn.commit()
+        self.__live_streams.pop(channel, None)
+
     async def increment_trivia_score(self, uid: int, score: int) -> None:
+        await self.__writable.wait()
         self.__conn.execute("""
             INSERT OR IGNORE INTO TriviaLeaderboard(
                 User,
                 Score,
                 CorrectQuestions
             ) VALUES (?, 0, 0)
-        """, (sha384(str(uid).encode()).hexdigest(),))
+        """, (_user_hash(uid),))
         self.__conn.execute("""
             UPDATE TriviaLeaderboard SET
                 Score = Score + ?,
@@ -133,7 +406,7 @@ class DatabaseBroker(object):
             WHERE (
                 User = ?
             )
-        """, (score, sha384(str(uid).encode()).hexdigest()))
+        """, (score, _user_hash(uid)))
         self.__conn.commit()
 
     async def get_trivia_stats(self, uid: int) -> tuple[Any, Any, Any]:
@@ -151,92 +424,453 @@ class DatabaseBroker(object):
                 )
             WHERE
                 User = ?
-        """, (sha384(str(uid).encode()).hexdigest(),)).fetchone()
+        """, (_user_hash(uid),)).fetchone()
 
     async def connect(self) -> None:
         from sqlite3 import connect
         from sqlite3 import PARSE_DECLTYPES
 
-        self.__conn = connect(self.__db_str, detect_types=PARSE_DECLTYPES)
+        start = perf_counter()
+        self.__conn = connect(self.__db_str, detect_types=PARSE_DECLTYPES, timeout=30)
+        if self.__db_str != ":memory:":
+            # Corpora are read on connections of their own while messages
+            # are written (as are other workers'); in WAL mode neither
+            # blocks the other
+            self.__conn.execute("PRAGMA journal_mode = WAL")
+            self.__conn.execute("PRAGMA synchronous = NORMAL")
 
-        self.__conn.execute("""
-            CREATE TABLE IF NOT EXISTS TwitchMessages(
-                Id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                Channel     TEXT,
-                User        TEXT,
-                Message     TEXT,
-                MessageTime DATETIME
-            )""")
-        self.__conn.execute("""
-            CREATE TABLE IF NOT EXISTS TwitchBannedWords(
-                Id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                Word        TEXT,
-                AddTime     DATETIME
-            )""")
-        self.__conn.execute("""
-            CREATE TABLE IF NOT EXISTS TwitchBanned(
-                Id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                Channel     TEXT,
-                User        TEXT,
-                BanTime     DATETIME,
-                UnbanTime   DATETIME
-            )""")
-        self.__conn.execute("""
-            CREATE TABLE IF NOT EXISTS TwitchStreams(
-                Id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                VODURL      TEXT,
-                Channel     TEXT,
-                StartTime   DATETIME,
-                EndTime     DATETIME
-            )
-            """)
-        self.__conn.execute("""
-            CREATE TABLE IF NOT EXISTS TwitchClips(
-                Id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                ClipLink    TEXT,
-                Channel     TEXT,
-                StartTime   DATETIME,
-                EndTime     DATETIME
-            )
-            """)
-        self.__conn.execute("""
-            CREATE TABLE IF NOT EXISTS TriviaLeaderboard(
-                Id               INTEGER PRIMARY KEY AUTOINCREMENT,
-                User             TEXT UNIQUE,
-                Score            INTEGER,
-                CorrectQuestions INTEGER
-            )
-        """)
-        self.__conn.commit()
+        create_tables(self.__conn)
+        create_indexes(self.__conn)
+        self.__codec = MessageCodec(self.__conn)
+        self.__searchable = create_search(self.__conn, self.__codec.decode)
 
-        # Load messages into memory
+        self.reload_banned_words()
         self.__datasets: Dict[str, Corpus] = {}
-        query = self.__conn.execute("SELECT DISTINCT Channel FROM TwitchMessages").fetchall()
-        for row in query:
-            messages = self.__conn.execute("""
-                SELECT Message
-                FROM TwitchMessages
-                WHERE Channel = ?
-                  AND
-                User NOT IN (SELECT User FROM TwitchBanned WHERE UnbanTime < ?)
-                  AND
-                NOT EXISTS ( SELECT Word FROM TwitchBannedWords WHERE Message LIKE '%' || Word || '%' )
-            """, (row[0], datetime.now())).fetchall()
-            async with self.__cache_lock.writer_lock:
-                if row[0] in self.__datasets:
-                    return
-
-                self.__datasets[row[0]] = Corpus([x[0] for x in messages])
+        self.__snapshots = {} if self.__windowed or self.__corpus_streams is not None else \
+                           {row[0]: row[1:] for row in self.__conn.execute(SNAPSHOT_QUERY)
+                            if self.__owned is None or row[0] in self.__owned}
+        _STARTUP.labels("database").set(perf_counter() - start)
 
-    async def init_corpus(self, channel: str) -> None:
-        async with self.__cache_lock.writer_lock:
-            if channel in self.__datasets:
+        # Corpora load in the background: chat can connect meanwhile, and
+        # each channel's generation starts once its own corpus is ready
+        # (see `corpus_ready`). Any channel still in the core database
+        # is moved to its own as it loads.
+        if self.__channel_dir is not None:
+            makedirs(self.__channel_dir, exist_ok=True)
+
+        if self.__owned is not None:
+            channels = self.__owned
+        else:
+            channels = [row[0] for row in self.__conn.execute("SELECT DISTINCT Channel FROM TwitchMessages")]
+            if self.__channel_dir is not None:
+                channels = sorted(set(channels).union(self.__channel_files()))
+
+        for channel in channels:
+            self.__load(channel)
+        self.__background.append(self.__new_task(self.__loaded_main(start), "loaded"))
+
+        if self.__windowed and self.__corpus_age is not None:
+            self.__background.append(self.__new_task(self.__expiry_main(), "corpus_expiry"))
+
+        if self.__archive_after is not None and self.__db_str != ":memory:":
+            self.__background.append(self.__new_task(self.__compaction_main(), "compaction"))
+
+        if self.__compress:
+            self.__background.append(self.__new_task(self.__train_main(), "train_codec"))
+
+        await self.__ingest.__aenter__()
+
+    def __channel_files(self) -> Dict[str, str]:
+        # channel -> path of its own database
+        return {path.splitext(x)[0]: path.join(self.__channel_dir, x)
+                for x in listdir(self.__channel_dir) if x.endswith(".sqlite")}
+
+    def __messages(self, channel: str) -> Connection:
+        """
+        The connection holding the channel's messages: the core one, or
+        with `channel_dir`, the channel's own (see `__open`).
+        """
+        return self.__conn if self.__channel_dir is None else self.__channels[channel]
+
+    async def __open(self, channels: Iterable[str]) -> None:
+        """
+        With `channel_dir`, open the channels' own databases if they are
+        not yet. Each is set up in the executor, as moving a channel's
+        messages over and indexing them can take a while the first time.
+        All are open once this returns.
+        """
+        if self.__channel_dir is None:
+            return
+
+        channels = list(channels)
+        while True:
+            missing = [x for x in channels if x not in self.__channels]
+            if len(missing) == 0:
                 return
 
-            q2 = self.__conn.execute("SELECT Message FROM TwitchMessages WHERE Channel = ?", (channel,)).fetchall()
-            async with self.__cache_lock.writer_lock:
-                self.__datasets[channel] = Corpus([x[0] for x in q2])
+            channel = missing[0]
+            opening = self.__opening.get(channel)
+            if opening is None:
+                opening = self.__opening[channel] = asyncio.get_running_loop().run_in_executor(
+                    None, self.__open_file, channel)
+                # registered before any caller resumes
+                opening.add_done_callback(partial(self.__opened, channel))
+            await asyncio.shield(opening)
+
+    def __open_file(self, channel: str) -> Connection:
+        from sqlite3 import connect
+        from sqlite3 import PARSE_DECLTYPES
+
+        # made here, used on the loop
+        conn = connect(path.join(self.__channel_dir, f"{channel}.sqlite"), detect_types=PARSE_DECLTYPES,
+                       timeout=30, check_same_thread=False)
+        # before the core is attached, so it only applies to this file
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+
+        attach_core(conn, self.__db_str)
+        create_channel_tables(conn, channel, partial(self.__codec.decode, db=conn))
+        return conn
+
+    def __opened(self, channel: str, opening: asyncio.Future) -> None:
+        del self.__opening[channel]
+        if not opening.cancelled() and opening.exception() is None:
+            self.__channels[channel] = opening.result()
+
+    def detach(self, channel: str) -> None:
+        """
+        Close the channel's own database, e.g. once it has been left. It
+        is reopened if its messages are needed again; the corpus stays.
+        """
+        conn = self.__channels.pop(channel, None)
+        if conn is not None:
+            conn.close()
+
+    def reload_banned_words(self) -> None:
+        """
+        Re-read the banned words, which are cached (lowercased) for the
+        life of the broker (they only change by editing the database).
+        """
+        self.__banned_words: Tuple[str, ...] = tuple(
+            x[0].lower() for x in self.__conn.execute("SELECT Word FROM TwitchBannedWords") if x[0])
+
+    async def ban_word(self, word: str) -> int:
+        """
+        Ban a word: messages containing it are no longer learned from,
+        and those already learned from are retracted from the corpora,
+        found through the full-text index rather than a scan. Returns
+        how many messages were retracted.
+        """
+        word = word.strip()
+        if len(word) == 0 or word.lower() in self.__banned_words:
+            return 0
+
+        await self.__writable.wait()
+        # a corpus still loading might have read them already, or not
+        for channel in list(self.__loading):
+            await self.corpus_ready(channel)
+
+        channels = list(self.__datasets)
+        await self.__open(channels)
+
+        start = perf_counter()
+        phrase = search_phrase(word) if self.__searchable else None
+        sources = [self.__conn] if self.__channel_dir is None else [self.__messages(x) for x in channels]
+        rows = []
+        for messages in sources:
+            if phrase is not None:
+                rows += messages.execute(SEARCH_QUERY, (datetime.now(), phrase)).fetchall()
+            else:
+                rows += messages.execute(SEARCH_SCAN_QUERY, (datetime.now(), word)).fetchall()
+
+        # those with an earlier banned word were never learned from
+        earlier = self.__banned_words
+        found: Dict[str, Tuple[List[str], List[int]]] = {}
+        self.__codec.require(x[2] for x in rows)
+        for channel, msg, version, repeats in rows:
+            if version is not None:
+                msg = self.__codec.decode(msg, version)
+                # a scan matches every compressed message
+                if phrase is None and word.lower() not in msg.lower():
+                    continue
+            if not any(x in msg.lower() for x in earlier):
+                msgs, weights = found.setdefault(channel, ([], []))
+                msgs.append(msg)
+                weights.append(repeat_weight(repeats, self.__repeat_cap))
+
+        self.__conn.execute("INSERT INTO TwitchBannedWords(Word, AddTime) VALUES (?, ?)", (word, datetime.now()))
+        self.__conn.commit()
+        self.reload_banned_words()
+
+        retracted = 0
+        for channel, (msgs, weights) in found.items():
+            corpus = self.__datasets.get(channel)
+            if corpus is not None:
+                retracted += corpus.retract(msgs, weights)
+
+        print(f"banned {word!r}: {retracted} messages retracted in {perf_counter() - start:.2f}s")
+        return retracted
+
+    @property
+    def __windowed(self) -> bool:
+        return self.__corpus_messages is not None or self.__corpus_age is not None
+
+    def __new_corpus(self, channel: str, messages: list[str] | None = None) -> Corpus:
+        return Corpus(messages, self.__flavor, name=channel,
+                      max_messages=self.__corpus_messages, max_age=self.__corpus_age)
+
+    def __load(self, channel: str) -> asyncio.Task:
+        task = self.__loading.get(channel)
+        if task is None:
+            task = self.__loading[channel] = self.__new_task(self.__load_main(channel), f"load.{channel}")
+        return task
+
+    async def __load_main(self, channel: str) -> None:
+        async with self.__load_slots:
+            start = perf_counter()
+            loop = asyncio.get_running_loop()
+
+            # Start from a prebuilt snapshot where it is still valid, and only
+            # read the messages saved after it. Snapshots hold everything, so
+            # they are of no use to a window, or to the last few streams.
+            corpus, last_id = None, 0
+            snapshot = self.__snapshots.pop(channel, None)
+            if snapshot is not None:
+                try:
+                    corpus = await loop.run_in_executor(None, Corpus.from_snapshot, snapshot[2], snapshot[1],
+                                                        self.__flavor, channel)
+                    last_id = snapshot[0]
+                except (ValueError, EOFError, TypeError, ZlibError):
+                    # unreadable (e.g. another python's marshal format): rebuild
+                    corpus = None
+
+            # The newest row is found here, on the loop, like every write:
+            # anything staged before this point is up to it, anything after
+            # is past it. The rows themselves are read in the executor.
+            batch = self.__batches.get(channel)
+            if batch is not None:
+                batch.clear()
+
+            await self.__open((channel,))
+            messages = self.__messages(channel)
+            upto = messages.execute("SELECT MAX(Id) FROM TwitchMessages WHERE Channel = ?",
+                                    (channel,)).fetchone()[0] or 0
+            streams = self.__corpus_streams is not None and self.__has_streams(channel)
+            if not self.__windowed:
+                corpus = corpus if corpus is not None else Corpus(flavor=self.__flavor, name=channel)
+            else:
+                corpus = self.__new_corpus(channel)
+
+            if self.__db_str == ":memory:":
+                # nothing else can open it: read it here after all
+                rows = self.__read(channel, messages, last_id, upto, streams)
+                texts = await loop.run_in_executor(None, self.__extend, corpus, rows)
+            else:
+                texts = await loop.run_in_executor(None, self.__read_extend, channel, corpus, last_id, upto, streams)
+
+            self.__datasets[channel] = corpus
+            if self.__compress:
+                self.__codec.observe(channel, texts)
+
+            elapsed = perf_counter() - start
+            _STARTUP.labels(f"corpus.{channel}").set(elapsed)
+            print(f"{channel}: corpus ready in {elapsed:.2f}s")
+
+            # those loading at startup are frozen together once all are
+            if self.__gc_freeze and self.__started and self.__freezing is None:
+                self.__freezing = self.__new_task(self.__late_freeze_main(), "late_freeze")
+                self.__background.append(self.__freezing)
+
+    def __read_extend(self, channel: str, corpus: Corpus, after: int, upto: int, streams: bool) -> List[str]:
+        # in an executor thread, so on a connection of its own
+        from sqlite3 import connect
+        from sqlite3 import PARSE_DECLTYPES
+
+        if self.__channel_dir is None:
+            conn = connect(self.__db_str, detect_types=PARSE_DECLTYPES, timeout=30)
+        else:
+            conn = connect(path.join(self.__channel_dir, f"{channel}.sqlite"), detect_types=PARSE_DECLTYPES,
+                           timeout=30)
+            attach_core(conn, self.__db_str)
+
+        try:
+            rows = self.__read(channel, conn, after, upto, streams)
+        finally:
+            conn.close()
+        return self.__extend(corpus, rows)
+
+    def __read(self, channel: str, conn: Connection, after: int, upto: int, streams: bool) -> list:
+        """
+        The rows to build a channel's corpus from, up to row `upto` (and
+        after row `after`, which a snapshot already holds), with the
+        dictionaries to decode them read.
+        """
+        now = datetime.now()
+        if self.__windowed:
+            since = ""
+            if self.__corpus_age is not None:
+                since = (datetime.now(UTC) - self.__corpus_age).strftime("%Y-%m-%d %H:%M:%S")
+
+            limit = self.__corpus_messages if self.__corpus_messages is not None else -1
+            rows = conn.execute(CORPUS_WINDOW_QUERY, (now, channel, upto, since, limit)).fetchall()
+            rows.reverse()
+        elif streams:
+            rows = conn.execute(CORPUS_STREAMS_QUERY + " AND Id <= ?",
+                                (now, channel, channel, self.__corpus_streams, upto)).fetchall()
+        else:
+            rows = conn.execute(CORPUS_QUERY + " AND Id <= ?", (now, channel, after, upto)).fetchall()
+
+        self.__codec.require((x[1] for x in rows), conn)
+        return rows
+
+    def __extend(self, corpus: Corpus, rows: list) -> List[str]:
+        rows = decode_rows(self.__codec, rows, self.__banned_words)
+        texts = [x[0] for x in rows]
+        if corpus.windowed:
+            corpus.extend(texts, [_message_time(x[1]) for x in rows],
+                          [repeat_weight(x[2], self.__repeat_cap) for x in rows])
+        else:
+            corpus.extend(texts, weights=[repeat_weight(x[1], self.__repeat_cap) for x in rows])
+        return texts
+
+    def __has_streams(self, channel: str) -> bool:
+        return self.__conn.execute("SELECT 1 FROM TwitchStreams WHERE Channel = ? LIMIT 1",
+                                   (channel,)).fetchone() is not None
+
+    async def __loaded_main(self, start: float) -> None:
+        # only those in the database at startup
+        loading = list(self.__loading.values())
+        try:
+            await asyncio.gather(*(asyncio.shield(x) for x in loading))
+        except asyncio.CancelledError:
+            return
+
+        elapsed = perf_counter() - start
+        _STARTUP.labels("corpora").set(elapsed)
+        print(f"{len(loading)} corpora ready in {elapsed:.2f}s")
+
+        if self.__gc_freeze:
+            start = perf_counter()
+            gc_tuning.freeze()
+            print(f"corpora frozen in {perf_counter() - start:.2f}s")
+        self.__started = True
+
+    async def __late_freeze_main(self) -> None:
+        try:
+            await asyncio.sleep(LATE_FREEZE_DELAY)
+            # with any still loading, so they are not left for the next one
+            await asyncio.gather(*(asyncio.shield(x) for x in self.__loading.values()))
+        except asyncio.CancelledError:
+            return
+        finally:
+            self.__background.remove(self.__freezing)
+            self.__freezing = None
+
+        start = perf_counter()
+        gc_tuning.freeze()
+        print(f"late corpora frozen in {perf_counter() - start:.2f}s")
+
+    async def corpus_ready(self, channel: str) -> None:
+        """
+        Wait until the channel's corpus has loaded, if it is loading.
+        """
+        task = self.__loading.get(channel)
+        if task is not None and not task.done():
+            await asyncio.shield(task)
+
+    async def __train_main(self) -> None:
+        # a channel's first dictionary once it has said enough, and a new
+        # one as its chat drifts; trained in the executor, stored here
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await asyncio.sleep(60)
+                for channel, samples in self.__codec.due():
+                    start = perf_counter()
+                    dictionary = await loop.run_in_executor(None, train, samples)
+                    version = self.__codec.add(channel, dictionary)
+                    print(f"{channel}: message dictionary {version}, {len(dictionary):,} bytes "
+                          f"from {len(samples):,} messages in {perf_counter() - start:.2f}s")
+        except asyncio.CancelledError:
+            return
+
+    async def __expiry_main(self) -> None:
+        # age out quiet channels too, not just those still receiving messages
+        try:
+            while True:
+                await asyncio.sleep(min(self.__corpus_age.total_seconds() / 24, 60 * 60))
+                for corpus in self.__datasets.values():
+                    corpus.expire()
+        except asyncio.CancelledError:
+            return
+
+    async def compact(self) -> Dict[str, int]:
+        """
+        Archive messages older than `archive_after` and compact the
+        database (each channel's, one at a time, with `channel_dir`).
+        Runs in an executor on its own connection; database writes wait
+        until it is done.
+        """
+        from functools import partial
+        from .maintenance import compact
+
+        if self.__channel_dir is None:
+            jobs = [partial(compact, self.__db_str, self.__archive_dir, self.__archive_after,
+                            repeat_cap=self.__repeat_cap)]
+        else:
+            jobs = [partial(compact, x, self.__archive_dir, self.__archive_after,
+                            repeat_cap=self.__repeat_cap, core=self.__db_str)
+                    for _, x in sorted(self.__channel_files().items())]
+
+        self.__writable.clear()
+        try:
+            start = perf_counter()
+            archived: Dict[str, int] = {}
+            for job in jobs:
+                for target, count in (await asyncio.get_running_loop().run_in_executor(None, job)).items():
+                    archived[target] = archived.get(target, 0) + count
+            print(f"archived {sum(archived.values())} messages in {perf_counter() - start:.1f}s")
+            return archived
+        finally:
+            self.__writable.set()
+
+    async def __compaction_main(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self.__compact_interval)
+                await self.compact()
+        except asyncio.CancelledError:
+            return
+
+    async def init_corpus(self, channel: str) -> None:
+        """
+        Load the channel's corpus, if nothing has yet, and wait for it.
+        """
+        if channel in self.__datasets:
+            return
+
+        await asyncio.shield(self.__load(channel))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Corpus sizes per channel, and the ingestion backlog.
+        """
+        return {
+            "corpora": {k: v.stats() for k, v in self.__datasets.items()},
+            "loading": sum(1 for x in self.__loading.values() if not x.done()),
+            "ingest": self.__ingest.depths(),
+            # saved, but not yet in a model version
+            "unpublished": sum(x[2] for batch in self.__batches.values() for x in batch.values()),
+        }
+
+    # Corpora publish immutable model versions, and generation runs on the
+    # version current when it starts: no lock between ingest and generation.
+    async def generate_text(self, channel: str, about: str | None = None) -> str | None:
+        """
+        A message for the channel; given `about`, one containing that word
+        (`None` if the channel has never used it).
+        """
+        return await self.__datasets[channel].generate_text(about=about)
 
-    async def generate_text(self, channel: str) -> str:
-        async with self.__cache_lock.reader_lock:
-            return await self.__datasets[channel].generate_text()
+    async def generate_candidates(self, channel: str, count: int) -> List[Tuple[str, float]]:
+        return await self.__datasets[channel].generate_candidates(count)
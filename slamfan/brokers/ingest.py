@@ -0,0 +1,252 @@
+import asyncio
+from collections import deque
+from datetime import datetime
+from enum import Enum
+from random import random
+from time import monotonic
+from typing import Awaitable, Callable, Deque, Dict, List, Set, Tuple
+from uuid import UUID
+
+from metrics import Counter, Gauge
+
+_DROPPED = Counter("slamfan_ingest_dropped_messages",
+                   "Chat messages dropped by ingestion, by stage and reason",
+                   ("channel", "stage", "reason"))
+_PENDING = Gauge("slamfan_ingest_pending",
+                 "Messages waiting out the moderation delay",
+                 ("channel",))
+_DEPTH = Gauge("slamfan_ingest_queue_depth",
+               "Chat messages waiting in each ingestion stage",
+               ("stage",))
+
+class ShedPolicy(Enum):
+    """
+    What ingestion does with new messages when it is over its
+    high-water mark.
+    """
+    # keep a share of them that falls to none at capacity
+    SAMPLE = "sample"
+    # keep them until at capacity, then drop them
+    DROP = "drop"
+
+class PendingMessage(object):
+    """
+    A chat message on its way through ingestion.
+    """
+    __slots__ = ("channel", "uid", "uid_hash", "msg", "msg_id", "msg_time", "due", "train", "cancelled")
+
+    def __init__(self, channel: str, uid: int, msg: str, msg_id: UUID, msg_time: datetime) -> None:
+        self.channel = channel
+        self.uid = uid
+        self.uid_hash = ""
+        self.msg = msg
+        self.msg_id = msg_id
+        self.msg_time = msg_time
+        self.due = 0.0
+        # set by the filter stage: whether it may be learned from
+        self.train = True
+        self.cancelled = False
+
+class IngestPipeline(object):
+    """
+    Chat ingestion as a fixed set of stages joined by bounded queues,
+    rather than a task per message:
+
+        intake -> filter -> delay -> persist (batched) -> `persist` callback
+
+    The delay stage holds each message for the moderation delay, so that
+    removals and bans can `cancel` it first. At most `capacity` messages
+    are in the pipeline; past `high_water` of that, new messages are shed
+    according to `policy`. A stage that cannot keep up makes the one
+    before it wait.
+
+    Messages are shed rather than making `submit` wait for room: twitchio
+    dispatches every chat line as a task of its own, so waiting would
+    only park a task per line, and never slow down the socket.
+    """
+
+    def __init__(self, tg: asyncio.TaskGroup,
+                 filter: Callable[[PendingMessage], None],
+                 persist: Callable[[List[PendingMessage]], Awaitable[None]],
+                 delay: float = 30, capacity: int = 50000, high_water: float = 0.8,
+                 policy: ShedPolicy = ShedPolicy.SAMPLE, batch: int = 256) -> None:
+        """
+        :paramref: `tg`: task group to run the stages in
+        :paramref: `filter`: fills in a message's `uid_hash` and `train`
+        :paramref: `persist`: saves a batch of messages that outlived the delay
+        :paramref: `delay`: seconds messages wait before they are saved
+        :paramref: `capacity`: most messages in the pipeline at once
+        :paramref: `high_water`: fraction of `capacity` past which to shed
+        :paramref: `policy`: how to shed
+        :paramref: `batch`: most messages saved per `persist` call
+        """
+        self.__task_group = tg
+        self.__filter = filter
+        self.__persist = persist
+        self.__delay = delay
+        self.__capacity = capacity
+        self.__high_water = int(capacity * high_water)
+        self.__policy = policy
+        self.__batch = batch
+
+        self.__intake: asyncio.Queue[PendingMessage] = asyncio.Queue(capacity)
+        self.__delayed: Deque[PendingMessage] = deque()
+        self.__delayed_ready = asyncio.Event()
+        self.__persisting: asyncio.Queue[PendingMessage] = asyncio.Queue(batch * 4)
+
+        # every message still in the pipeline, by id and by (channel,
+        # user), for `cancel`
+        self.__waiting: Dict[str, PendingMessage] = {}
+        self.__by_user: Dict[Tuple[str, str], Set[PendingMessage]] = {}
+        self.__tasks: List[asyncio.Task] = []
+        # messages taken and not yet saved or dropped; set at none
+        self.__unsettled = 0
+        self.__settled = asyncio.Event()
+        self.__settled.set()
+
+        _DEPTH.set_collect(lambda: {(k,): v for k, v in self.depths().items()})
+
+    async def __aenter__(self) -> 'IngestPipeline':
+        for name, fn in (("filter", self.__filter_main), ("delay", self.__delay_main),
+                         ("persist", self.__persist_main)):
+            self.__tasks.append(self.__task_group.create_task(fn(), name=f"ingest.{name}"))
+        return self
+
+    async def __aexit__(self, *e) -> None:
+        for task in self.__tasks:
+            task.cancel()
+
+    def __len__(self) -> int:
+        return len(self.__waiting)
+
+    def depths(self) -> Dict[str, int]:
+        """
+        Messages waiting in each stage.
+        """
+        return {"intake": self.__intake.qsize(),
+                "delay": len(self.__delayed),
+                "persist": self.__persisting.qsize()}
+
+    def __shed(self) -> bool:
+        depth = len(self.__waiting)
+        if depth >= self.__capacity:
+            return True
+
+        if self.__policy != ShedPolicy.SAMPLE or depth < self.__high_water:
+            return False
+
+        # keep a share falling linearly from all (at high water) to none
+        return random() >= (self.__capacity - depth) / (self.__capacity - self.__high_water)
+
+    async def submit(self, channel: str, uid: int, msg: str, msg_id: UUID, msg_time: datetime) -> bool:
+        """
+        Hand a message to the pipeline. Returns whether it was taken.
+        """
+        if self.__shed():
+            _DROPPED.labels(channel, "intake", "shed").inc()
+            return False
+
+        pending = PendingMessage(channel, uid, msg, msg_id, msg_time)
+        self.__waiting[str(msg_id)] = pending
+        self.__by_user.setdefault((channel, str(uid)), set()).add(pending)
+        self.__intake.put_nowait(pending)
+        self.__unsettled += 1
+        self.__settled.clear()
+        return True
+
+    def cancel(self, channel: str, msg_id: UUID | None = None, uid: int | None = None) -> int:
+        """
+        Drop a message (by id), or all of a user's messages, in a channel
+        before they are saved. Returns how many were dropped.
+        """
+        if msg_id is not None:
+            found = [self.__waiting[str(msg_id)]] if str(msg_id) in self.__waiting else []
+        else:
+            found = list(self.__by_user.get((channel, str(uid)), ()))
+
+        found = [x for x in found if x.channel == channel and not x.cancelled]
+        for pending in found:
+            pending.cancelled = True
+        return len(found)
+
+    def __done(self, pending: PendingMessage) -> None:
+        if self.__waiting.get(str(pending.msg_id)) is pending:
+            del self.__waiting[str(pending.msg_id)]
+
+        key = (pending.channel, str(pending.uid))
+        same_user = self.__by_user.get(key)
+        if same_user is not None:
+            same_user.discard(pending)
+            if len(same_user) == 0:
+                del self.__by_user[key]
+
+    def __settle(self, count: int) -> None:
+        self.__unsettled -= count
+        if self.__unsettled == 0:
+            self.__settled.set()
+
+    async def drain(self) -> None:
+        """
+        Wait until every message taken so far has been saved or dropped.
+        """
+        await self.__settled.wait()
+
+    async def __filter_main(self) -> None:
+        try:
+            while True:
+                pending = await self.__intake.get()
+                if pending.cancelled:
+                    self.__done(pending)
+                    self.__settle(1)
+                    continue
+
+                self.__filter(pending)
+                pending.due = monotonic() + self.__delay
+                self.__delayed.append(pending)
+                _PENDING.labels(pending.channel).inc()
+                self.__delayed_ready.set()
+        except asyncio.CancelledError:
+            return
+
+    async def __delay_main(self) -> None:
+        # the delay is the same for everyone, so the line is in due order
+        try:
+            while True:
+                if len(self.__delayed) == 0:
+                    self.__delayed_ready.clear()
+                    await self.__delayed_ready.wait()
+                    continue
+
+                wait = self.__delayed[0].due - monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+                pending = self.__delayed.popleft()
+                _PENDING.labels(pending.channel).dec()
+                if pending.cancelled:
+                    self.__done(pending)
+                    self.__settle(1)
+                    continue
+
+                await self.__persisting.put(pending)
+        except asyncio.CancelledError:
+            return
+
+    async def __persist_main(self) -> None:
+        try:
+            while True:
+                batch = [await self.__persisting.get()]
+                while len(batch) < self.__batch and not self.__persisting.empty():
+                    batch.append(self.__persisting.get_nowait())
+
+                for pending in batch:
+                    self.__done(pending)
+
+                taken = len(batch)
+                batch = [x for x in batch if not x.cancelled]
+                if len(batch) > 0:
+                    await self.__persist(batch)
+                self.__settle(taken)
+        except asyncio.CancelledError:
+            return
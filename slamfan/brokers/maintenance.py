@@ -0,0 +1,290 @@
+"""
+Offline maintenance of the bot's database: model snapshots, archival
+of old messages out of the hot `TwitchMessages` table, and compression
+of those left in it.
+
+Everything here is synchronous and opens its own connection, so it can
+be run from a script or from an executor thread beside the bot.
+"""
+from sqlite3 import connect, Connection
+from datetime import datetime, timedelta, UTC
+from gzip import GzipFile
+from json import dumps, loads
+from os import path, makedirs, fsync
+from time import perf_counter
+from zlib import error as ZlibError
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from turing import Corpus
+
+from .codec import MessageCodec, decode_rows, train
+from .schema import attach_core, has_search, repeat_weight, unmirror, CORPUS_QUERY, SNAPSHOT_QUERY
+
+def _snapshot(db: Connection, channel: str, corpus: Corpus, last_id: int) -> int:
+    model = corpus.snapshot()
+    if model is None:
+        return 0
+
+    with db:
+        db.execute("""
+            INSERT OR REPLACE INTO CorpusSnapshots(
+                Channel,
+                LastMessageId,
+                Messages,
+                Model,
+                BuildTime
+            ) VALUES (?, ?, ?, ?, ?)
+        """, (channel, last_id, len(corpus), model, datetime.now(UTC)))
+
+    return len(model)
+
+def build_snapshots(db: Connection, channels: Iterable[str] | None = None,
+                    extra: Dict[str, List[str]] | None = None, incremental: bool = False,
+                    repeat_cap: int | None = None) -> None:
+    """
+    Train each channel's model from the hot table and store it, so the
+    bot can start from the snapshot instead of re-reading every message.
+
+    :paramref: `channels`: channels to build; all of them if `None`
+    :paramref: `extra`: additional messages per channel (e.g. from an
+                        archive) to train on
+    :paramref: `incremental`: extend still-valid snapshots with newer
+                              messages instead of retraining, keeping
+                              whatever archived history they hold
+    :paramref: `repeat_cap`: most copies of one message the model counts
+    """
+    if channels is None:
+        channels = [x[0] for x in db.execute("SELECT DISTINCT Channel FROM TwitchMessages")]
+
+    valid = {}
+    if incremental:
+        valid = {x[0]: x[1:] for x in db.execute(SNAPSHOT_QUERY)}
+
+    extra = extra or {}
+    codec = MessageCodec(db)
+    words = [x[0] for x in db.execute("SELECT Word FROM TwitchBannedWords") if x[0]]
+    for channel in channels:
+        start = perf_counter()
+        last_id = db.execute("SELECT MAX(Id) FROM TwitchMessages WHERE Channel = ?", (channel,)).fetchone()[0] or 0
+
+        corpus = None
+        after = 0
+        if channel in valid:
+            after, size, model = valid[channel]
+            try:
+                corpus = Corpus.from_snapshot(model, size, name=channel)
+            except (ValueError, EOFError, TypeError, ZlibError):
+                after = 0
+
+        rows = decode_rows(codec, db.execute(CORPUS_QUERY + " AND Id <= ?",
+                                             (datetime.now(), channel, after, last_id)).fetchall(), words)
+        if corpus is None:
+            corpus = Corpus(name=channel)
+        corpus.extend([x[0] for x in rows] + extra.get(channel, []),
+                      weights=[repeat_weight(x[1], repeat_cap) for x in rows] + [1] * len(extra.get(channel, [])))
+
+        size = _snapshot(db, channel, corpus, last_id)
+        if size > 0:
+            print(f"{channel}: snapshot of {len(corpus):,} messages, {size:,} bytes "
+                  f"in {perf_counter() - start:.1f}s")
+
+def archive_path(archive_dir: str, channel: str, month: str | None) -> str:
+    if month is None:
+        return path.join(archive_dir, f"{channel}.jsonl.gz")
+    return path.join(archive_dir, channel, f"{month}.jsonl.gz")
+
+def archive_messages(db: Connection, archive_dir: str, older_than: timedelta,
+                     per_month: bool = True) -> Dict[str, int]:
+    """
+    Move messages older than `older_than` out of `TwitchMessages` into
+    gzipped json-lines files, one per channel (and month). Files are
+    appended to, and each file is synced to disk before its rows are
+    deleted, so an interrupted run can only duplicate rows, never lose
+    them.
+
+    Returns the number of rows archived per file.
+    """
+    cutoff = (datetime.now(UTC) - older_than).strftime("%Y-%m-%d %H:%M:%S")
+    month = "substr(MessageTime, 1, 7)" if per_month else "NULL"
+    groups = db.execute(f"""
+        SELECT Channel, {month}, MAX(Id)
+        FROM TwitchMessages
+        WHERE MessageTime < ?
+        GROUP BY Channel, {month}
+    """, (cutoff,)).fetchall()
+
+    codec = MessageCodec(db)
+    searchable = has_search(db)
+    archived: Dict[str, int] = {}
+    for channel, group_month, last_id in groups:
+        where = f"Channel = ? AND MessageTime < ? AND Id <= ? AND {month} IS ?"
+        args = (channel, cutoff, last_id, group_month)
+        target = archive_path(archive_dir, channel, group_month)
+        makedirs(path.dirname(target) or ".", exist_ok=True)
+
+        # collapsed repeats' other senders, with how many copies each sent
+        repeated = f"Message IN (SELECT Id FROM TwitchMessages WHERE {where})"
+        repeaters: Dict[int, Dict[str, int]] = {}
+        for rid, user, repeats in db.execute(f"SELECT Message, User, Repeats FROM TwitchMessageRepeats "
+                                             f"WHERE {repeated}", args):
+            repeaters.setdefault(rid, {})[user] = repeats
+
+        count = 0
+        # compressed ones, to take out of the full-text mirror
+        compressed = []
+        with open(target, "ab") as raw:
+            with GzipFile(fileobj=raw, mode="ab") as gz:
+                for rid, chan, user, msg, version, time, repeats, stream in db.execute(f"""
+                        SELECT Id, Channel, User, Message, Codec, MessageTime, Repeats, Stream
+                        FROM TwitchMessages
+                        WHERE {where}
+                        ORDER BY Id""", args):
+                    if version is not None:
+                        msg = codec.decode(msg, version)
+                        compressed.append((rid, msg))
+                    record = {"id": rid, "channel": chan, "user": user, "message": msg,
+                              "time": str(time), "repeats": repeats, "stream": stream}
+                    if rid in repeaters:
+                        record["repeaters"] = repeaters[rid]
+                    gz.write((dumps(record) + "\n").encode())
+                    count += 1
+            raw.flush()
+            fsync(raw.fileno())
+
+        with db:
+            if searchable:
+                unmirror(db, compressed)
+            db.execute(f"DELETE FROM TwitchMessageRepeats WHERE {repeated}", args)
+            db.execute(f"DELETE FROM TwitchMessages WHERE {where}", args)
+
+        archived[target] = archived.get(target, 0) + count
+
+    return archived
+
+def compress_messages(db: Connection, chunk: int = 10000) -> Dict[str, Tuple[int, int]]:
+    """
+    Compress the plain messages in `TwitchMessages` (see `codec`), with
+    each channel's newest dictionary, trained from its most recent
+    messages where it has none. The space is only given back by a
+    `VACUUM`.
+
+    Returns the bytes of text before and after, per channel.
+    """
+    codec = MessageCodec(db)
+    sizes: Dict[str, Tuple[int, int]] = {}
+    for (channel,) in db.execute("SELECT DISTINCT Channel FROM TwitchMessages").fetchall():
+        recent = db.execute("SELECT Message, Codec FROM TwitchMessages WHERE Channel = ? ORDER BY Id DESC LIMIT ?",
+                            (channel, MessageCodec.SAMPLES)).fetchall()
+        codec.observe(channel, [codec.decode(*x) for x in reversed(recent)])
+        for due, samples in codec.due():
+            codec.add(due, train(samples))
+
+        before = after = 0
+        last = 0
+        while True:
+            rows = db.execute("""SELECT Id, Message FROM TwitchMessages
+                                 WHERE Channel = ? AND Codec IS NULL AND Id > ?
+                                 ORDER BY Id LIMIT ?""", (channel, last, chunk)).fetchall()
+            if len(rows) == 0:
+                break
+
+            updates = []
+            for rid, msg in rows:
+                stored, version = codec.encode(channel, msg)
+                before += len(msg.encode())
+                after += len(stored) if version is not None else len(msg.encode())
+                if version is not None:
+                    updates.append((stored, version, rid))
+
+            # the mirror keeps the text it has: it has not changed
+            with db:
+                db.executemany("UPDATE TwitchMessages SET Message = ?, Codec = ? WHERE Id = ?", updates)
+            last = rows[-1][0]
+
+        sizes[channel] = (before, after)
+    return sizes
+
+def read_archive(paths: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """
+    Read archived message records, skipping duplicates left by an
+    interrupted archival run.
+    """
+    seen = set()
+    for p in paths:
+        with GzipFile(p, "rb") as gz:
+            for line in gz:
+                record = loads(line)
+                if record["id"] in seen:
+                    continue
+
+                seen.add(record["id"])
+                yield record
+
+def corpus_filter(db: Connection) -> Callable[[str, str], bool]:
+    """
+    Python equivalent of the user/word filtering in `CORPUS_QUERY`, for
+    messages that are no longer in the database.
+    """
+    users = {x[0] for x in db.execute("SELECT User FROM TwitchBanned WHERE UnbanTime < ?", (datetime.now(),))}
+    words = [x[0].lower() for x in db.execute("SELECT Word FROM TwitchBannedWords") if x[0]]
+
+    def allowed(user: str, msg: str) -> bool:
+        if user in users:
+            return False
+
+        lowered = msg.lower()
+        return not any(w in lowered for w in words)
+
+    return allowed
+
+def archived_messages(db: Connection, paths: Iterable[str], channel: str | None = None) -> Dict[str, List[str]]:
+    """
+    Messages from archive files, per channel, that may be used in a corpus.
+    Collapsed repeats are expanded back into one entry per copy, leaving
+    out those of banned chatters.
+    """
+    allowed = corpus_filter(db)
+    out: Dict[str, List[str]] = {}
+    for record in read_archive(paths):
+        if channel is not None and record["channel"] != channel:
+            continue
+
+        msg = record["message"]
+        repeaters = record.get("repeaters", {})
+        copies = sum(n for user, n in repeaters.items() if allowed(user, msg))
+        if allowed(record["user"], msg):
+            copies += record.get("repeats", 1) - sum(repeaters.values())
+        if copies > 0:
+            out.setdefault(record["channel"], []).extend([msg] * copies)
+    return out
+
+def compact(db_path: str, archive_dir: str, older_than: timedelta, per_month: bool = True,
+            snapshots: bool = True, vacuum: bool = True, repeat_cap: int | None = None,
+            core: str | None = None) -> Dict[str, int]:
+    """
+    The full compaction job: refresh snapshots (so the models keep the
+    history that is about to leave the hot table), archive old messages,
+    then `VACUUM` to give the space back.
+
+    A snapshot invalidated by a ban is retrained from the hot table only;
+    `fold` the archives back in to recover the older history.
+
+    Given the `core` database, `db_path` is one channel's own database
+    (see `schema.create_channel_tables`), and only it is vacuumed.
+    """
+    db = connect(db_path, timeout=60)
+    try:
+        if core is not None:
+            attach_core(db, core)
+
+        if snapshots:
+            build_snapshots(db, incremental=True, repeat_cap=repeat_cap)
+
+        archived = archive_messages(db, archive_dir, older_than, per_month)
+
+        if vacuum and len(archived) > 0:
+            db.execute("VACUUM")
+
+        return archived
+    finally:
+        db.close()
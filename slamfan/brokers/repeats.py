@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from time import monotonic
+from typing import Dict, List
+
+class RepeatTable(object):
+    """
+    Per-channel table of recently saved messages, keyed by a hash of the
+    normalized text, so that exact repeats (emote walls, command spam, a
+    copypasta sent by half of chat) can be collapsed onto the row of their
+    first copy, whoever sends them. The entry remembers who sent that
+    copy; the others' are counted per chatter beside the row (see
+    `schema.MESSAGE_REPEATS`), so banning one never takes anyone else's
+    copies with it.
+
+    Entries are forgotten `window` seconds after the last repeat, and
+    each channel holds at most `size` of them.
+    """
+
+    def __init__(self, window: float = 300, size: int = 4096) -> None:
+        self.__window = window
+        self.__size = size
+        # channel -> hash -> [row id, times seen, last seen, first sender]
+        self.__channels: Dict[str, OrderedDict[bytes, List]] = {}
+
+    @staticmethod
+    def key(msg: str) -> bytes:
+        return blake2b(' '.join(msg.split()).encode(), digest_size=8).digest()
+
+    def repeat(self, channel: str, msg: str) -> List | None:
+        """
+        If `msg` repeats a recent message, count it and return its
+        `[row id, times seen, last seen, first sender]` entry; otherwise
+        `None`.
+        """
+        if self.__window <= 0:
+            return None
+
+        now = monotonic()
+        table = self.__channels.get(channel)
+        if table is None:
+            return None
+
+        # oldest first: drop whatever has gone quiet
+        while len(table) > 0:
+            oldest = next(iter(table.values()))
+            if now - oldest[2] <= self.__window:
+                break
+            table.popitem(last=False)
+
+        key = self.key(msg)
+        entry = table.get(key)
+        if entry is None:
+            return None
+
+        entry[1] += 1
+        entry[2] = now
+        table.move_to_end(key)
+        return entry
+
+    def record(self, channel: str, user: str, msg: str, row_id: int) -> None:
+        """
+        Remember `msg` as the first copy, sent by `user` and saved as
+        `row_id`.
+        """
+        if self.__window <= 0:
+            return
+
+        key = self.key(msg)
+        table = self.__channels.setdefault(channel, OrderedDict())
+        table[key] = [row_id, 1, monotonic(), user]
+        table.move_to_end(key)
+        while len(table) > self.__size:
+            table.popitem(last=False)
@@ -0,0 +1,395 @@
+from sqlite3 import Connection, OperationalError
+from typing import Callable, Iterable, Tuple
+
+MESSAGES = """
+    CREATE TABLE IF NOT EXISTS TwitchMessages(
+        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        Channel     TEXT,
+        User        TEXT,
+        Message     TEXT,
+        MessageTime DATETIME,
+        Repeats     INTEGER NOT NULL DEFAULT 1
+    )"""
+
+# Repeats of a message collapsed onto its row (see `repeats.RepeatTable`)
+# from chatters other than the one who sent it first: how many copies
+# each sent, so their bans can take exactly those back out. Kept beside
+# TwitchMessages, with `channel_dir` in the channel's own database.
+MESSAGE_REPEATS = """
+    CREATE TABLE IF NOT EXISTS TwitchMessageRepeats(
+        Message     INTEGER,
+        User        TEXT,
+        Repeats     INTEGER NOT NULL,
+        PRIMARY KEY (Message, User)
+    )"""
+
+TABLES = (
+    MESSAGES,
+    MESSAGE_REPEATS,
+    """
+    CREATE TABLE IF NOT EXISTS TwitchBannedWords(
+        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        Word        TEXT,
+        AddTime     DATETIME
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS TwitchBanned(
+        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        Channel     TEXT,
+        User        TEXT,
+        BanTime     DATETIME,
+        UnbanTime   DATETIME
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS TwitchStreams(
+        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        VODURL      TEXT,
+        Channel     TEXT,
+        StartTime   DATETIME,
+        EndTime     DATETIME
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS TwitchClips(
+        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        ClipLink    TEXT,
+        Channel     TEXT,
+        StartTime   DATETIME,
+        EndTime     DATETIME
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS TriviaLeaderboard(
+        Id               INTEGER PRIMARY KEY AUTOINCREMENT,
+        User             TEXT UNIQUE,
+        Score            INTEGER,
+        CorrectQuestions INTEGER
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS MessageDictionaries(
+        Id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        Channel     TEXT,
+        Dictionary  BLOB,
+        BuildTime   DATETIME
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS CorpusSnapshots(
+        Channel       TEXT PRIMARY KEY,
+        LastMessageId INTEGER,
+        Messages      INTEGER,
+        Model         BLOB,
+        BuildTime     DATETIME
+    )""",
+)
+
+# Columns added since a table was first created: (table, column, definition)
+COLUMNS = (
+    ("TwitchMessages", "Repeats", "INTEGER NOT NULL DEFAULT 1"),
+    # the TwitchStreams session it was sent during; NULL while offline
+    ("TwitchMessages", "Stream", "INTEGER"),
+    # Twitch's own id for the stream
+    ("TwitchStreams", "TwitchId", "TEXT"),
+    # the MessageDictionaries version Message is compressed with (see
+    # `codec`); NULL for plain text
+    ("TwitchMessages", "Codec", "INTEGER"),
+)
+
+INDEXES = {
+    "TwitchMessagesByChannel": "TwitchMessages(Channel, Id)",
+    "TwitchBannedByChannelUser": "TwitchBanned(Channel, User)",
+    "TwitchMessagesByStream": "TwitchMessages(Channel, Stream)",
+    "TwitchStreamsByChannel": "TwitchStreams(Channel, TwitchId)",
+}
+
+# A full-text mirror of TwitchMessages.Message, kept in step by triggers,
+# to find messages containing a word without scanning them all. Trigram
+# tokens match substrings case-insensitively, as `LIKE '%word%'` does,
+# for words of three characters or more. Compressed messages are mirrored
+# by whatever compresses or deletes them, as sql cannot read them.
+SEARCH_TABLE = "TwitchMessagesText"
+SEARCH = f"""
+    CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        Message,
+        content='TwitchMessages',
+        content_rowid='Id',
+        tokenize='trigram'
+    )"""
+SEARCH_TRIGGERS = {
+    "TwitchMessagesTextInsert": f"""
+        AFTER INSERT ON TwitchMessages WHEN new.Codec IS NULL BEGIN
+            INSERT INTO {SEARCH_TABLE}(rowid, Message) VALUES (new.Id, new.Message);
+        END""",
+    "TwitchMessagesTextDelete": f"""
+        AFTER DELETE ON TwitchMessages WHEN old.Codec IS NULL BEGIN
+            INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, Message) VALUES ('delete', old.Id, old.Message);
+        END""",
+    "TwitchMessagesTextUpdate": f"""
+        AFTER UPDATE OF Message ON TwitchMessages WHEN old.Codec IS NULL AND new.Codec IS NULL BEGIN
+            INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, Message) VALUES ('delete', old.Id, old.Message);
+            INSERT INTO {SEARCH_TABLE}(rowid, Message) VALUES (new.Id, new.Message);
+        END""",
+}
+
+# The queries below start by naming the chatters whose messages are not
+# learned from, so that they only take the current time once, first.
+_BANNED = "WITH Banned(User) AS (SELECT User FROM TwitchBanned WHERE UnbanTime < ?)"
+
+def _learnable(m: str) -> str:
+    # row `m` has copies not banned: its sender's, or another chatter's
+    return f"""({m}.User NOT IN Banned OR EXISTS (
+                    SELECT 1 FROM TwitchMessageRepeats r WHERE r.Message = {m}.Id AND r.User NOT IN Banned))"""
+
+def _weight(m: str) -> str:
+    # how many copies of row `m` are not banned; most rows are sent once,
+    # and only collapsed repeats have other chatters' copies to look up
+    return f"""CASE
+        WHEN {m}.Repeats = 1 THEN 1
+        WHEN {m}.User IN Banned THEN (
+            SELECT IFNULL(SUM(r.Repeats), 0) FROM TwitchMessageRepeats r
+            WHERE r.Message = {m}.Id AND r.User NOT IN Banned)
+        ELSE {m}.Repeats - (
+            SELECT IFNULL(SUM(r.Repeats), 0) FROM TwitchMessageRepeats r
+            WHERE r.Message = {m}.Id AND r.User IN Banned)
+    END"""
+
+# Messages containing a word (as a quoted fts5 phrase), with how many of
+# their copies are from users not banned.
+# Parameters: the current time, the phrase
+SEARCH_QUERY = f"""
+    {_BANNED}
+    SELECT m.Channel, m.Message, m.Codec, {_weight("m")} AS Repeats
+    FROM {SEARCH_TABLE} t
+    JOIN TwitchMessages m ON m.Id = t.rowid
+    WHERE {SEARCH_TABLE} MATCH ?
+      AND
+    {_learnable("m")}
+"""
+
+# As `SEARCH_QUERY`, by scanning: for words too short for trigrams, or
+# where sqlite has no fts5. Every compressed message is a candidate.
+# Parameters: the current time, the word
+SEARCH_SCAN_QUERY = f"""
+    {_BANNED}
+    SELECT Channel, Message, Codec, {_weight("TwitchMessages")} AS Repeats
+    FROM TwitchMessages
+    WHERE (Codec IS NOT NULL OR Message LIKE '%' || ? || '%')
+      AND
+    {_learnable("TwitchMessages")}
+"""
+
+# Messages that may be used to build a channel's corpus, with how many of
+# their copies are from users not banned. The corpus queries can only
+# check plain messages for banned words; pass the rows through
+# `codec.decode_rows`.
+# Parameters: the current time, channel, only messages with an Id above this
+CORPUS_QUERY = f"""
+    {_BANNED}
+    SELECT Message, Codec, {_weight("TwitchMessages")} AS Repeats
+    FROM TwitchMessages
+    WHERE Channel = ?
+      AND
+    Id > ?
+      AND
+    {_learnable("TwitchMessages")}
+      AND
+    (Codec IS NOT NULL OR NOT EXISTS ( SELECT Word FROM TwitchBannedWords WHERE Message LIKE '%' || Word || '%' ))
+"""
+
+# As `CORPUS_QUERY`, but only messages sent during the channel's last few
+# streams: sessions are numbered in order, so that is one range of the
+# (Channel, Stream) index.
+# Parameters: the current time, channel, channel, how many streams
+CORPUS_STREAMS_QUERY = f"""
+    {_BANNED}
+    SELECT Message, Codec, {_weight("TwitchMessages")} AS Repeats
+    FROM TwitchMessages
+    WHERE Channel = ?
+      AND
+    Stream >= (SELECT MIN(Id) FROM (SELECT Id FROM TwitchStreams WHERE Channel = ? ORDER BY Id DESC LIMIT ?))
+      AND
+    {_learnable("TwitchMessages")}
+      AND
+    (Codec IS NOT NULL OR NOT EXISTS ( SELECT Word FROM TwitchBannedWords WHERE Message LIKE '%' || Word || '%' ))
+"""
+
+# The newest messages that may be used in a sliding-window corpus, newest first.
+# Parameters: the current time, channel, newest Id, oldest MessageTime, most rows (-1 for all)
+CORPUS_WINDOW_QUERY = f"""
+    {_BANNED}
+    SELECT Message, Codec, MessageTime, {_weight("TwitchMessages")} AS Repeats
+    FROM TwitchMessages
+    WHERE Channel = ?
+      AND
+    Id <= ?
+      AND
+    {_learnable("TwitchMessages")}
+      AND
+    (Codec IS NOT NULL OR NOT EXISTS ( SELECT Word FROM TwitchBannedWords WHERE Message LIKE '%' || Word || '%' ))
+      AND
+    MessageTime >= ?
+    ORDER BY Id DESC
+    LIMIT ?
+"""
+
+# Snapshots that are still valid, i.e. built after the newest ban / banned word.
+SNAPSHOT_QUERY = """
+    SELECT Channel, LastMessageId, Messages, Model
+    FROM CorpusSnapshots
+    WHERE BuildTime >= COALESCE((SELECT MAX(Changed) FROM (
+                                    SELECT MAX(BanTime) AS Changed FROM TwitchBanned
+                                      UNION ALL
+                                    SELECT MAX(AddTime) AS Changed FROM TwitchBannedWords
+                                 )), '')
+"""
+
+# With per-channel storage, each channel's messages are in a file of
+# their own, beside which the core database (everything else) is attached
+# under this name. Unqualified names resolve to the channel's file first,
+# so every query above runs unchanged on either layout.
+CORE = "core"
+
+def _add_columns(conn: Connection, tables: Iterable[str]) -> None:
+    for table, column, definition in COLUMNS:
+        if table not in tables:
+            continue
+
+        existing = {x[1] for x in conn.execute(f"PRAGMA main.table_info({table})")}
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def create_tables(conn: Connection) -> None:
+    for table in TABLES:
+        conn.execute(table)
+
+    _add_columns(conn, {x[0] for x in COLUMNS})
+    conn.commit()
+
+def attach_core(conn: Connection, core: str) -> None:
+    conn.execute(f"ATTACH DATABASE ? AS {CORE}", (core,))
+
+def create_channel_tables(conn: Connection, channel: str,
+                          decode: Callable[[bytes, int], str] | None = None) -> bool:
+    """
+    Set up a channel's own database: the message table, its indexes and
+    its full-text mirror, and nothing that would hide the core tables.
+    Any of the channel's messages still in the core database are moved
+    over (keeping their ids, which snapshots refer to).
+
+    Returns `False` if there is no full-text search (see `create_search`,
+    which `decode` is for).
+    """
+    conn.execute(MESSAGES)
+    conn.execute(MESSAGE_REPEATS)
+    _add_columns(conn, ("TwitchMessages",))
+
+    left = conn.execute(f"SELECT 1 FROM {CORE}.TwitchMessages WHERE Channel = ? LIMIT 1", (channel,)).fetchone()
+    if left is not None:
+        # One transaction, but in WAL mode that is only atomic for each
+        # file: should a crash come between the two, the next run moves
+        # what is still in the core again, skipping the ids already here
+        columns = ", ".join(x[1] for x in conn.execute("PRAGMA main.table_info(TwitchMessages)"))
+        with conn:
+            # the triggers mirror plain messages as they arrive; compressed
+            # ones are mirrored here, unless the mirror is new and filled
+            # from the whole table below
+            compressed = []
+            if decode is not None and has_search(conn):
+                compressed = conn.execute(f"""SELECT Id, Message, Codec FROM {CORE}.TwitchMessages
+                                              WHERE Channel = ? AND Codec IS NOT NULL
+                                              AND Id NOT IN (SELECT Id FROM main.TwitchMessages)""",
+                                          (channel,)).fetchall()
+
+            moved = conn.execute(f"""INSERT OR IGNORE INTO main.TwitchMessages({columns})
+                                     SELECT {columns} FROM {CORE}.TwitchMessages
+                                     WHERE Channel = ?""", (channel,)).rowcount
+            mirror(conn, [(x[0], decode(x[1], x[2])) for x in compressed])
+
+            # and who else sent them, while the rows still say which channel
+            repeated = f"Message IN (SELECT Id FROM {CORE}.TwitchMessages WHERE Channel = ?)"
+            conn.execute(f"""INSERT OR IGNORE INTO main.TwitchMessageRepeats(Message, User, Repeats)
+                             SELECT Message, User, Repeats FROM {CORE}.TwitchMessageRepeats
+                             WHERE {repeated}""", (channel,))
+            conn.execute(f"DELETE FROM {CORE}.TwitchMessageRepeats WHERE {repeated}", (channel,))
+            conn.execute(f"DELETE FROM {CORE}.TwitchMessages WHERE Channel = ?", (channel,))
+        print(f"{channel}: moved {moved:,} messages to its own database")
+
+    for name, target in INDEXES.items():
+        if target.startswith("TwitchMessages("):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS main.{name} ON {target}")
+    conn.commit()
+
+    return create_search(conn, decode)
+
+def repeat_weight(repeats: int, cap: int | None) -> int:
+    """
+    The model weight of a message sent `repeats` times.
+    """
+    return repeats if cap is None else min(repeats, cap)
+
+def create_indexes(conn: Connection) -> None:
+    for name, target in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    conn.commit()
+
+def drop_indexes(conn: Connection) -> None:
+    for name in INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+
+def create_search(conn: Connection, decode: Callable[[bytes, int], str] | None = None) -> bool:
+    """
+    Create the full-text mirror of messages, filling it from the table
+    if it is new (slow, once, on a large database). Compressed messages
+    are only mirrored given a `decode` (see `codec.MessageCodec`).
+    Returns `False` if this sqlite has no fts5 trigram tokenizer (3.34+).
+    """
+    found = has_search(conn)
+    if not found:
+        try:
+            conn.execute(SEARCH)
+        except OperationalError:
+            return False
+
+    # replaced each time, in case they predate compressed messages
+    for name, body in SEARCH_TRIGGERS.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+
+    if not found:
+        conn.execute(f"INSERT INTO {SEARCH_TABLE}(rowid, Message) "
+                     f"SELECT Id, Message FROM TwitchMessages WHERE Codec IS NULL")
+        if decode is not None:
+            compressed = conn.execute("SELECT Id, Message, Codec FROM TwitchMessages WHERE Codec IS NOT NULL")
+            mirror(conn, [(x[0], decode(x[1], x[2])) for x in compressed.fetchall()])
+    conn.commit()
+    return True
+
+def mirror(conn: Connection, rows: Iterable[Tuple[int, str]]) -> None:
+    """
+    Add compressed messages, as (id, text), to the full-text mirror; the
+    triggers only see plain ones.
+    """
+    conn.executemany(f"INSERT INTO {SEARCH_TABLE}(rowid, Message) VALUES (?, ?)", rows)
+
+def unmirror(conn: Connection, rows: Iterable[Tuple[int, str]]) -> None:
+    """
+    Remove compressed messages, as (id, text), from the full-text mirror,
+    before they are deleted.
+    """
+    conn.executemany(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, Message) VALUES ('delete', ?, ?)", rows)
+
+def has_search(conn: Connection) -> bool:
+    return conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = ?", (SEARCH_TABLE,)).fetchone() is not None
+
+def drop_search(conn: Connection) -> None:
+    for name in SEARCH_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+    conn.commit()
+
+def search_phrase(word: str) -> str | None:
+    """
+    `word` as an fts5 phrase for `SEARCH_QUERY`, or `None` if it is too
+    short for the trigram index.
+    """
+    if len(word) < 3:
+        return None
+    return '"' + word.replace('"', '""') + '"'
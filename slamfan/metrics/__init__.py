@@ -0,0 +1,3 @@
+from .registry import REGISTRY, Registry, Counter, Gauge, Histogram
+from .server import MetricsServer
+from .watchdog import LoopWatchdog
@@ -0,0 +1,223 @@
+"""
+On-demand profiling of the live process, for `!profile` in chat and
+SIGUSR2. Nothing is installed while no profile is running.
+"""
+import asyncio
+import os
+import sys
+import threading
+from collections import Counter as Tally
+from datetime import datetime
+from enum import Enum
+from typing import Dict, List, Tuple
+
+class ProfileMode(Enum):
+    # a thread samples every thread's stack: low overhead, sees executors,
+    # but leans towards where threads give up the GIL (e.g. `select`)
+    SAMPLE = "sample"
+    # cProfile on the event loop's thread: exact, but slows it down
+    CPU = "cpu"
+    # tracemalloc: where memory was allocated over the run
+    MEMORY = "memory"
+
+def _where(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class _Sampler(object):
+    """
+    Records the stack of every other thread each `interval` seconds.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.__interval = interval
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__main, name="profile-sampler", daemon=True)
+        # (thread name, frames root first) -> times seen
+        self.stacks: Tally[Tuple[str, Tuple[str, ...]]] = Tally()
+        self.samples = 0
+        self.__where: Dict[object, str] = {}
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+        self.__thread.join()
+
+    def __main(self) -> None:
+        me = threading.get_ident()
+        while not self.__stop.wait(self.__interval):
+            names = {x.ident: x.name for x in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    where = self.__where.get(frame.f_code)
+                    if where is None:
+                        where = self.__where[frame.f_code] = _where(frame.f_code)
+                    stack.append(where)
+                    frame = frame.f_back
+                self.stacks[(names.get(ident, str(ident)), tuple(reversed(stack)))] += 1
+            self.samples += 1
+
+class Profiler(object):
+    """
+    Runs one profile at a time, for a bounded time, and writes the
+    results under `directory`: a `.txt` report of the hottest functions
+    (or allocation sites), plus `.folded` stacks (flame graph input) or
+    `.pstats` (cProfile) where there are any.
+    """
+
+    MAX_SECONDS = 600.0
+
+    def __init__(self, directory: str = "profiles", interval: float = 0.005) -> None:
+        """
+        :paramref: `directory`: where results are written
+        :paramref: `interval`: seconds between samples in `SAMPLE` mode
+        """
+        self.__directory = directory
+        self.__interval = interval
+        self.__running = False
+        self.__done = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.__running
+
+    def stop(self) -> None:
+        """
+        End the running profile early; it is still written out.
+        """
+        self.__done.set()
+
+    async def run(self, mode: ProfileMode = ProfileMode.SAMPLE, seconds: float = 30.0) -> Tuple[str, str]:
+        """
+        Profile for `seconds` (or until `stop`), and return the path of
+        the report and a one-line summary of it.
+        """
+        if self.running:
+            raise RuntimeError("a profile is already running")
+
+        self.__running = True
+        self.__done.clear()
+        seconds = min(max(seconds, 1.0), self.MAX_SECONDS)
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            base = os.path.join(self.__directory,
+                                f"profile-{mode.value}-{os.getpid()}-{datetime.now():%Y%m%d-%H%M%S}")
+
+            match mode:
+                case ProfileMode.SAMPLE:
+                    return await self.__sample(base, seconds)
+                case ProfileMode.CPU:
+                    return await self.__cpu(base, seconds)
+                case ProfileMode.MEMORY:
+                    return await self.__memory(base, seconds)
+        finally:
+            self.__running = False
+
+    async def __wait(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self.__done.wait(), seconds)
+        except TimeoutError:
+            pass
+
+    async def __sample(self, base: str, seconds: float) -> Tuple[str, str]:
+        sampler = _Sampler(self.__interval)
+        sampler.start()
+        try:
+            await self.__wait(seconds)
+        finally:
+            # joins a thread that wakes every `interval`, so is quick
+            sampler.stop()
+
+        return await asyncio.get_running_loop().run_in_executor(None, _write_sample, base, sampler)
+
+    async def __cpu(self, base: str, seconds: float) -> Tuple[str, str]:
+        import cProfile
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await self.__wait(seconds)
+        finally:
+            profile.disable()
+
+        return await asyncio.get_running_loop().run_in_executor(None, _write_cpu, base, profile)
+
+    async def __memory(self, base: str, seconds: float) -> Tuple[str, str]:
+        import tracemalloc
+
+        # snapshots walk every traced block: off the loop, like the report
+        loop = asyncio.get_running_loop()
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(16)
+        try:
+            before = await loop.run_in_executor(None, tracemalloc.take_snapshot)
+            await self.__wait(seconds)
+            after = await loop.run_in_executor(None, tracemalloc.take_snapshot)
+        finally:
+            if started:
+                tracemalloc.stop()
+
+        return await loop.run_in_executor(None, _write_memory, base, before, after)
+
+# The reports are built and written in an executor: on a large heap or a
+# long profile, sorting and formatting them takes long enough to stall chat.
+
+def _write_sample(base: str, sampler: _Sampler) -> Tuple[str, str]:
+    own: Tally[str] = Tally()
+    inclusive: Tally[str] = Tally()
+    for (_, stack), n in sampler.stacks.items():
+        own[stack[-1]] += n
+        for frame in set(stack):
+            inclusive[frame] += n
+
+    total = max(1, sum(sampler.stacks.values()))
+    with open(f"{base}.folded", "w") as f:
+        for (thread, stack), n in sampler.stacks.most_common():
+            f.write(f"{';'.join((thread,) + stack)} {n}\n")
+
+    with open(f"{base}.txt", "w") as f:
+        f.write(f"{sampler.samples} samples of every thread, {total} stacks\n\n")
+        f.write("self%   function\n")
+        for frame, n in own.most_common(40):
+            f.write(f"{100 * n / total:5.1f}   {frame}\n")
+        f.write("\ntotal%  function\n")
+        for frame, n in inclusive.most_common(40):
+            f.write(f"{100 * n / total:5.1f}   {frame}\n")
+
+    return f"{base}.txt", ", ".join(f"{x} {100 * n / total:.0f}%" for x, n in own.most_common(3))
+
+def _write_cpu(base: str, profile) -> Tuple[str, str]:
+    import pstats
+
+    profile.dump_stats(f"{base}.pstats")
+    with open(f"{base}.txt", "w") as f:
+        stats = pstats.Stats(profile, stream=f)
+        stats.sort_stats("tottime").print_stats(40)
+        stats.sort_stats("cumulative").print_stats(40)
+
+    # ((file, line, function), (calls, primitive calls, own time, total time, callers))
+    top: List[Tuple[Tuple[str, int, str], Tuple]] = sorted(
+        pstats.Stats(profile).stats.items(), key=lambda x: x[1][2], reverse=True)[:3]
+    return f"{base}.txt", ", ".join(f"{fn} ({os.path.basename(file)}:{line}) {t[2]:.2f}s"
+                                    for (file, line, fn), t in top)
+
+def _write_memory(base: str, before, after) -> Tuple[str, str]:
+    growth = after.compare_to(before, "lineno")
+    current = after.statistics("lineno")
+    with open(f"{base}.txt", "w") as f:
+        f.write("growth over the run\n")
+        for stat in growth[:40]:
+            f.write(f"{stat}\n")
+        f.write("\nlargest allocation sites\n")
+        for stat in current[:40]:
+            f.write(f"{stat}\n")
+
+    return f"{base}.txt", ", ".join(f"{x.traceback[0].filename.rsplit(os.sep, 1)[-1]}:"
+                                    f"{x.traceback[0].lineno} {x.size_diff / 1024:+.0f}kB"
+                                    for x in growth[:3])
@@ -0,0 +1,226 @@
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+_DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    if len(pairs) == 0:
+        return ""
+
+    return "{" + ",".join(pairs) + "}"
+
+def _fmt_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric(object):
+    """
+    Abstract class representing a single named metric, optionally
+    split into children by a fixed set of label names.
+    """
+
+    _TYPE = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = (), registry: 'Registry | None' = None):
+        self._name = name
+        self._doc = doc
+        self._labels: Tuple[str, ...] = tuple(labels)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values: str):
+        """
+        Get (or create) the child for the given label values
+
+        :paramref: `values`: one value per label name, in order
+        """
+        if len(values) != len(self._labels):
+            raise ValueError(f"{self._name} expects labels {self._labels}")
+
+        key = tuple(str(x) for x in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def remove(self, *values: str) -> None:
+        self._children.pop(tuple(str(x) for x in values), None)
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def _samples(self) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError()
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self._name} {self._doc}", f"# TYPE {self._name} {self._TYPE}"]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self._name}{suffix}{labels} {_fmt_value(value)}")
+        return "\n".join(lines)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+
+class _Value(object):
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count of events.
+    """
+
+    _TYPE = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for k, v in list(self._children.items()):
+            yield "_total", _fmt_labels(self._labels, k), v.value
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down. A gauge may instead be backed by
+    a `collect` callable, evaluated only when the metrics are scraped,
+    which returns a mapping of label-value tuples to values.
+    """
+
+    _TYPE = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = (),
+                 collect: Callable[[], Dict[Tuple[str, ...], float]] | None = None,
+                 registry: 'Registry | None' = None):
+        super().__init__(name, doc, labels, registry)
+        self.__collect = collect
+
+    def set_collect(self, collect: Callable[[], Dict[Tuple[str, ...], float]] | None) -> None:
+        self.__collect = collect
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def _samples(self):
+        if self.__collect is not None:
+            for k, v in self.__collect().items():
+                yield "", _fmt_labels(self._labels, tuple(str(x) for x in k)), v
+            return
+
+        for k, v in list(self._children.items()):
+            yield "", _fmt_labels(self._labels, k), v.value
+
+
+class _HistogramValue(object):
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts: List[int] = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, bucketed by upper bound.
+    """
+
+    _TYPE = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = _DEFAULT_BUCKETS,
+                 registry: 'Registry | None' = None):
+        self.__bounds = tuple(sorted(buckets))
+        super().__init__(name, doc, labels, registry)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.__bounds)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def summary(self, *values: str) -> Tuple[int, float]:
+        """
+        (count, sum) of the observations for the given label values.
+        """
+        child = self._children.get(tuple(str(x) for x in values))
+        return (child.count, child.sum) if child is not None else (0, 0.0)
+
+    def _samples(self):
+        for k, v in list(self._children.items()):
+            running = 0
+            for bound, count in zip(self.__bounds + (float("inf"),), v.counts):
+                running += count
+                yield "_bucket", _fmt_labels(self._labels, k, f'le="{_fmt_value(bound)}"'), running
+            yield "_sum", _fmt_labels(self._labels, k), v.sum
+            yield "_count", _fmt_labels(self._labels, k), v.count
+
+
+class Registry(object):
+    """
+    Collection of metrics that are exposed together.
+    """
+
+    def __init__(self) -> None:
+        self.__metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self.__metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+
+        self.__metrics[metric.name] = metric
+
+    def get(self, name: str) -> _Metric | None:
+        return self.__metrics.get(name)
+
+    def expose(self) -> str:
+        """
+        Render every registered metric in the prometheus text format.
+        """
+        return "\n".join(x.expose() for x in self.__metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
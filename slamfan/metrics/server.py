@@ -0,0 +1,62 @@
+import asyncio
+
+from .registry import REGISTRY, Registry
+
+class MetricsServer(object):
+    """
+    Minimal HTTP endpoint exposing a metrics registry in the prometheus
+    text format. Event loop lag is measured by `LoopWatchdog`.
+
+    Disabled (a no-op context manager) if no port is given.
+    """
+
+    def __init__(self, tg: asyncio.TaskGroup, host: str = "127.0.0.1", port: int | None = None,
+                 registry: Registry = REGISTRY):
+        """
+        :paramref: `tg`: task group the server belongs to
+        :paramref: `host`: address to bind; local only by default
+        :paramref: `port`: port to bind, or `None` to disable the endpoint
+        :paramref: `registry`: the metrics to expose
+        """
+        self.__tasks = tg
+        self.__host = host
+        self.__port = port
+        self.__registry = registry
+        self.__server: asyncio.AbstractServer | None = None
+
+    async def __aenter__(self) -> 'MetricsServer':
+        if self.__port is None:
+            return self
+
+        self.__server = await asyncio.start_server(self.__handle, self.__host, self.__port)
+        print(f"metrics listening on http://{self.__host}:{self.__port}/metrics")
+        return self
+
+    async def __aexit__(self, *e) -> None:
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+                status = "200 OK"
+                body = self.__registry.expose().encode()
+            else:
+                status = "404 Not Found"
+                body = b"not found\n"
+
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
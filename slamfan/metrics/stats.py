@@ -0,0 +1,109 @@
+"""
+A point-in-time report on the bot's insides, for `!stats` in chat and
+for a local dump on SIGUSR1.
+"""
+import asyncio
+import gc
+import os
+from time import perf_counter
+from typing import Any, Dict
+
+from .registry import REGISTRY
+from .watchdog import LOOP_LAG
+
+def _rss() -> int:
+    # current RSS on linux; elsewhere, the peak is the best there is
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _mb(n: float) -> str:
+    return f"{n / (1 << 20):.0f}MB"
+
+async def collect(dbm: Any, watchdog: Any | None = None) -> Dict[str, Any]:
+    """
+    Gather the report. `dbm` is the `DatabaseBroker`, and `watchdog` the
+    `LoopWatchdog`, if there is one.
+    """
+    # the time it takes to get back onto the loop is its current lag
+    start = perf_counter()
+    await asyncio.sleep(0)
+    probe = perf_counter() - start
+
+    stats = dbm.stats()
+    stats["process"] = {
+        "rss": _rss(),
+        "tasks": len(asyncio.all_tasks()),
+        "lag_ms": round(1000 * max(probe, LOOP_LAG.labels().value), 1),
+    }
+
+    pauses = REGISTRY.get("slamfan_gc_pause_seconds")
+    stats["gc"] = {"frozen": gc.get_freeze_count(), "thresholds": gc.get_threshold()}
+    for generation in range(3):
+        count, total = pauses.summary(generation) if pauses is not None else (0, 0.0)
+        stats["gc"][generation] = {"collections": count, "pause_ms": round(1000 * total, 1)}
+    if watchdog is not None:
+        stats["process"].update({f"lag_{k}_ms": round(1000 * v, 1) for k, v in watchdog.recent().items()})
+        stats["stalls"] = [{"at": x.at.strftime("%H:%M:%S"), "ms": round(1000 * x.seconds),
+                            "task": x.task, "stack": x.stack} for x in watchdog.stalls()]
+    return stats
+
+def summary(stats: Dict[str, Any], limit: int = 480) -> str:
+    """
+    The report as a single chat line of at most `limit` characters,
+    biggest corpora first.
+    """
+    process, ingest = stats["process"], stats["ingest"]
+    lag = f"lag {process['lag_ms']}ms"
+    if "stalls" in stats:
+        lag += f" (p99 {process['lag_p99_ms']}ms, {len(stats['stalls'])} stalls)"
+
+    line = (f"rss {_mb(process['rss'])}, {process['tasks']} tasks, {lag}"
+            f" | ingest {ingest['intake']}/{ingest['delay']}/{ingest['persist']} (in/delay/db),"
+            f" {stats['unpublished']} unpublished, {stats['loading']} loading")
+
+    corpora = sorted(stats["corpora"].items(), key=lambda x: x[1]["bytes"], reverse=True)
+    for i, (channel, c) in enumerate(corpora):
+        part = (f" | {channel} {c['messages']} msgs {c.get('states', 0)} states"
+                f" ~{_mb(c['bytes'])} gen {c['generation_ms']}ms")
+        # leave room for the "+N more"
+        if len(line) + len(part) > limit - 12:
+            line += f" | +{len(corpora) - i} more"
+            break
+        line += part
+    return line[:limit]
+
+def report(stats: Dict[str, Any]) -> str:
+    """
+    The whole report, one line per item.
+    """
+    process, ingest = stats["process"], stats["ingest"]
+    lag = f"{process['lag_ms']}ms"
+    if "stalls" in stats:
+        lag += (f" now, {process['lag_p50_ms']}ms p50, {process['lag_p99_ms']}ms p99,"
+                f" {process['lag_max_ms']}ms max recently")
+
+    collections = ", ".join(f"gen{i} {stats['gc'][i]['collections']}x {stats['gc'][i]['pause_ms']}ms"
+                            for i in range(3))
+
+    lines = [f"rss:         {_mb(process['rss'])}",
+             f"tasks:       {process['tasks']}",
+             f"loop lag:    {lag}",
+             f"ingest:      {ingest['intake']} intake, {ingest['delay']} delayed, {ingest['persist']} persisting",
+             f"unpublished: {stats['unpublished']}",
+             f"gc:          {collections}, {stats['gc']['frozen']} frozen,"
+             f" thresholds {stats['gc']['thresholds']}",
+             f"loading:     {stats['loading']}"]
+
+    for channel, c in sorted(stats["corpora"].items()):
+        lines.append(f"{channel}: {c['messages']} messages, {c.get('states', 0)} states,"
+                     f" {c.get('transitions', 0)} transitions, ~{_mb(c['bytes'])},"
+                     f" {c['generation_ms']}ms per batch")
+
+    for stall in stats.get("stalls", []):
+        lines.append(f"stall at {stall['at']}: {stall['ms']}ms in {stall['task']}")
+        lines.extend(f"    {frame}" for frame in stall["stack"])
+    return "\n".join(lines)
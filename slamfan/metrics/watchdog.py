@@ -0,0 +1,202 @@
+"""
+Watches the event loop for stalls. A task ticks on the loop at a fixed
+interval, and how late each tick runs is the loop's lag; a thread
+notices when a tick is overdue and records what the loop is running
+at that moment, so that a stall can be pinned on a task and a line.
+"""
+import asyncio
+import os
+import sys
+import threading
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+from time import monotonic
+from traceback import StackSummary, walk_stack
+from typing import Deque, Dict, List, Tuple
+
+from .registry import Counter, Gauge, Histogram
+
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+            0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+LOOP_LAG = Gauge("slamfan_event_loop_lag_seconds",
+                 "Most recent delay between a scheduled wakeup and the loop running it")
+LOOP_LAG_HIST = Histogram("slamfan_event_loop_lag_distribution_seconds",
+                          "Distribution of event loop wakeup delays",
+                          buckets=_BUCKETS)
+_STALLS = Counter("slamfan_event_loop_stalls",
+                  "Times the event loop was blocked past the stall threshold, by the kind of task running",
+                  ("task",))
+
+def _kind(task: str) -> str:
+    # task names carry channels and ids, e.g. "db_load.somechannel"
+    # or "turing.somechannel"; keep the kind, or "Task" for unnamed ones
+    return task.split(".", 1)[0].split("-", 1)[0]
+
+class Stall(object):
+    """
+    A time the event loop was blocked past the threshold.
+    """
+    __slots__ = ("at", "seconds", "task", "stack")
+
+    def __init__(self, at: datetime, seconds: float, task: str, stack: List[str]) -> None:
+        self.at = at
+        self.seconds = seconds
+        # the task running when the stall was caught, and its stack,
+        # innermost frame last
+        self.task = task
+        self.stack = stack
+
+class _RollingHistogram(object):
+    """
+    Bucketed counts over the last `window` seconds, kept as `slots`
+    sub-histograms of which the oldest is dropped as time passes.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...], window: float, slots: int = 30) -> None:
+        self.__buckets = buckets
+        self.__span = window / slots
+        self.__slots: Deque[Tuple[int, List[int], List[float]]] = deque(maxlen=slots)
+
+    def __current(self, now: float) -> Tuple[List[int], List[float]]:
+        slot = int(now // self.__span)
+        if len(self.__slots) == 0 or self.__slots[-1][0] != slot:
+            self.__slots.append((slot, [0] * (len(self.__buckets) + 1), [0.0]))
+        return self.__slots[-1][1], self.__slots[-1][2]
+
+    def observe(self, value: float, now: float) -> None:
+        counts, peak = self.__current(now)
+        counts[bisect_left(self.__buckets, value)] += 1
+        peak[0] = max(peak[0], value)
+
+    def summary(self, now: float) -> Dict[str, float]:
+        """
+        The 50th and 99th percentiles (as bucket upper bounds) and the
+        most seen over the window.
+        """
+        oldest = int(now // self.__span) - self.__slots.maxlen
+        live = [x for x in self.__slots if x[0] > oldest]
+        counts = [sum(x) for x in zip(*(x[1] for x in live))]
+        peak = max((x[2][0] for x in live), default=0.0)
+
+        total = sum(counts)
+        result = {"p50": 0.0, "p99": 0.0, "max": peak}
+        for name, q in (("p50", 0.5), ("p99", 0.99)):
+            seen = 0
+            for i, n in enumerate(counts):
+                seen += n
+                if seen >= q * total and total > 0:
+                    result[name] = min(peak, self.__buckets[i] if i < len(self.__buckets) else peak)
+                    break
+        return result
+
+class LoopWatchdog(object):
+    """
+    Measures event loop lag all the time, into the lag metrics and a
+    histogram of the last `window` seconds, and records the task and
+    stack behind each stall longer than `threshold`.
+    """
+
+    def __init__(self, tg: asyncio.TaskGroup, interval: float = 0.1, threshold: float = 0.25,
+                 window: float = 300.0, keep: int = 20) -> None:
+        """
+        :paramref: `tg`: task group to run the ticker in
+        :paramref: `interval`: seconds between ticks
+        :paramref: `threshold`: seconds of lag that count as a stall
+        :paramref: `window`: seconds of lag history kept for `recent`
+        :paramref: `keep`: most stalls kept for `stalls`
+        """
+        self.__task_group = tg
+        self.__interval = interval
+        self.__threshold = threshold
+        self.__rolling = _RollingHistogram(_BUCKETS, window)
+        self.__stalls: Deque[Stall] = deque(maxlen=keep)
+
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__loop_thread = 0
+        self.__task: asyncio.Task | None = None
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__watch_main, name="loop-watchdog", daemon=True)
+
+        # (tick number, when it is due); swapped whole, so the thread
+        # always sees a matching pair
+        self.__due: Tuple[int, float] = (0, float("inf"))
+        # (tick number, task, stack) caught by the thread during a stall
+        self.__caught: Tuple[int, str, List[str]] | None = None
+
+    async def __aenter__(self) -> 'LoopWatchdog':
+        self.__loop = asyncio.get_running_loop()
+        self.__loop_thread = threading.get_ident()
+        self.__task = self.__task_group.create_task(self.__tick_main(), name="watchdog")
+        self.__thread.start()
+        return self
+
+    async def __aexit__(self, *e) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+        self.__stop.set()
+        self.__thread.join()
+
+    def recent(self) -> Dict[str, float]:
+        """
+        Lag over the window: its 50th and 99th percentiles and the most
+        seen, in seconds.
+        """
+        return self.__rolling.summary(monotonic())
+
+    def stalls(self) -> List[Stall]:
+        """
+        The most recent stalls, oldest first.
+        """
+        return list(self.__stalls)
+
+    async def __tick_main(self) -> None:
+        loop = asyncio.get_running_loop()
+        tick = 0
+        try:
+            while True:
+                tick += 1
+                expected = loop.time() + self.__interval
+                self.__due = (tick, monotonic() + self.__interval)
+                await asyncio.sleep(self.__interval)
+
+                lag = max(0.0, loop.time() - expected)
+                LOOP_LAG.set(lag)
+                LOOP_LAG_HIST.observe(lag)
+                self.__rolling.observe(lag, monotonic())
+                if lag >= self.__threshold:
+                    self.__stalled(tick, lag)
+        except asyncio.CancelledError:
+            return
+
+    def __stalled(self, tick: int, lag: float) -> None:
+        caught, self.__caught = self.__caught, None
+        if caught is not None and caught[0] == tick:
+            _, task, stack = caught
+        else:
+            # over before the thread looked
+            task, stack = "?", []
+
+        self.__stalls.append(Stall(datetime.now(), lag, task, stack))
+        _STALLS.labels(_kind(task)).inc()
+        print(f"event loop blocked {1000 * lag:.0f}ms in {task}"
+              + (f" at {stack[-1]}" if len(stack) > 0 else ""))
+
+    def __watch_main(self) -> None:
+        while not self.__stop.wait(self.__threshold / 4):
+            tick, due = self.__due
+            if monotonic() - due < self.__threshold:
+                continue
+            if self.__caught is not None and self.__caught[0] == tick:
+                continue
+
+            # the loop is stuck in whatever it is running now
+            task = asyncio.current_task(self.__loop)
+            frame = sys._current_frames().get(self.__loop_thread)
+            if frame is None:
+                continue
+
+            frames = StackSummary.extract(walk_stack(frame), limit=16, lookup_lines=False)
+            stack = [f"{x.name} ({os.path.basename(x.filename)}:{x.lineno})" for x in reversed(frames)]
+            self.__caught = (tick, task.get_name() if task is not None else "(callback)", stack)
@@ -0,0 +1,2 @@
+from .ring import HashRing
+from .supervisor import Supervisor
@@ -0,0 +1,35 @@
+from bisect import bisect
+from hashlib import blake2b
+from typing import Dict, Iterable, List
+
+def _point(key: str) -> int:
+    return int.from_bytes(blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class HashRing(object):
+    """
+    Consistent hashing of channels onto workers. Each worker owns many
+    points on a ring, and a channel belongs to the first worker point at
+    or after its own hash, so adding or removing a worker only moves the
+    channels on the arcs it gains or loses.
+    """
+
+    def __init__(self, workers: Iterable[int], replicas: int = 128) -> None:
+        points = sorted((_point(f"{worker}:{i}"), worker) for worker in workers for i in range(replicas))
+        if len(points) == 0:
+            raise ValueError("a hash ring needs at least one worker")
+
+        self.__hashes = [x[0] for x in points]
+        self.__workers = [x[1] for x in points]
+
+    def owner(self, channel: str) -> int:
+        i = bisect(self.__hashes, _point(channel.lower())) % len(self.__hashes)
+        return self.__workers[i]
+
+    def assign(self, channels: Iterable[str]) -> Dict[int, List[str]]:
+        """
+        Channels per worker; workers without channels are left out.
+        """
+        out: Dict[int, List[str]] = {}
+        for channel in channels:
+            out.setdefault(self.owner(channel), []).append(channel)
+        return out
@@ -0,0 +1,165 @@
+from argparse import Namespace
+from subprocess import Popen, TimeoutExpired
+from typing import Dict, List
+from time import monotonic, sleep
+import signal
+import sys
+import os
+
+from .ring import HashRing
+
+class Supervisor(object):
+    """
+    Runs the bot as `workers` processes, each owning the channels a
+    consistent-hash ring assigns to it: their corpora, cogs and chat
+    connections. Workers share the database (in WAL mode), which holds
+    everything that crosses channels: bans, trivia scores, users.
+
+    The channel list is `--channel` plus, if given, `--channels-file`
+    (one channel per line). On SIGHUP the file is re-read and only the
+    workers whose channels changed are restarted. A worker that crashes
+    is restarted; one that exits cleanly (`!die`) stops them all.
+
+    Workers run the supervisor's own command line; their share of the
+    work is passed in the environment (see `worker_argv`).
+    """
+
+    def __init__(self, argv: Namespace, workers: int, grace: float = 10.0) -> None:
+        """
+        :paramref: `argv`: the bot's arguments
+        :paramref: `workers`: number of worker processes
+        :paramref: `grace`: seconds a stopping worker gets before it is killed
+        """
+        self.__argv = argv
+        self.__workers = workers
+        self.__ring = HashRing(range(workers))
+        self.__grace = grace
+
+        self.__processes: Dict[int, Popen] = {}
+        self.__assigned: Dict[int, List[str]] = {}
+        self.__restarts: Dict[int, float] = {}
+
+        self.__reload = False
+        self.__stop = False
+
+    def channels(self) -> List[str]:
+        channels = list(self.__argv.channels or [])
+        if self.__argv.channels_file is not None:
+            with open(self.__argv.channels_file, "r") as f:
+                channels += [x.strip() for x in f if len(x.strip()) > 0 and not x.startswith("#")]
+
+        # dedupe, keeping order
+        return list(dict.fromkeys(x.lower() for x in channels))
+
+    @staticmethod
+    def worker_argv(argv: Namespace) -> Namespace:
+        """
+        In a worker, narrow the arguments down to its shard. Returns
+        `argv` unchanged outside of a worker.
+        """
+        shard = os.environ.get("SLAMFAN_SHARD")
+        if shard is None:
+            return argv
+
+        index = int(shard)
+        argv.workers = 1
+        argv.channels_file = None
+        argv.channels = [x for x in os.environ.get("SLAMFAN_SHARD_CHANNELS", "").split(",") if len(x) > 0]
+        argv.shard = index
+        # every worker's bots log in as the same accounts, so each gets
+        # its share of their send limit (see `SendQueue`)
+        argv.shards = int(os.environ.get("SLAMFAN_SHARD_COUNT", "1"))
+        # the superuser's own channel lives with whichever worker owns it
+        argv.home = os.environ.get("SLAMFAN_SHARD_HOME") == "1"
+        if argv.metrics_port is not None:
+            argv.metrics_port = int(argv.metrics_port) + index
+        if index != 0:
+            # one archiver is enough
+            argv.archive_after_days = None
+        return argv
+
+    def __start(self, index: int) -> None:
+        env = dict(os.environ)
+        env["SLAMFAN_SHARD"] = str(index)
+        env["SLAMFAN_SHARD_COUNT"] = str(self.__workers)
+        env["SLAMFAN_SHARD_CHANNELS"] = ",".join(self.__assigned[index])
+        env["SLAMFAN_SHARD_HOME"] = "1" if self.__ring.owner(self.__argv.superuser) == index else "0"
+
+        proc = Popen([sys.executable] + sys.argv, env=env)
+        self.__processes[index] = proc
+        print(f"shard {index}: pid {proc.pid}, {len(self.__assigned[index])} channels")
+
+    def __halt(self, indices: List[int]) -> None:
+        procs = [self.__processes.pop(x) for x in indices if x in self.__processes]
+        for proc in procs:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGINT)
+
+        deadline = monotonic() + self.__grace
+        for proc in procs:
+            try:
+                proc.wait(max(0.0, deadline - monotonic()))
+            except TimeoutExpired:
+                proc.kill()
+                proc.wait()
+
+    def rebalance(self) -> None:
+        """
+        Re-read the channel list, and restart the workers whose share of
+        it changed. Moved channels are stopped on their old worker before
+        the new one starts them.
+        """
+        assigned = self.__ring.assign(self.channels())
+
+        # a worker with no channels still runs if it is the superuser's home
+        home = self.__ring.owner(self.__argv.superuser)
+        assigned.setdefault(home, [])
+
+        changed = [x for x in set(assigned) | set(self.__assigned)
+                   if sorted(assigned.get(x, [])) != sorted(self.__assigned.get(x, []))
+                   or (x in assigned and x not in self.__processes)]
+        self.__halt(changed)
+
+        self.__assigned = assigned
+        for index in changed:
+            if index in assigned:
+                self.__start(index)
+
+    def __on_signal(self, signum, _) -> None:
+        if signum == signal.SIGHUP:
+            self.__reload = True
+        else:
+            self.__stop = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGHUP, self.__on_signal)
+        signal.signal(signal.SIGTERM, self.__on_signal)
+        signal.signal(signal.SIGINT, self.__on_signal)
+
+        try:
+            self.rebalance()
+            while not self.__stop:
+                sleep(1.0)
+
+                if self.__reload:
+                    self.__reload = False
+                    print("reloading channels")
+                    self.rebalance()
+
+                for index, proc in list(self.__processes.items()):
+                    if proc.poll() is None:
+                        continue
+
+                    if proc.returncode == 0:
+                        print(f"shard {index} exited, stopping")
+                        self.__stop = True
+                        break
+
+                    # crashed: restart, at most once every 30 seconds
+                    if monotonic() - self.__restarts.get(index, -30.0) >= 30.0:
+                        print(f"shard {index} died ({proc.returncode}), restarting")
+                        self.__restarts[index] = monotonic()
+                        del self.__processes[index]
+                        self.__start(index)
+        finally:
+            self.__halt(list(self.__processes))
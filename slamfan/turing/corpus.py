@@ -1,54 +1,337 @@
 from uuid import UUID
-from typing import List, Iterable, Dict
+from typing import List, Iterable, Dict, Deque, Tuple
+from collections import deque
+from itertools import repeat
+from datetime import datetime, timedelta, UTC
 from re import compile, sub
 from hashlib import sha384
+from time import perf_counter
+from zlib import compress, decompress
 import asyncio
+import marshal
+
+from metrics import Counter, Gauge, Histogram
 
 from .generation import GeneratorBackend, TextGenerator
+from .novelty import NgramIndex
 
 _NOSPACE = compile(r"\s\s+")
 _MENTION = compile(r"\s*@[A-Z0-9a-z_]+\s*")
 
+_GENERATION_LATENCY = Histogram("slamfan_generation_seconds",
+                                "Time taken to generate a single message",
+                                ("channel",))
+_BATCH_LATENCY = Histogram("slamfan_generation_batch_seconds",
+                           "Time taken to generate a batch of candidate messages",
+                           ("channel",))
+_REJECTED = Counter("slamfan_generation_rejected",
+                    "Generated messages discarded for repeating a source message",
+                    ("channel",))
+_CORPUS_SIZE = Gauge("slamfan_corpus_messages",
+                     "Messages currently held in a corpus",
+                     ("channel",))
+
+def _utc(when: datetime | None) -> datetime:
+    if when is None:
+        return datetime.now(UTC)
+
+    # twitchio hands out naive UTC timestamps
+    return when.replace(tzinfo=UTC) if when.tzinfo is None else when
+
 class Corpus(object):
     """
     Represents a corpus, a dataset of large amounts of text. This
     is all in-memory.
+
+    By default a corpus only ever grows. Given `max_messages` and/or
+    `max_age` it keeps a sliding window instead: messages are held in a
+    ring buffer, and the oldest are retracted from the model as new ones
+    arrive, so its size is bounded by configuration rather than uptime.
+
+    Every message is also recorded in an n-gram index, and generated
+    text that repeats a source message too closely is discarded.
     """
 
     def __init__(self,
                  data: Iterable[str] | None = None,
-                 flavor: GeneratorBackend = GeneratorBackend.MARKOVIFY):
-        self._raw_corpus: List[str] = []
-        if data is None:
-            data = []
+                 flavor: GeneratorBackend = GeneratorBackend.MARKOVIFY,
+                 name: str = "",
+                 max_messages: int | None = None,
+                 max_age: timedelta | None = None):
+        self._raw_corpus: Deque[str] = deque()
+        # parallel to `_raw_corpus`, only kept when windowed (weights) or
+        # for `max_age` (send times)
+        self._weights: Deque[int] = deque()
+        self._added: Deque[datetime] = deque()
+        # characters held in `_raw_corpus`, kept up as it changes
+        self._held = 0
+        self._name = name
+        self._snapshot_size = 0
+        self._max_messages = max_messages
+        self._max_age = max_age
+        self._index = NgramIndex()
+        # retracted messages still in `_index`
+        self._stale = 0
 
+        self._active_generator: TextGenerator = flavor.create()
+        if data is not None:
+            self.extend(data)
 
-        self._active_generator: TextGenerator = flavor.value
-        if len(data) == 0:
-            return
+    @classmethod
+    def from_snapshot(cls,
+                      snapshot: bytes,
+                      size: int = 0,
+                      flavor: GeneratorBackend = GeneratorBackend.MARKOVIFY,
+                      name: str = "") -> 'Corpus':
+        """
+        Rebuild a corpus from the output of `snapshot`, without the
+        original messages.
+
+        :paramref: `snapshot`: the snapshot
+        :paramref: `size`: the number of messages the snapshot was built from
+        """
+        model, index = marshal.loads(decompress(snapshot))
+        if not isinstance(model, bytes):
+            raise ValueError("snapshot predates the n-gram index")
+
+        corpus = cls(None, flavor, name)
+        corpus._active_generator.load_snapshot(model)
+        corpus._index = NgramIndex.from_bytes(index)
+        corpus._snapshot_size = size
+        _CORPUS_SIZE.labels(name).set(len(corpus))
+        return corpus
+
+    def snapshot(self) -> bytes | None:
+        """
+        Serialize the trained model and n-gram index, compressed. `None`
+        if the corpus is empty.
+        """
+        model = self._active_generator.to_snapshot()
+        if model is None:
+            return None
 
-        self._raw_corpus += data
-        self._real_dataset = "\n".join([self._active_generator.fmt(self.__normalize(x)) for x in data])
-        self._active_generator.add_data(self._real_dataset)
+        return compress(marshal.dumps((model, self._index.to_bytes())))
 
     def __normalize(self, msg: str) -> str:
         return sub(_MENTION, "", sub(_NOSPACE, " ", msg))
 
-    def add(self, msg: str) -> None:
+    @property
+    def windowed(self) -> bool:
+        return self._max_messages is not None or self._max_age is not None
+
+    def add(self, msg: str, msg_time: datetime | None = None, weight: int = 1) -> None:
         """
         Add a new message to the corpus (dataset)
 
         :paramref: `msg`: string to add
+        :paramref: `msg_time`: when it was sent, for `max_age`; now if `None`
+        :paramref: `weight`: count it as this many copies of the message
+        """
+        self.extend([msg], [msg_time], [weight])
+
+    def extend(self,
+               data: Iterable[str],
+               times: Iterable[datetime | None] | None = None,
+               weights: Iterable[int] | None = None) -> None:
         """
+        Add many messages to the corpus at once, publishing one new model
+        version for all of them (and whatever they push out of the window).
+
+        :paramref: `data`: strings to add
+        :paramref: `times`: when each was sent, for `max_age`; now if `None`
+        :paramref: `weights`: how many copies each counts as; 1 if `None`
+        """
+        data = list(data)
+        times = [None] * len(data) if times is None else times
+        weights = [1] * len(data) if weights is None else weights
+
+        msgs = [(self._active_generator.fmt(self.__normalize(x)), _utc(t), w)
+                for x, t, w in zip(data, times, weights)]
+        msgs = [x for x in msgs if len(x[0].strip()) > 0 and x[2] > 0]
+
+        # Don't train on messages that would be retracted straight away
+        if self._max_messages is not None:
+            msgs = msgs[len(msgs) - self._max_messages:] if len(msgs) > self._max_messages else msgs
+        if self._max_age is not None:
+            cutoff = datetime.now(UTC) - self._max_age
+            msgs = [x for x in msgs if x[1] >= cutoff]
 
-        msg_ = self._active_generator.fmt(self.__normalize(msg))
-        if len(msg_.strip()) == 0:
+        if len(msgs) == 0:
             return
 
-        self._raw_corpus.append(msg_)
-        self._real_dataset += "\n" + msg_
-        self._active_generator.add_data(msg_)
+        self._raw_corpus += (x[0] for x in msgs)
+        self._held += sum(len(x[0]) for x in msgs)
+        if self.windowed:
+            self._weights += (x[2] for x in msgs)
+        if self._max_age is not None:
+            self._added += (x[1] for x in msgs)
+        for msg in msgs:
+            self._index.add(msg[0].split())
+
+        expired = self.__evict()
+        self._active_generator.update_data(self.__changes(((x[0], x[2]) for x in msgs), 1) +
+                                           self.__changes(expired, -1))
+        _CORPUS_SIZE.labels(self._name).set(len(self))
+
+    @staticmethod
+    def __changes(msgs: Iterable[Tuple[str, int]], sign: int) -> List[Tuple[str, int]]:
+        # one model change per distinct weight
+        by_weight: Dict[int, List[str]] = {}
+        for msg, weight in msgs:
+            by_weight.setdefault(weight, []).append(msg)
+
+        return [("\n".join(group), sign * weight) for weight, group in by_weight.items()]
+
+    def __evict(self, now: datetime | None = None) -> List[Tuple[str, int]]:
+        expired: List[Tuple[str, int]] = []
+        if self._max_messages is not None:
+            while len(self._raw_corpus) > self._max_messages:
+                if self._max_age is not None:
+                    self._added.popleft()
+                expired.append((self._raw_corpus.popleft(), self._weights.popleft()))
+
+        if self._max_age is not None:
+            cutoff = _utc(now) - self._max_age
+            while len(self._added) > 0 and self._added[0] < cutoff:
+                self._added.popleft()
+                expired.append((self._raw_corpus.popleft(), self._weights.popleft()))
+
+        if len(expired) > 0:
+            self._held -= sum(len(x[0]) for x in expired)
+            # the index can't forget; rebuild it once it is mostly stale
+            self._stale += len(expired)
+            if self._stale > len(self._raw_corpus):
+                self._index = NgramIndex()
+                for msg in self._raw_corpus:
+                    self._index.add(msg.split())
+                self._stale = 0
+
+        return expired
+
+    def expire(self, now: datetime | None = None) -> int:
+        """
+        Retract messages that have fallen out of the window from the
+        model. Happens on every add; call it periodically as well if
+        `max_age` should apply to quiet channels.
+
+        Returns the number of messages retracted.
+        """
+        expired = self.__evict(now)
+        if len(expired) > 0:
+            self._active_generator.update_data(self.__changes(expired, -1))
+
+        _CORPUS_SIZE.labels(self._name).set(len(self))
+        return len(expired)
+
+    def is_novel(self, text: str) -> bool:
+        """
+        Whether generated `text` is sufficiently unlike every message in
+        the corpus (see `NgramIndex.overlaps`).
+        """
+        return not self._index.overlaps(text.split())
+
+    def retract(self, data: Iterable[str], weights: Iterable[int] | None = None) -> int:
+        """
+        Take messages back out of the model, e.g. ones containing a newly
+        banned word. A windowed corpus only retracts those still in its
+        window. Returns the number retracted.
+
+        :paramref: `data`: strings previously added
+        :paramref: `weights`: the weight each was added with; 1 if `None`
+        """
+        data = list(data)
+        weights = [1] * len(data) if weights is None else weights
+        msgs = [(self._active_generator.fmt(self.__normalize(x)), w) for x, w in zip(data, weights)]
+        msgs = [x for x in msgs if len(x[0].strip()) > 0 and x[1] > 0]
+
+        wanted: Dict[str, int] = {}
+        for msg, _ in msgs:
+            wanted[msg] = wanted.get(msg, 0) + 1
+
+        # drop them from what is held too; in a window that is all there
+        # is, and its weights are the ones to retract
+        held: List[Tuple[str, int, datetime | None]] = []
+        removed: List[Tuple[str, int]] = []
+        for msg, weight, added in zip(self._raw_corpus,
+                                      self._weights if self.windowed else repeat(1),
+                                      self._added if self._max_age is not None else repeat(None)):
+            if wanted.get(msg, 0) > 0:
+                wanted[msg] -= 1
+                removed.append((msg, weight))
+            else:
+                held.append((msg, weight, added))
+
+        if len(removed) > 0:
+            self._raw_corpus = deque(x[0] for x in held)
+            self._held -= sum(len(x[0]) for x in removed)
+            if self.windowed:
+                self._weights = deque(x[1] for x in held)
+            if self._max_age is not None:
+                self._added = deque(x[2] for x in held)
+            # the index can't forget, which only makes generation stricter
+            self._stale += len(removed)
+
+        if self.windowed:
+            msgs = removed
+        else:
+            # the rest were in the snapshot this corpus started from
+            self._snapshot_size = max(0, self._snapshot_size - (len(msgs) - len(removed)))
+
+        if len(msgs) > 0:
+            self._active_generator.update_data(self.__changes(msgs, -1))
+        _CORPUS_SIZE.labels(self._name).set(len(self))
+        return len(msgs)
+
+    async def generate_text(self, tries: int = 10, about: str | None = None) -> str | None:
+        """
+        Generate a message unlike any source message; given `about`, one
+        containing that word. `None` if none could be.
+        """
+        start = perf_counter()
+        try:
+            for _ in range(tries):
+                text = await self._active_generator.generate_text(about)
+                if text is None or self.is_novel(text):
+                    return text
+                _REJECTED.labels(self._name).inc()
+            return None
+        finally:
+            _GENERATION_LATENCY.labels(self._name).observe(perf_counter() - start)
+
+    async def generate_candidates(self, count: int) -> List[Tuple[str, float]]:
+        """
+        Generate up to `count` messages in one go, as `(text, score)`
+        pairs; higher scores are more typical of the channel.
+        """
+        start = perf_counter()
+        try:
+            candidates = await self._active_generator.generate_candidates(count)
+            novel = [x for x in candidates if self.is_novel(x[0])]
+            _REJECTED.labels(self._name).inc(len(candidates) - len(novel))
+            return novel
+        finally:
+            _BATCH_LATENCY.labels(self._name).observe(perf_counter() - start)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Message and model sizes, a rough estimate of the memory they take,
+        and the mean time to generate a batch; cheap enough to ask for
+        while live.
+        """
+        model = self._active_generator.stats()
+        # measured per state (tuple + dict) and per transition (dict slot
+        # + count); words are shared, so not counted
+        approx = 300 * model.get("states", 0) + 50 * model.get("transitions", 0) \
+                 + self._held + 50 * len(self._raw_corpus) + self._index.nbytes
+
+        count, total = _BATCH_LATENCY.summary(self._name)
+        return {"messages": len(self), **model, "bytes": approx,
+                "generation_ms": round(1000 * total / count, 1) if count > 0 else 0}
+
+    @property
+    def name(self) -> str:
+        return self._name
 
-    async def generate_text(self) -> str:
-        return await self._active_generator.generate_text()
+    def __len__(self) -> int:
+        return self._snapshot_size + len(self._raw_corpus)
 
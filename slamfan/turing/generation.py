@@ -1,8 +1,124 @@
+from collections.abc import Mapping
 from enum import Enum
 from re import compile, sub
-from markovify import NewlineText as MarkovDataset, combine as MergeDatasets
+from math import log
+from random import choice
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+from markovify import NewlineText as MarkovDataset, Chain as MarkovChain
+from markovify.chain import BEGIN, END, compile_next
+import marshal
 import asyncio
 
+def _word_key(word: str) -> str:
+    return word.strip(".,!?").lower()
+
+class ChainModel(Mapping):
+    """
+    A markov chain's state table (state -> next word -> count), as a
+    markovify `Chain` reads it, split into shards by the hash of the
+    state. A new version made with `evolve` shares every shard with the
+    one it came from, and copies a shard only when it is first written,
+    so publishing a change costs what it touches rather than the whole
+    table. Published versions must not be written to.
+    """
+
+    SHARDS = 4096
+
+    # never written: a shard is copied before its first write
+    __EMPTY: Dict = {}
+
+    def __init__(self, shards: List[Dict] | None = None, size: int = 0) -> None:
+        self.__shards = [self.__EMPTY] * self.SHARDS if shards is None else shards
+        self.__size = size
+        # shards this version has copied, and so may write to
+        self.__owned: Set[int] = set()
+
+    @classmethod
+    def from_dict(cls, model: Dict[Tuple[str, ...], Dict[str, int]]) -> 'ChainModel':
+        table = cls()
+        for state, nexts in model.items():
+            table[state] = nexts
+        return table
+
+    def evolve(self) -> 'ChainModel':
+        """
+        A new version to write changes to, sharing this one's shards.
+        """
+        return ChainModel(list(self.__shards), self.__size)
+
+    def __getitem__(self, state: Tuple[str, ...]) -> Dict[str, int]:
+        return self.__shards[hash(state) & (self.SHARDS - 1)][state]
+
+    def __contains__(self, state: object) -> bool:
+        return state in self.__shards[hash(state) & (self.SHARDS - 1)]
+
+    def get(self, state: Tuple[str, ...], default=None):
+        return self.__shards[hash(state) & (self.SHARDS - 1)].get(state, default)
+
+    def __writable(self, state: Tuple[str, ...]) -> Dict:
+        i = hash(state) & (self.SHARDS - 1)
+        if i not in self.__owned:
+            self.__shards[i] = dict(self.__shards[i])
+            self.__owned.add(i)
+        return self.__shards[i]
+
+    def __setitem__(self, state: Tuple[str, ...], nexts: Dict[str, int]) -> None:
+        shard = self.__writable(state)
+        if state not in shard:
+            self.__size += 1
+        shard[state] = nexts
+
+    def __delitem__(self, state: Tuple[str, ...]) -> None:
+        del self.__writable(state)[state]
+        self.__size -= 1
+
+    def __iter__(self) -> Iterator[Tuple[str, ...]]:
+        for shard in self.__shards:
+            yield from shard
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def items(self) -> Iterator[Tuple[Tuple[str, ...], Dict[str, int]]]:
+        for shard in self.__shards:
+            yield from shard.items()
+
+    def values(self) -> Iterator[Dict[str, int]]:
+        for shard in self.__shards:
+            yield from shard.values()
+
+class _Chain(MarkovChain):
+    """
+    A markovify chain over a `ChainModel` that works out its begin-state
+    distribution the first time it is walked (in the generating thread)
+    rather than as it is built: nearly every change touches the begin
+    state, which has as many entries as there are first words, and most
+    versions are replaced before anything is generated from them.
+    """
+
+    def __init__(self, state_size: int, model: ChainModel) -> None:
+        self.state_size = state_size
+        self.model = model
+        self.compiled = False
+        self.__begin = None
+
+    def precompute_begin_state(self) -> None:
+        self.__begin = compile_next(self.model[(BEGIN,) * self.state_size])
+
+    def __compiled_begin(self) -> Tuple[List[str], List[int]]:
+        # threads racing here both compute the same thing
+        if self.__begin is None:
+            self.precompute_begin_state()
+        return self.__begin
+
+    @property
+    def begin_choices(self) -> List[str]:
+        return self.__compiled_begin()[0]
+
+    @property
+    def begin_cumdist(self) -> List[int]:
+        return self.__compiled_begin()[1]
+
 class TextGenerator(object):
     """
     Abstract class representing a method of
@@ -12,15 +128,52 @@ class TextGenerator(object):
     def __init__(self) -> None:
         pass
 
-    def add_data(self, corpus: str) -> None:
+    def add_data(self, corpus: str, weight: int = 1) -> None:
         raise NotImplementedError()
 
-    async def generate_text(self):
+    def remove_data(self, corpus: str, weight: int = 1) -> None:
+        raise NotImplementedError()
+
+    def update_data(self, changes: Iterable[Tuple[str, int]]) -> None:
+        """
+        Apply many `(text, weight)` changes at once; negative weights
+        retract.
+        """
+        for corpus, weight in changes:
+            if weight > 0:
+                self.add_data(corpus, weight)
+            elif weight < 0:
+                self.remove_data(corpus, -weight)
+
+    async def generate_text(self, about: str | None = None):
+        """
+        Generate a sentence; given `about`, one that contains that word,
+        or `None` if the model has never seen it.
+        """
+        raise NotImplementedError()
+
+    async def generate_candidates(self, count: int) -> List[Tuple[str, float]]:
+        """
+        Generate up to `count` sentences at once, each with a score
+        (higher is more typical of the training data).
+        """
         raise NotImplementedError()
 
     def fmt(self, str_: str) -> str:
         raise NotImplementedError()
 
+    def to_snapshot(self) -> bytes | None:
+        raise NotImplementedError()
+
+    def load_snapshot(self, snapshot: bytes) -> None:
+        raise NotImplementedError()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Sizes of the model, for reporting.
+        """
+        return {}
+
     @property
     def type(self) -> 'GeneratorBackend':
         return self
@@ -36,24 +189,197 @@ class MarkovifyGenerator(TextGenerator):
 
         self.__model: MarkovDataset | None = None
         self.__chain_length = kwargs.get('chain', 2)
+        # transitions in the newest model version, kept up as it changes
+        self.__transitions = 0
+        # word -> states that start with it, for `generate_text(about=...)`;
+        # follows the newest model version
+        self.__starts: Dict[str, Set[Tuple[str, ...]]] = {}
+        # only used to split text into runs of words, the markovify way
+        self.__tokenizer = MarkovDataset(None, state_size=self.__chain_length,
+                                         parsed_sentences=[[""]], retain_original=False)
 
-    def add_data(self, corpus: str) -> None:
-        if self.__model is None:
-            self.__model = MarkovDataset(corpus, state_size=self.__chain_length)
+    def add_data(self, corpus: str, weight: int = 1) -> None:
+        self.update_data([(corpus, weight)])
+
+    def remove_data(self, corpus: str, weight: int = 1) -> None:
+        """
+        Retract text previously given to `add_data` (with the same weight);
+        the chain ends up as if it had never been added.
+        """
+        self.update_data([(corpus, -weight)])
+
+    def update_data(self, changes: Iterable[Tuple[str, int]]) -> None:
+        """
+        Apply a batch of additions (positive weights) and retractions
+        (negative weights) and publish the result as a new model version.
+
+        Copy-on-write: the current version is never modified. Only the
+        states the batch touches, and the shards of the table holding them
+        (see `ChainModel`), are copied, so generation still walking the old
+        version in another thread is unaffected, and needs no lock.
+        """
+        # Adjusting counts beats merging a second model in (markovify.combine),
+        # which costs O(corpus) per message and has no way to subtract one.
+        fresh = self.__model is None
+        model = ChainModel() if fresh else self.__model.chain.model.evolve()
+        copied = set()
+        begin = (BEGIN,) * self.__chain_length
+
+        # additions first, so no count passes through zero on the way
+        for corpus, delta in sorted(changes, key=lambda x: x[1] < 0):
+            for run in self.__tokenizer.generate_corpus(corpus):
+                items = list(begin) + run + [END]
+                for i in range(len(run) + 1):
+                    state = tuple(items[i:i + self.__chain_length])
+                    follow = items[i + self.__chain_length]
+
+                    nexts = model.get(state)
+                    if nexts is None:
+                        nexts = model[state] = {}
+                        copied.add(state)
+                        self.__index(state)
+                    elif not fresh and state not in copied:
+                        nexts = model[state] = dict(nexts)
+                        copied.add(state)
+
+                    old = nexts.get(follow, 0)
+                    count = old + delta
+                    if count > 0:
+                        if old == 0:
+                            self.__transitions += 1
+                        nexts[follow] = count
+                        continue
+
+                    if old > 0:
+                        self.__transitions -= 1
+                    nexts.pop(follow, None)
+                    if len(nexts) == 0:
+                        del model[state]
+                        copied.discard(state)
+                        self.__index(state, remove=True)
+
+        if begin in model:
+            self.__model = MarkovDataset(None,
+                                         state_size=self.__chain_length,
+                                         chain=_Chain(self.__chain_length, model),
+                                         retain_original=False)
         else:
-            self.__model = MergeDatasets([self.__model,
-                                          MarkovDataset(corpus,
-                                                        state_size=self.__chain_length)])
+            # everything was retracted
+            self.__model = None
+            self.__transitions = 0
+
+        self._changed()
+
+    def __index(self, state: Tuple[str, ...], remove: bool = False) -> None:
+        if state[0] == BEGIN:
+            return
+
+        key = _word_key(state[0])
+        if not remove:
+            self.__starts.setdefault(key, set()).add(state)
+            return
+
+        starts = self.__starts.get(key)
+        if starts is not None:
+            starts.discard(state)
+            if len(starts) == 0:
+                del self.__starts[key]
 
-    async def generate_text(self):
+    def _changed(self) -> None:
+        """
+        Called whenever a new model version is published.
+        """
+        pass
+
+    def _start_state(self, chain: MarkovChain, about: str) -> Tuple[str, ...] | None:
+        """
+        A random state of `chain` that starts with the word `about`.
+        """
+        # copied in one go: the index moves on with newer versions
+        starts = tuple(self.__starts.get(_word_key(about), ()))
+        for _ in range(min(len(starts), 8)):
+            state = choice(starts)
+            if state in chain.model:
+                return state
+        return None
+
+    @property
+    def _chain(self) -> MarkovChain | None:
+        return self.__model.chain if self.__model is not None else None
+
+    @property
+    def _chain_length(self) -> int:
+        return self.__chain_length
+
+    async def generate_text(self, about: str | None = None):
         from functools import partial
 
-        if self.__model is None:
+        model = self.__model
+        if model is None:
             return None
 
-        fn = partial(self.__model.make_sentence, state_size=self.__chain_length, test_output=False)
+        start = None
+        if about is not None:
+            start = self._start_state(model.chain, about)
+            if start is None:
+                return None
+
+        fn = partial(model.make_sentence, init_state=start, state_size=self.__chain_length, test_output=False)
         return await asyncio.get_running_loop().run_in_executor(None, fn)
 
+    async def generate_candidates(self, count: int) -> List[Tuple[str, float]]:
+        if self.__model is None:
+            return []
+
+        model = self.__model
+        begin = (BEGIN,) * self.__chain_length
+
+        def score(words: List[str]) -> float:
+            # mean log-probability per step
+            state = begin
+            total = 0.0
+            for word in words + [END]:
+                nexts = model.chain.model[state]
+                total += log(nexts[word] / sum(nexts.values()))
+                state = state[1:] + (word,)
+            return total / (len(words) + 1)
+
+        def run() -> List[Tuple[str, float]]:
+            walks = (model.chain.walk() for _ in range(count))
+            return [(model.word_join(x), score(x)) for x in walks if len(x) > 0]
+
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+
+    def to_snapshot(self) -> bytes | None:
+        # marshal rather than markovify's json: it loads ~4x faster
+        if self.__model is None:
+            return None
+
+        return marshal.dumps((self.__chain_length, dict(self.__model.chain.model.items())))
+
+    def load_snapshot(self, snapshot: bytes) -> None:
+        state_size, model = marshal.loads(snapshot)
+        if state_size != self.__chain_length:
+            raise ValueError(f"snapshot has state size {state_size}, expected {self.__chain_length}")
+        model = ChainModel.from_dict(model)
+
+        self.__model = MarkovDataset(None,
+                                     state_size=state_size,
+                                     chain=_Chain(state_size, model),
+                                     retain_original=False)
+        self.__starts = {}
+        for state in model:
+            self.__index(state)
+        self.__transitions = sum(len(x) for x in model.values())
+        self._changed()
+
+    def stats(self) -> Dict[str, int]:
+        model = self.__model
+        if model is None:
+            return {"states": 0, "transitions": 0}
+
+        return {"states": len(model.chain.model), "transitions": self.__transitions}
+
     def fmt(self, str_: str) -> str:
         if not isinstance(str_, str):
             raise TypeError()
@@ -66,6 +392,55 @@ class MarkovifyGenerator(TextGenerator):
 
         return ret
 
+class NumpyMarkovGenerator(MarkovifyGenerator):
+    """
+    The markovify chain, sampled with NumPy: many sentences are walked
+    in lock-step over arrays compiled from the chain, so large batches
+    of candidates cost little more than one sentence. Needs numpy.
+
+    The arrays are recompiled on the first generation after the chain
+    changes.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        self.__compiled = None
+        self.__max_words = kwargs.get('max_words', 128)
+
+    def _changed(self) -> None:
+        self.__compiled = None
+
+    def __compile(self, chain: MarkovChain):
+        from .vectorized import CompiledChain
+
+        # (chain, arrays): the arrays are only good for that version
+        compiled = self.__compiled
+        if compiled is None or compiled[0] is not chain:
+            compiled = (chain, CompiledChain(chain.model, self._chain_length))
+            self.__compiled = compiled
+        return compiled[1]
+
+    async def generate_text(self, about: str | None = None):
+        if about is not None:
+            # the arrays only walk from the start of a sentence
+            return await super().generate_text(about)
+
+        candidates = await self.generate_candidates(8)
+        return candidates[0][0] if len(candidates) > 0 else None
+
+    async def generate_candidates(self, count: int) -> List[Tuple[str, float]]:
+        from .vectorized import walk
+
+        chain = self._chain
+        if chain is None:
+            return []
+
+        def run() -> List[Tuple[str, float]]:
+            return walk(self.__compile(chain), count, self.__max_words)
+
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+
 
 class GeneratorBackend(Enum):
     """
@@ -74,3 +449,11 @@ class GeneratorBackend(Enum):
     """
     UNDEFINED = TextGenerator()
     MARKOVIFY = MarkovifyGenerator()
+    NUMPY = NumpyMarkovGenerator()
+
+    def create(self, **kwargs) -> TextGenerator:
+        """
+        Create a new, empty generator of this flavor. The enum value
+        itself is shared, so every corpus needs its own instance.
+        """
+        return type(self.value)(**kwargs)
@@ -0,0 +1,119 @@
+from hashlib import blake2b
+from math import ceil, log
+from typing import List, Sequence
+import marshal
+
+class _BloomFilter(object):
+    """
+    A fixed-size Bloom filter over 128-bit hashes, using double hashing
+    to derive its bit positions.
+    """
+
+    def __init__(self, capacity: int, error: float, bits: bytearray | None = None, count: int = 0) -> None:
+        self.capacity = capacity
+        self.count = count
+        self.size = max(8, ceil(-capacity * log(error) / (log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * log(2)))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+
+    def __positions(self, digest: bytes) -> List[int]:
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, digest: bytes) -> None:
+        bits = self.bits
+        for pos in self.__positions(digest):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, digest: bytes) -> bool:
+        bits = self.bits
+        for pos in self.__positions(digest):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+class NgramIndex(object):
+    """
+    A compact, probabilistic index of the word n-grams (and whole
+    messages) a corpus was trained on, for rejecting generated text that
+    repeats a chatter's message. Membership has no false negatives;
+    false positives only make the check stricter.
+
+    It is a scalable Bloom filter: when the newest filter is full, a new
+    one twice its size is started. Entries cannot be removed.
+    """
+
+    def __init__(self, n: int = 4, capacity: int = 1 << 16, error: float = 0.01) -> None:
+        self.__n = n
+        self.__error = error
+        self.__filters: List[_BloomFilter] = [_BloomFilter(capacity, error)]
+
+    @staticmethod
+    def __digest(words: Sequence[str], whole: bool = False) -> bytes:
+        # whole messages are hashed apart from n-grams of the same words
+        return blake2b(("\x00" if whole else "\x01").join(words).encode(), digest_size=16).digest()
+
+    def __add(self, digest: bytes) -> None:
+        current = self.__filters[-1]
+        if current.count >= current.capacity:
+            current = _BloomFilter(current.capacity * 2, self.__error)
+            self.__filters.append(current)
+        current.add(digest)
+
+    def __contains(self, digest: bytes) -> bool:
+        return any(digest in x for x in self.__filters)
+
+    def add(self, words: Sequence[str]) -> None:
+        """
+        Index one source message, given as its words.
+        """
+        if len(words) == 0:
+            return
+
+        self.__add(self.__digest(words, whole=True))
+        for i in range(len(words) - self.__n + 1):
+            self.__add(self.__digest(words[i:i + self.__n]))
+
+    def overlaps(self, words: Sequence[str], ratio: float = 0.7, max_total: int = 15) -> bool:
+        """
+        Whether `words` repeats a source message too closely: verbatim,
+        or with a run of more than `min(max_total, ratio * len(words))`
+        words (and at least n) made of indexed n-grams. The same limits
+        as markovify's `test_output`, in O(len(words)) rather than a scan
+        of the whole corpus.
+        """
+        if len(words) == 0:
+            return False
+
+        if self.__contains(self.__digest(words, whole=True)):
+            return True
+
+        limit = max(self.__n, min(max_total, round(ratio * len(words))) + 1)
+        # `run` consecutive indexed n-grams cover run + n - 1 words
+        run = 0
+        for i in range(len(words) - self.__n + 1):
+            if self.__contains(self.__digest(words[i:i + self.__n])):
+                run += 1
+                if run + self.__n - 1 >= limit:
+                    return True
+            else:
+                run = 0
+
+        return False
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(x.bits) for x in self.__filters)
+
+    def to_bytes(self) -> bytes:
+        return marshal.dumps((self.__n, self.__error,
+                              [(x.capacity, x.count, bytes(x.bits)) for x in self.__filters]))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'NgramIndex':
+        n, error, filters = marshal.loads(data)
+        index = cls(n, error=error)
+        index.__filters = [_BloomFilter(c, error, bytearray(b), count) for c, count, b in filters]
+        return index
@@ -0,0 +1,101 @@
+"""
+NumPy sampling over a markovify chain: the chain's dict-of-dicts model
+is flattened into arrays once, and many sentences are then walked in
+lock-step, one vectorized `searchsorted` per word position.
+"""
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from markovify.chain import BEGIN, END
+
+class CompiledChain(object):
+    """
+    A markovify chain model flattened for batch sampling.
+
+    Every transition (state, next word) is one slot of the flat arrays,
+    and the slots of a state are contiguous: `offsets[s]:offsets[s + 1]`.
+    `cumulative` is the running total of the weights over *all* slots,
+    so a single `searchsorted` picks the next slot for a whole batch of
+    states at once.
+    """
+
+    def __init__(self, model: Dict[Tuple[str, ...], Dict[str, int]], state_size: int) -> None:
+        states = list(model.keys())
+        index = {state: i for i, state in enumerate(states)}
+        vocabulary: Dict[str, int] = {}
+
+        sizes = np.fromiter((len(model[x]) for x in states), dtype=np.int64, count=len(states))
+        self.offsets = np.zeros(len(states) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.offsets[1:])
+
+        slots = int(self.offsets[-1])
+        self.words = np.empty(slots, dtype=np.int32)
+        self.following = np.empty(slots, dtype=np.int64)
+        weights = np.empty(slots, dtype=np.float64)
+
+        slot = 0
+        for state in states:
+            tail = state[1:]
+            for word, count in model[state].items():
+                self.words[slot] = vocabulary.setdefault(word, len(vocabulary))
+                # -1 ends the sentence; -2 marks a state missing from the model
+                self.following[slot] = -1 if word == END else index.get(tail + (word,), -2)
+                weights[slot] = count
+                slot += 1
+
+        self.vocabulary: List[str] = list(vocabulary)
+        self.weights = weights
+        self.cumulative = np.cumsum(weights)
+        before = np.concatenate(([0.0], self.cumulative))
+        self.base = before[self.offsets[:-1]]
+        self.total = before[self.offsets[1:]] - self.base
+        self.begin = index[(BEGIN,) * state_size]
+
+def walk(chain: CompiledChain, count: int, max_words: int = 128,
+         rng: Any = None) -> List[Tuple[str, float]]:
+    """
+    Walk `count` sentences from the begin state in lock-step.
+
+    Returns `(sentence, score)` for every walk that ended within
+    `max_words` words, where the score is the mean log-probability per
+    step: higher means a more typical sentence for the channel.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+
+    state = np.full(count, chain.begin, dtype=np.int64)
+    out = np.full((count, max_words), -1, dtype=np.int32)
+    length = np.zeros(count, dtype=np.int64)
+    logp = np.zeros(count, dtype=np.float64)
+    finished = np.zeros(count, dtype=bool)
+
+    alive = np.arange(count)
+    for step in range(max_words + 1):
+        if alive.size == 0:
+            break
+
+        s = state[alive]
+        target = chain.base[s] + rng.random(alive.size) * chain.total[s]
+        pick = np.searchsorted(chain.cumulative, target, side="right")
+        # float rounding can land one slot outside the state's segment
+        pick = np.clip(pick, chain.offsets[s], chain.offsets[s + 1] - 1)
+
+        logp[alive] += np.log(chain.weights[pick] / chain.total[s])
+        following = chain.following[pick]
+
+        ended = following == -1
+        finished[alive[ended]] = True
+
+        going = following >= 0
+        if step < max_words:
+            out[alive[going], step] = chain.words[pick[going]]
+        length[alive[going]] += 1
+        state[alive[going]] = following[going]
+        alive = alive[going]
+
+    results = []
+    vocabulary = chain.vocabulary
+    for i in np.flatnonzero(finished & (length > 0)):
+        words = out[i, :length[i]]
+        results.append((" ".join(vocabulary[w] for w in words), float(logp[i] / (length[i] + 1))))
+    return results
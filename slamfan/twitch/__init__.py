@@ -1,2 +1,4 @@
 from .cogs import *
-from .bot import TwitchBot
\ No newline at end of file
+from .bot import TwitchBot
+from .outbound import SendQueue, Priority
+from .streams import StreamWatcher
@@ -6,6 +6,7 @@ from uuid import UUID
 from typing import Dict, Any, List
 
 from .cogs.cogbase import CogBase
+from .outbound import SendQueue
 
 class TwitchBot(Bot):
     """
@@ -16,7 +17,9 @@ class TwitchBot(Bot):
     Additionally provides __aenter__ and __aexit__ context
     managers.
     """
-    def __init__(self, access_token: str, prefix: str, channels: List[str] = []):
+    def __init__(self, access_token: str, prefix: str, channels: List[str] = [],
+                 irc_url: str | None = None, api_url: str | None = None,
+                 outbound: SendQueue | None = None):
         """
         Base Class for Twitch Bots. Contains additional events
         that are extensions for the base `Bot` class provided
@@ -28,8 +31,60 @@ class TwitchBot(Bot):
             Prefix to use for commands
         :paramref:`channels`:
             List of channels to watch initially.
+        :paramref:`irc_url`:
+            Websocket URL of the chat server, if not twitch's own.
+        :paramref:`api_url`:
+            Base URL of the helix/oauth API, if not twitch's own. Must
+            serve `/helix/...` and `/oauth2/validate`.
+        :paramref:`outbound`:
+            Send queue shared with the process's other bots, which cogs
+            send through (see `CogBase._say`). Sent directly if `None`.
         """
         super().__init__(access_token, prefix=prefix, initial_channels=channels)
+        self.__outbound = outbound
+
+        if irc_url is not None or api_url is not None:
+            self.__redirect(irc_url, api_url)
+
+    def __redirect(self, irc_url: str | None, api_url: str | None) -> None:
+        """
+        Point the bot at stand-in chat and API servers (e.g. for load
+        testing). twitchio keeps these endpoints as module globals, so
+        this affects every bot in the process.
+        """
+        import twitchio.websocket
+        from twitchio.http import Route
+
+        if irc_url is not None:
+            twitchio.websocket.HOST = irc_url
+
+        if api_url is None:
+            return
+
+        api_url = api_url.rstrip("/")
+        Route.BASE_URL = f"{api_url}/helix"
+        http = self._http
+
+        async def validate(*, token: str = None) -> dict:
+            from aiohttp import ClientSession
+            from twitchio.errors import AuthenticationError
+
+            if http.session is None:
+                http.session = ClientSession()
+
+            async with http.session.get(f"{api_url}/oauth2/validate",
+                                        headers={"Authorization": f"OAuth {token or http.token}"}) as resp:
+                if resp.status == 401:
+                    raise AuthenticationError("Invalid or unauthorized Access Token passed.")
+                data: dict = await resp.json()
+
+            if not http.nick:
+                http.nick = data.get("login")
+                http.user_id = data.get("user_id") and int(data["user_id"])
+                http.client_id = data.get("client_id")
+            return data
+
+        http.validate = validate
 
     async def __aenter__(self):
         """
@@ -46,10 +101,17 @@ class TwitchBot(Bot):
         """
         await self.close()
 
+        if self.__outbound is not None:
+            self.__outbound.cancel(self.nick)
+
         for v in self.cogs.values():
             if isinstance(v, CogBase):
                 v.die()
 
+    @property
+    def outbound(self) -> SendQueue | None:
+        return self.__outbound
+
     async def event_raw_data(self, data: str) -> None:
         """
         Processes raw event data. This is used to fill in the gaps
@@ -108,7 +170,9 @@ class TwitchBot(Bot):
         if 'login' in metadata:
             user_moderated = channel.get_chatter(metadata['login'])
         elif len(data) > 4:
-            user_moderated = await self.fetch_users(names=[data[4][1:]])
+            users = await self.fetch_users(names=[data[4][1:]])
+            if len(users) > 0:
+                user_moderated = users[0]
 
         match action:
             case "CLEARCHAT":
@@ -116,7 +180,7 @@ class TwitchBot(Bot):
                     if 'ban-duration' in metadata:
                         self.run_event("user_timeout", user_moderated, channel, timestamp, int(metadata['ban-duration']), metadata)
                     else:
-                        self.run_event('user_banned')
+                        self.run_event('user_banned', user_moderated, channel, timestamp, metadata)
                 else:
                     self.run_event("clearchat", channel, timestamp, metadata)
             case "CLEARMSG":
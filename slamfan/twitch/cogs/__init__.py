@@ -1,3 +1,3 @@
 from .admin import Admin
 from .turing import Turing
-from .trivia import Trivia
\ No newline at end of file
+from .trivia import Trivia, TriviaSources
\ No newline at end of file
@@ -1,18 +1,28 @@
 
 from twitchio.ext.commands import Cog, Context, command
+from typing import Any, Awaitable, Callable, Dict
 import asyncio
 
 from .cogbase import CogBase, Permission
+from ..outbound import Priority
 
 class Admin(CogBase):
     """
     Administrator cog. Contains functions to kill, restart
     and shutdown the hosting bot remotely.
     """
-    def __init__(self, super_user):
+    def __init__(self, super_user, stats: Callable[[], Awaitable[Dict[str, Any]]] | None = None,
+                 profiler: Any | None = None):
+        """
+        :paramref: `stats`: gathers the report for `!stats`
+        :paramref: `profiler`: the `metrics.profiling.Profiler` for `!profile`
+        """
         super().__init__(super_user)
+        self.__stats = stats
+        self.__profiler = profiler
         self.__restart = asyncio.Event()
         self.__die = asyncio.Event()
+        self.__cold = False
 
     @command()
     async def kill(self, ctx: Context) -> None:
@@ -37,17 +47,65 @@ class Admin(CogBase):
 
 
     @command()
-    async def restart(self, ctx: Context):
+    async def restart(self, ctx: Context, *args):
         """
         Gracefully signal the server to shutdown, and signal
-        that the server should restart.
+        that the server should restart, i.e. `!restart [cold]`
+
+        A restart is warm by default: only the chat connections and
+        cogs are rebuilt. A cold restart also rebuilds the dashboard
+        client and trivia sessions, and re-reads the banned words.
         """
         if not self._check_permission(Permission.Moderator, ctx.author):
             return
 
+        self.__cold = len(args) > 0 and args[0].lower() == "cold"
         self.__restart.set()
         self.__die.set()
 
+    @command()
+    async def stats(self, ctx: Context) -> None:
+        """
+        Report memory, backlogs and corpus sizes, i.e. `!stats`
+        """
+        from metrics.stats import summary
+
+        if self.__stats is None or not self._check_permission(Permission.BotHost, ctx.author):
+            return
+
+        await self._say(ctx, summary(await self.__stats()), Priority.ANSWER)
+
+    @command()
+    async def profile(self, ctx: Context, *args) -> None:
+        """
+        Profile the running bot for a while and write the results to a
+        file, i.e. `!profile [sample|cpu|memory] [seconds]` or
+        `!profile stop` to end it early
+        """
+        from metrics.profiling import ProfileMode
+
+        if self.__profiler is None or not self._check_permission(Permission.BotHost, ctx.author):
+            return
+
+        if len(args) > 0 and args[0].lower() == "stop":
+            self.__profiler.stop()
+            return
+
+        try:
+            mode = ProfileMode(args[0].lower()) if len(args) > 0 else ProfileMode.SAMPLE
+            seconds = float(args[1]) if len(args) > 1 else 30.0
+        except ValueError:
+            await self._say(ctx, "!profile [sample|cpu|memory] [seconds], or !profile stop", Priority.ANSWER)
+            return
+
+        try:
+            path, top = await self.__profiler.run(mode, seconds)
+        except RuntimeError as e:
+            await self._say(ctx, str(e), Priority.ANSWER)
+            return
+
+        await self._say(ctx, f"{path}: {top}"[:480], Priority.ANSWER)
+
     @property
     def die_event(self) -> asyncio.Event:
         return self.__die
@@ -55,3 +113,7 @@ class Admin(CogBase):
     @property
     def restart_event(self) -> asyncio.Event:
         return self.__restart
+
+    @property
+    def cold_restart(self) -> bool:
+        return self.__cold
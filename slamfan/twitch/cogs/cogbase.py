@@ -1,10 +1,14 @@
 from twitchio.ext.commands import Cog, command
 from twitchio.ext.commands.bot import Bot
-from twitchio import Chatter
+from twitchio import Chatter, Channel
+from twitchio.ext.commands import Context
 from enum import Enum
+from typing import Awaitable
 
 import asyncio
 
+from ..outbound import Priority
+
 class Permission(Enum):
 
     BotHost = 0,
@@ -63,10 +67,46 @@ class CogBase(Cog):
     def die(self):
         self._die.set()
 
+    async def _unless_dying(self, waiting: Awaitable) -> bool:
+        """
+        Wait for `waiting`, or until the cog is told to die, whichever
+        comes first. Returns `False` if it was told to die.
+        """
+        waiting = asyncio.ensure_future(waiting)
+        dying = asyncio.ensure_future(self._die.wait())
+        try:
+            await asyncio.wait((waiting, dying), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiting.cancel()
+            dying.cancel()
+        return not self._die.is_set()
+
     @Cog.event("event_ready")
     async def on_ready(self):
         print(f"{self._bot.nick}.{self.name} ready")
 
+    async def _say(self, target: Channel | Context, text: str, priority: Priority = Priority.CHATTER,
+                   coalesce: str | None = None, max_age: float | None = None) -> bool:
+        """
+        Send `text` to a channel, or in reply to a command, through the
+        bot's send queue if it has one. Returns whether it was sent.
+
+        :paramref: `priority`: the queue lane
+        :paramref: `coalesce`: replaces a queued message with the same key
+        :paramref: `max_age`: seconds after which it is not worth sending
+        """
+        if isinstance(target, Context):
+            channel, send = target.channel.name, target.reply
+        else:
+            channel, send = target.name, target.send
+
+        outbound = getattr(self._bot, "outbound", None)
+        if outbound is None:
+            await send(text)
+            return True
+
+        return await outbound.submit(self._bot.nick, channel, text, send, priority, coalesce, max_age)
+
     def _check_permission(self, required: Permission, person: Chatter) -> bool:
         got: Permission = Permission.Anonymous
 
@@ -2,21 +2,39 @@ import asyncio
 
 from twitchio.ext.commands import Cog, Context, command
 from twitchio import Message, Chatter, Channel, User
-from typing import Dict, Any, List, Set
+from typing import Deque, Dict, Any, List, Set
+from collections import deque
 from re import compile as regex
 from random import shuffle, choice
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from math import ceil
 from html import unescape as htmlunescape
+from time import perf_counter, monotonic
 
 from brokers import DashboardBroker, DatabaseBroker
+from metrics import Counter, Gauge, Histogram
 
 from .cogbase import CogBase, Permission
+from ..outbound import Priority
+from ..streams import StreamWatcher
 
 __TWITCH_TO_DASHBOARD_NAME__ = {
     "slamjam_": "slam"
 }
 
+_FETCH_LATENCY = Histogram("slamfan_trivia_fetch_seconds",
+                           "Time taken to fetch a question from a trivia source",
+                           ("source",))
+_FETCH_FAILURES = Counter("slamfan_trivia_fetch_failures",
+                          "Questions a trivia source failed to give (errors and timeouts)",
+                          ("source",))
+_HEDGED = Counter("slamfan_trivia_hedged_requests",
+                  "Requests sent to a trivia source because another was slower than its p95",
+                  ("source",))
+_BREAKER_OPEN = Gauge("slamfan_trivia_source_open",
+                      "1 while a trivia source's circuit breaker is open (the source is not asked)",
+                      ("source",))
+
 class TriviaQuestion(object):
 
     def __init__(self, q: str, a : str, incorrect: List[str]):
@@ -75,30 +93,131 @@ class _TriviaSource(object):
     async def dispute(self) -> str:
         return f"Dispute the answer at {self.__source}"
 
+class _CircuitBreaker(object):
+    """
+    Stops asking a source that keeps failing: after `failures` failures
+    in a row it opens for `cooldown` seconds (doubling each time it opens
+    again, up to `longest`), then lets one request through to see
+    whether the source is back.
+    """
+
+    def __init__(self, name: str, failures: int = 3, cooldown: float = 30.0, longest: float = 600.0) -> None:
+        self.__gauge = _BREAKER_OPEN.labels(name)
+        self.__failures = failures
+        self.__cooldown = cooldown
+        self.__longest = longest
+        self.__failed = 0
+        self.__opened = 0
+        self.__open_until = 0.0
+        self.__probing = False
+
+    def available(self) -> bool:
+        return monotonic() >= self.__open_until and not self.__probing
+
+    def allow(self) -> bool:
+        """
+        Whether to send a request now; once the breaker has opened, the
+        first one after the cooldown is the probe.
+        """
+        if not self.available():
+            return False
+
+        self.__probing = self.__failed >= self.__failures
+        self.__gauge.set(0)
+        return True
+
+    def release(self) -> None:
+        """
+        A request was abandoned, neither failing nor succeeding.
+        """
+        self.__probing = False
+
+    def success(self) -> None:
+        self.__failed = 0
+        self.__opened = 0
+        self.__probing = False
+
+    def failure(self) -> None:
+        self.__failed += 1
+        self.__probing = False
+        if self.__failed >= self.__failures:
+            self.__open_until = monotonic() + min(self.__longest, self.__cooldown * 2 ** self.__opened)
+            self.__opened += 1
+            self.__gauge.set(1)
+
 class _WebTriviaSource(_TriviaSource):
 
-    def __init__(self, url) -> None:
+    # hedge after this long until there are enough samples for a p95
+    HEDGE_AFTER = 1.0
+    MIN_SAMPLES = 10
+
+    def __init__(self, session: ClientSession, url: str) -> None:
+        """
+        :paramref: `session`: the HTTP session shared by all sources
+        :paramref: `url`: where a question is fetched from
+        """
         from urllib.parse import urlparse
-        self.__session = ClientSession()
+        self.__session = session
         self.__url = url
         parsed = urlparse(self.__url)
+        self.__name = parsed.netloc
+        self.__latency = _FETCH_LATENCY.labels(parsed.netloc)
+        self.__failures = _FETCH_FAILURES.labels(parsed.netloc)
+        # recent successful question latencies
+        self.__recent: Deque[float] = deque(maxlen=100)
+        self.__breaker = _CircuitBreaker(parsed.netloc)
         super().__init__(f"{parsed.scheme}://{parsed.netloc}")
 
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    @property
+    def breaker(self) -> _CircuitBreaker:
+        return self.__breaker
+
     async def _fetch(self) -> Dict[str, Any]:
-        req = await self.__session.get(self.__url)
-        return await req.json(content_type=None)
+        async with self.__session.get(self.__url) as req:
+            req.raise_for_status()
+            return await req.json(content_type=None)
 
-    async def __aenter__(self) -> '_WebTriviaSource':
-        await self.__session.__aenter__()
-        return self
+    async def ask(self) -> TriviaQuestion:
+        """
+        `question`, timed and counted towards the circuit breaker.
+        """
+        start = perf_counter()
+        try:
+            question = await self.question()
+        except asyncio.CancelledError:
+            self.__breaker.release()
+            raise
+        except Exception:
+            self.__latency.observe(perf_counter() - start)
+            self.__failures.inc()
+            self.__breaker.failure()
+            raise
+
+        elapsed = perf_counter() - start
+        self.__latency.observe(elapsed)
+        self.__recent.append(elapsed)
+        self.__breaker.success()
+        return question
+
+    def hedge_after(self) -> float:
+        """
+        Seconds to wait for this source before asking another: its
+        recent 95th percentile latency.
+        """
+        if len(self.__recent) < self.MIN_SAMPLES:
+            return self.HEDGE_AFTER
 
-    async def __aexit__(self, *a) -> None:
-        await self.__session.__aexit__(*a)
+        ranked = sorted(self.__recent)
+        return ranked[int(0.95 * (len(ranked) - 1))]
 
 class OpenTrivia(_WebTriviaSource):
 
-    def __init__(self) -> None:
-        super().__init__("https://opentdb.com/api.php?amount=1")
+    def __init__(self, session: ClientSession) -> None:
+        super().__init__(session, "https://opentdb.com/api.php?amount=1")
 
     async def question(self) -> TriviaQuestion:
         r = await self._fetch()
@@ -113,8 +232,8 @@ class OpenTrivia(_WebTriviaSource):
 
 class TriviaApi(_WebTriviaSource):
 
-    def __init__(self) -> None:
-        super().__init__("https://the-trivia-api.com/api/questions?limit=1")
+    def __init__(self, session: ClientSession) -> None:
+        super().__init__(session, "https://the-trivia-api.com/api/questions?limit=1")
 
     async def question(self) -> TriviaQuestion:
         r = (await self._fetch())[0]
@@ -122,8 +241,8 @@ class TriviaApi(_WebTriviaSource):
 
 class GithubSource(_WebTriviaSource):
 
-    def __init__(self) -> None:
-        super().__init__("https://raw.githubusercontent.com/bowerscd/aoe2trivia/main/data.json")
+    def __init__(self, session: ClientSession) -> None:
+        super().__init__(session, "https://raw.githubusercontent.com/bowerscd/aoe2trivia/main/data.json")
 
     async def question(self) -> TriviaQuestion:
 
@@ -131,26 +250,105 @@ class GithubSource(_WebTriviaSource):
         q = choice(r)
         return TriviaQuestion(q['question'], q['answer'], q['options'] + q['answer'])
 
+class TriviaSources(object):
+    """
+    The trivia sources, and the pooled HTTP session they share. Lives
+    outside the `Trivia` cog so that a warm restart, which rebuilds the
+    cogs, keeps the session (and its open connections).
+
+    A question comes from a random source; if it has not answered within
+    its usual (p95) time, another is asked too and the first answer
+    wins, and no question takes longer than `deadline`. Sources that keep
+    failing are left alone for a while (see `_CircuitBreaker`).
+    """
+
+    def __init__(self, connect_timeout: float = 2.0, read_timeout: float = 4.0, deadline: float = 6.0) -> None:
+        """
+        :paramref: `connect_timeout`: seconds to connect to a source
+        :paramref: `read_timeout`: seconds a source may go without sending
+        :paramref: `deadline`: most seconds to spend on one question,
+                               across every source asked
+        """
+        self.__deadline = deadline
+        self.__session = ClientSession(connector=TCPConnector(limit=8, limit_per_host=2, keepalive_timeout=120,
+                                                              ttl_dns_cache=300),
+                                       timeout=ClientTimeout(connect=connect_timeout, sock_read=read_timeout))
+        # GithubSource(self.__session)
+        self.__sources: tuple[_WebTriviaSource] = (TriviaApi(self.__session), OpenTrivia(self.__session))
+
+    async def __aenter__(self) -> 'TriviaSources':
+        await self.__session.__aenter__()
+        return self
+
+    async def __aexit__(self, *a) -> None:
+        await self.__session.__aexit__(*a)
+
+    async def question(self) -> TriviaQuestion:
+        """
+        A question from whichever source answers first. Raises the last
+        source's error, or `TimeoutError`, if none does in time.
+        """
+        candidates = [x for x in self.__sources if x.breaker.available()]
+        shuffle(candidates)
+
+        pending: Dict[asyncio.Task, _WebTriviaSource] = {}
+        error: Exception = LookupError("every trivia source is failing")
+        overdue = False
+        try:
+            async with asyncio.timeout(self.__deadline):
+                while len(candidates) > 0 or len(pending) > 0:
+                    wait = None
+                    while len(candidates) > 0:
+                        source = candidates.pop()
+                        if source.breaker.allow():
+                            if overdue:
+                                _HEDGED.labels(source.name).inc()
+                            pending[asyncio.create_task(source.ask(), name=f"trivia_fetch.{source.name}")] = source
+                            wait = source.hedge_after()
+                            break
+
+                    if len(pending) == 0:
+                        break
+
+                    done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                    # nothing back in time: ask the next source as well
+                    overdue = len(done) == 0
+                    for task in done:
+                        del pending[task]
+                        if task.exception() is None:
+                            return task.result()
+                        error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise error
+
 
 class Trivia(CogBase):
     """
     Base class for the trivia extension for the bot.
     """
 
-    def __init__(self, super_user: str, dashboard: DashboardBroker, dbm: DatabaseBroker, tg: asyncio.TaskGroup):
+    def __init__(self, super_user: str, dashboard: DashboardBroker, dbm: DatabaseBroker, tg: asyncio.TaskGroup,
+                 sources: TriviaSources, streams: StreamWatcher):
         """
         Initialization.
 
         :paramref: `super_user`: the username of the super user who
                     will be used for 'BotHost' permissions.
 
+        :paramref: `sources`: where questions come from; entered (and
+                              exited) by the caller.
+
+        :paramref: `streams`: tells which channels are live.
         """
         from random import seed
 
         super().__init__(super_user)
         seed()
-        # GithubSource()
-        self.__trivia_sources: tuple[_WebTriviaSource] = (TriviaApi(), OpenTrivia())
+        self.__trivia_sources = sources
+        self.__streams = streams
         self.__dash = dashboard
         self.__dbm = dbm
         self.__tasks = tg
@@ -158,22 +356,21 @@ class Trivia(CogBase):
         self.__trivia_delay: float = 90.0
         self.__trivia_time: float = 15.0
 
-    async def __aenter__(self) -> '_WebTriviaSource':
-        [await x.__aenter__() for x in self.__trivia_sources]
-        return self
-
-    async def __aexit__(self, *a) -> None:
-        [await x.__aexit__(*a) for x in self.__trivia_sources]
-
-    async def emit_message(self, channel: Channel) -> str:
+    async def emit_message(self, channel: Channel) -> bool:
         """
+        Ask a question in the channel. Returns `False` if there was none
+        to ask, i.e. every source failed or was too slow.
         """
-        source = choice(self.__trivia_sources)
-
-        question = await source.question()
+        try:
+            question = await self.__trivia_sources.question()
+        except Exception as e:
+            print(f"#{channel.name}: no trivia question: {e!r}")
+            return False
 
         self.__active_messages[channel.name] = [asyncio.Event(), question, 0.0]
-        await channel.send(f"{self._bot._prefix}answer in {ceil(self.__trivia_time)}s: {question}")
+        await self._say(channel, f"{self._bot._prefix}answer in {ceil(self.__trivia_time)}s: {question}",
+                        Priority.TRIVIA)
+        return True
 
     async def trivia_main(self, channel: Channel):
         """
@@ -183,17 +380,21 @@ class Trivia(CogBase):
             player_name = __TWITCH_TO_DASHBOARD_NAME__.get(channel.name, channel.name)
             while not self._die.is_set():
 
-                # If player is not idle, or is not live, spin
+                # Wait until the player is idle (pushed by the dashboard) and
+                # live (pushed by the stream watcher's polls) at once
                 while True:
+                    if not await self._unless_dying(self.__dash.wait_until_idle(player_name)):
+                        return
 
-                    if self.__dash.player_is_idle(player_name) and len(await self._bot.fetch_streams(user_logins=[channel.name])) != 0:
-                        break
+                    if not await self._unless_dying(self.__streams.wait_until_live(channel.name)):
+                        return
 
-                    await asyncio.sleep(0.5)
+                    if self.__dash.player_is_idle(player_name):
+                        break
 
-                # ask the question
-                await self.emit_message(channel)
-                while self.__active_messages[channel.name][2] < self.__trivia_time:
+                # ask the question, or if there is none, try again after the delay
+                asked = await self.emit_message(channel)
+                while asked and self.__active_messages[channel.name][2] < self.__trivia_time:
                     if self._die.is_set():
                         return
 
@@ -204,9 +405,10 @@ class Trivia(CogBase):
                     await asyncio.sleep(0.1)
 
                 # no one got the answer, report the right answer
-                if not self.__active_messages[channel.name][0].is_set():
+                if asked and not self.__active_messages[channel.name][0].is_set():
                     self.__active_messages[channel.name][0].set()
-                    await channel.send(f"The correct answer was: {self.__active_messages[channel.name][1].answer}")
+                    await self._say(channel, f"The correct answer was: {self.__active_messages[channel.name][1].answer}",
+                                    Priority.TRIVIA)
 
                 # Wait until the next quesiton can be asked
                 time_elapsed = 0.0
@@ -222,7 +424,8 @@ class Trivia(CogBase):
 
     @Cog.event("event_channel_joined")
     async def on_join_channel(self, channel: Channel) -> None:
-        self.__tasks.create_task(self.trivia_main(channel))
+        self.__streams.watch(self._bot, channel.name)
+        self.__tasks.create_task(self.trivia_main(channel), name=f"trivia.{channel.name}")
 
     async def __get_stats(self, uid: int) -> str:
         rank, score, questions = await self.__dbm.get_trivia_stats(uid)
@@ -250,4 +453,5 @@ class Trivia(CogBase):
             time_remaining = self.__trivia_delay - v[2]
             score_increase = round(5.0 * time_remaining)
             await self.__dbm.increment_trivia_score(ctx.author.id, score_increase)
-            await ctx.reply(f"Correct! Your trivia score has increased by {score_increase}! {await self.__get_stats(ctx.author.id)}")
+            await self._say(ctx, f"Correct! Your trivia score has increased by {score_increase}! {await self.__get_stats(ctx.author.id)}",
+                            Priority.ANSWER)
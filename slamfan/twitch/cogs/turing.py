@@ -1,7 +1,7 @@
 
 from twitchio.ext.commands import Cog, Context, command
 from twitchio import Message, Chatter, Channel, User
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Set, Tuple
 from uuid import UUID
 from datetime import datetime, UTC
 from re import compile as regex
@@ -9,7 +9,8 @@ from re import compile as regex
 from brokers import DatabaseBroker
 
 from .cogbase import CogBase, Permission
-from aiorwlock import RWLock
+from ..outbound import Priority
+from ..streams import StreamWatcher
 import asyncio
 
 _GLOBALLY_IGNORED_={
@@ -32,7 +33,8 @@ class Turing(CogBase):
     __SAVE_INTERVAL__ = 60
     __REMOVE_MENTION__ = regex(r"\s*@[A-Z0-9a-z_]+\s*")
 
-    def __init__(self, super_user: str, dbm: DatabaseBroker, tg: asyncio.TaskGroup):
+    def __init__(self, super_user: str, dbm: DatabaseBroker, tg: asyncio.TaskGroup, streams: StreamWatcher,
+                 msg_delay: Tuple[int, int] = (300, 600), candidates: int = 20):
         """
         Initialization. 
 
@@ -41,6 +43,15 @@ class Turing(CogBase):
 
         :paramref: `dbm`: the database manager object to control reading
                           and querying the database.
+
+        :paramref: `streams`: tells which channels are live; channels
+                              this cog joins are watched.
+
+        :paramref: `msg_delay`: range of seconds to wait between emitted
+                                messages.
+
+        :paramref: `candidates`: messages generated per emitted message,
+                                 of which the best is picked.
         """
         from random import seed
 
@@ -48,7 +59,9 @@ class Turing(CogBase):
         seed()
         self.__dbm = dbm
         self.__tasks = tg
-        self.__msg_delay: Tuple[float, float] = (300.0, 600.0)
+        self.__streams = streams
+        self.__msg_delay: Tuple[int, int] = msg_delay
+        self.__candidates = candidates
 
     @command()
     async def ignore(self, ctx: Context, *args):
@@ -118,7 +131,7 @@ class Turing(CogBase):
         await self.__dbm.twitch_unban(ctx.channel.name, ctx.author.id, ctx.message.timestamp)
 
     @command()
-    async def bad(self, ctx: Context):
+    async def bad(self, ctx: Context, *args):
         """
         bad command, i.e. `!bad <word>`
 
@@ -127,10 +140,15 @@ class Turing(CogBase):
         and the extension will not generate sentences with this
         word.
 
-        NOTE: this will trigger a complete rebuild of the dataset,
-        so it's perf will be pretty horrendous.
+        Messages already learned from are found through the
+        database's full-text index and retracted from the model,
+        rather than rebuilding it.
         """
-        raise NotImplementedError()
+        if len(args) != 1 or not self._check_permission(Permission.Moderator, ctx.author):
+            return
+
+        retracted = await self.__dbm.ban_word(args[0])
+        await self._say(ctx, f"forgot {retracted} messages", Priority.ANSWER)
 
     @command()
     async def good(self, ctx: Context):
@@ -147,6 +165,21 @@ class Turing(CogBase):
         """
         raise NotImplementedError()
 
+    @command()
+    async def about(self, ctx: Context, *args):
+        """
+        about command, i.e. `!about <word>`
+
+        Say something about a word, if chat ever has.
+        """
+        if len(args) != 1 or not self._check_permission(Permission.Subscriber, ctx.author):
+            return
+
+        await self.__dbm.corpus_ready(ctx.channel.name)
+        text = await self.__dbm.generate_text(ctx.channel.name, about=args[0])
+        if text is not None:
+            await self._say(ctx, text, Priority.ANSWER, coalesce="about", max_age=30)
+
     async def __save_message(self, channel: str, uid: int, msg: str, msg_id: UUID, msg_time: datetime):
         """
         Internal function for saving messages to the database. Shortcuts out
@@ -186,30 +219,59 @@ class Turing(CogBase):
                     await asyncio.sleep(1.0)
                     delay += 1.0
 
-                for i in range(20):
-                    text = await self.__dbm.generate_text(channel.name)
+                text = self.__pick(await self.__dbm.generate_candidates(channel.name, self.__candidates),
+                                   messages)
 
                 if text is None:
                     continue
 
                 # block until stream is live
-                while len(await self._bot.fetch_streams(user_logins=[channel.name])) == 0:
+                while not self.__streams.is_live(channel.name):
                     # ...except if we're dying
                     if self._die.is_set():
                         return
 
                     messages.clear()
-                    await asyncio.sleep(0.1)
+                    await asyncio.sleep(1.0)
+
+                # may have been sent while waiting for the stream
+                if text in messages:
+                    continue
 
-                messages.add(text)  
-                await channel.send(text)
+                # Idle chatter: a newer message replaces it if it is still
+                # queued, and it is not worth sending long after the fact
+                messages.add(text)
+                await self._say(channel, text, Priority.CHATTER, coalesce="turing", max_age=60.0)
         except asyncio.CancelledError:
             pass
 
+    @staticmethod
+    def __pick(candidates: List[Tuple[str, float]], sent: Set[str]) -> str | None:
+        """
+        Best-of-N: a random one of the most typical quarter of the
+        candidates, so the pick is plausible without always being the
+        single most likely sentence. Anything already `sent` this stream
+        is skipped.
+        """
+        from random import choice
+
+        candidates = [x for x in candidates if x[0] not in sent]
+        if len(candidates) == 0:
+            return None
+
+        ranked = sorted(candidates, key=lambda x: x[1], reverse=True)
+        return choice(ranked[:max(1, len(ranked) // 4)])[0]
+
     @Cog.event("event_channel_joined")
     async def on_join_channel(self, channel: Channel) -> None:
+        self.__streams.watch(self._bot, channel.name)
         await self.__dbm.init_corpus(channel.name)
-        self.__tasks.create_task(self.turing_main(channel))
+        self.__tasks.create_task(self.turing_main(channel), name=f"turing.{channel.name}")
+
+    @Cog.event("event_part")
+    async def on_part_channel(self, user: User) -> None:
+        if user.name is not None and user.name.lower() == self._bot.nick.lower():
+            self.__dbm.detach(user.channel.name)
 
     @Cog.event("event_message")
     async def on_message(self, msg: Message) -> None:
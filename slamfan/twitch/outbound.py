@@ -0,0 +1,210 @@
+import asyncio
+from collections import deque
+from enum import IntEnum
+from time import monotonic
+from typing import Any, Awaitable, Callable, Deque, Dict, Tuple
+
+from metrics import Counter, Gauge, Histogram
+
+_OUTBOUND = Counter("slamfan_outbound_messages",
+                    "Chat messages handed to the send queue, by what became of them",
+                    ("account", "outcome"))
+_QUEUED = Gauge("slamfan_outbound_queued",
+                "Chat messages waiting in the send queue",
+                ("account",))
+_WAIT = Histogram("slamfan_outbound_wait_seconds",
+                  "Time sent messages spent in the send queue")
+
+class Priority(IntEnum):
+    """
+    Send queue lanes, most urgent first.
+    """
+    ANSWER = 0
+    TRIVIA = 1
+    CHATTER = 2
+
+class _SlidingWindow(object):
+    """
+    At most `limit` messages in any `period` seconds, as Twitch counts
+    them: the send times of the last `limit` are kept, and the next may
+    only go once the oldest of them is `period` old.
+    """
+
+    def __init__(self, limit: int, period: float) -> None:
+        self.__period = period
+        self.__sent: Deque[float] = deque(maxlen=limit)
+
+    def ready_in(self, now: float) -> float:
+        """
+        Seconds until a message may be sent; 0 if one may now.
+        """
+        if len(self.__sent) < self.__sent.maxlen:
+            return 0.0
+        return max(0.0, self.__sent[0] + self.__period - now)
+
+    def take(self, now: float) -> None:
+        self.__sent.append(now)
+
+class _Outgoing(object):
+
+    def __init__(self, account: str, channel: str, text: str, send: Callable[[str], Awaitable[Any]],
+                 coalesce: str | None, max_age: float | None) -> None:
+        self.account = account
+        self.channel = channel
+        self.text = text
+        self.send = send
+        self.coalesce = coalesce
+        self.queued = monotonic()
+        self.expires = self.queued + max_age if max_age is not None else None
+        self.done: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def finish(self, sent: bool) -> None:
+        if not self.done.done():
+            self.done.set_result(sent)
+
+class SendQueue(object):
+    """
+    The one way out to chat, shared by every bot in the process, so that
+    nothing exceeds Twitch's limits: a sliding window per account (all
+    of its channels together) and one per (account, channel).
+
+    Messages wait in priority lanes; the most urgent message that both
+    of its windows allow goes next, so a channel that is rate limited
+    never holds up the others. A message given a `coalesce` key replaces
+    one with the same key still waiting in its channel, and one given a
+    `max_age` is dropped if it has waited longer than that.
+    """
+
+    # non-moderator limits: 20 messages per 30 seconds per account, and
+    # one per second in any one channel
+    ACCOUNT_LIMIT: Tuple[int, float] = (20, 30.0)
+    CHANNEL_LIMIT: Tuple[int, float] = (1, 1.0)
+
+    def __init__(self, tg: asyncio.TaskGroup,
+                 account_limit: Tuple[int, float] = ACCOUNT_LIMIT,
+                 channel_limit: Tuple[int, float] = CHANNEL_LIMIT) -> None:
+        """
+        :paramref: `tg`: task group to run the sender in
+        :paramref: `account_limit`: (messages, per seconds) for an account
+        :paramref: `channel_limit`: (messages, per seconds) for an account
+                                    in one channel
+        """
+        self.__task_group = tg
+        self.__account_limit = account_limit
+        self.__channel_limit = channel_limit
+        self.__lanes: Dict[Priority, Deque[_Outgoing]] = {x: deque() for x in Priority}
+        self.__accounts: Dict[str, _SlidingWindow] = {}
+        self.__channels: Dict[Tuple[str, str], _SlidingWindow] = {}
+        self.__wake = asyncio.Event()
+        self.__task: asyncio.Task | None = None
+
+    async def __aenter__(self) -> 'SendQueue':
+        self.__task = self.__task_group.create_task(self.__send_main(), name="outbound")
+        return self
+
+    async def __aexit__(self, *e) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+        for lane in self.__lanes.values():
+            while len(lane) > 0:
+                self.__drop(lane.popleft(), "cancelled")
+
+    def submit(self, account: str, channel: str, text: str, send: Callable[[str], Awaitable[Any]],
+               priority: Priority = Priority.CHATTER, coalesce: str | None = None,
+               max_age: float | None = None) -> asyncio.Future:
+        """
+        Queue a message. Returns a future of whether it was sent.
+
+        :paramref: `account`: the sending bot's login
+        :paramref: `channel`: the channel it goes to
+        :paramref: `send`: sends the text, e.g. `Channel.send` or `Context.reply`
+        :paramref: `coalesce`: replaces a queued message with this key in the channel
+        :paramref: `max_age`: seconds after which it is not worth sending
+        """
+        out = _Outgoing(account, channel, text, send, coalesce, max_age)
+        lane = self.__lanes[priority]
+
+        if coalesce is not None:
+            for i, queued in enumerate(lane):
+                if (queued.account, queued.channel, queued.coalesce) == (account, channel, coalesce):
+                    lane[i] = out
+                    queued.finish(False)
+                    _OUTBOUND.labels(account, "coalesced").inc()
+                    self.__wake.set()
+                    return out.done
+
+        lane.append(out)
+        _QUEUED.labels(account).inc()
+        self.__wake.set()
+        return out.done
+
+    def cancel(self, account: str) -> None:
+        """
+        Drop everything queued by `account`, e.g. when its bot disconnects.
+        """
+        for lane in self.__lanes.values():
+            for out in [x for x in lane if x.account == account]:
+                lane.remove(out)
+                self.__drop(out, "cancelled")
+
+    def __drop(self, out: _Outgoing, outcome: str) -> None:
+        out.finish(False)
+        _QUEUED.labels(out.account).dec()
+        _OUTBOUND.labels(out.account, outcome).inc()
+
+    def __next(self, now: float) -> Tuple[_Outgoing | None, float]:
+        """
+        The message to send now, or how long until one may be sent.
+        """
+        wait = float("inf")
+        for lane in self.__lanes.values():
+            for out in list(lane):
+                if out.expires is not None and now > out.expires:
+                    lane.remove(out)
+                    self.__drop(out, "expired")
+                    continue
+
+                account = self.__accounts.get(out.account)
+                if account is None:
+                    account = self.__accounts[out.account] = _SlidingWindow(*self.__account_limit)
+                key = (out.account, out.channel)
+                channel = self.__channels.get(key)
+                if channel is None:
+                    channel = self.__channels[key] = _SlidingWindow(*self.__channel_limit)
+
+                ready = max(account.ready_in(now), channel.ready_in(now))
+                if ready == 0.0:
+                    lane.remove(out)
+                    account.take(now)
+                    channel.take(now)
+                    return out, 0.0
+
+                wait = min(wait, ready)
+        return None, wait
+
+    async def __send_main(self) -> None:
+        try:
+            while True:
+                out, wait = self.__next(monotonic())
+                if out is None:
+                    self.__wake.clear()
+                    try:
+                        await asyncio.wait_for(self.__wake.wait(), None if wait == float("inf") else wait)
+                    except TimeoutError:
+                        pass
+                    continue
+
+                _QUEUED.labels(out.account).dec()
+                try:
+                    await out.send(out.text)
+                except Exception as e:
+                    print(f"{out.account} -> #{out.channel}: send failed: {e!r}")
+                    _OUTBOUND.labels(out.account, "failed").inc()
+                    out.finish(False)
+                    continue
+
+                _WAIT.observe(monotonic() - out.queued)
+                _OUTBOUND.labels(out.account, "sent").inc()
+                out.finish(True)
+        except asyncio.CancelledError:
+            return
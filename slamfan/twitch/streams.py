@@ -0,0 +1,125 @@
+import asyncio
+from datetime import datetime, UTC
+from typing import Dict, Set
+
+from twitchio.ext.commands import Bot
+
+from brokers import DatabaseBroker
+
+class StreamWatcher(object):
+    """
+    Tracks which channels are live, with one batched API request every
+    `interval` seconds for all of them (rather than one per channel per
+    cog), and records each stream session through the database broker
+    as its channel goes live and offline.
+
+    Sessions are keyed by Twitch's stream id, so one that was live
+    across a restart carries on as the same session.
+    """
+
+    # most logins helix takes per request
+    BATCH = 100
+
+    def __init__(self, tg: asyncio.TaskGroup, dbm: DatabaseBroker, interval: float = 15.0) -> None:
+        """
+        :paramref: `tg`: task group to run the poller in
+        :paramref: `dbm`: where sessions are recorded
+        :paramref: `interval`: seconds between polls
+        """
+        self.__task_group = tg
+        self.__dbm = dbm
+        self.__interval = interval
+        self.__api: Bot | None = None
+        self.__channels: Set[str] = set()
+        # channel -> stream id, for those live at the last poll
+        self.__live: Dict[str, str] = {}
+        # channels polled at least once
+        self.__seen: Set[str] = set()
+        # channel -> set while it is live, for `wait_until_live`
+        self.__went_live: Dict[str, asyncio.Event] = {}
+        self.__wake = asyncio.Event()
+        self.__task: asyncio.Task | None = None
+
+    async def __aenter__(self) -> 'StreamWatcher':
+        self.__task = self.__task_group.create_task(self.__poll_main(), name="streams")
+        return self
+
+    async def __aexit__(self, *e) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+
+    def watch(self, bot: Bot, channel: str) -> None:
+        """
+        Start tracking `channel`, asking the API through `bot` (the
+        newest bot to ask is used for every channel).
+        """
+        self.__api = bot
+        channel = channel.lower()
+        if channel not in self.__channels:
+            self.__channels.add(channel)
+            self.__wake.set()
+
+    def is_live(self, channel: str) -> bool:
+        """
+        Whether the channel was live at the last poll.
+        """
+        return channel.lower() in self.__live
+
+    async def wait_until_live(self, channel: str) -> None:
+        """
+        Wait for the channel to be live (see `is_live`), woken by the
+        poll that finds it so. Returns at once if it already is.
+        """
+        await self.__live_event(channel.lower()).wait()
+
+    def __live_event(self, channel: str) -> asyncio.Event:
+        live = self.__went_live.get(channel)
+        if live is None:
+            live = self.__went_live[channel] = asyncio.Event()
+            if channel in self.__live:
+                live.set()
+        return live
+
+    async def __poll_main(self) -> None:
+        try:
+            while True:
+                self.__wake.clear()
+                if self.__api is not None and len(self.__channels) > 0:
+                    await self.__poll(self.__api)
+
+                try:
+                    await asyncio.wait_for(self.__wake.wait(), self.__interval)
+                except TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            return
+
+    async def __poll(self, api: Bot) -> None:
+        channels = sorted(self.__channels)
+        live = {}
+        for i in range(0, len(channels), self.BATCH):
+            try:
+                streams = await api.fetch_streams(user_logins=channels[i:i + self.BATCH])
+            except Exception as e:
+                # e.g. the bot was closed by a restart; its successor will
+                # have called `watch` by the next poll
+                print(f"stream poll failed: {e!r}")
+                return
+
+            for stream in streams:
+                live[stream.user.name.lower()] = stream
+
+        for channel in channels:
+            stream = live.get(channel)
+            if stream is not None and self.__live.get(channel) != str(stream.id):
+                await self.__dbm.stream_started(channel, str(stream.id), stream.started_at)
+                self.__live[channel] = str(stream.id)
+                self.__live_event(channel).set()
+                print(f"#{channel}: live")
+            elif stream is None and (channel in self.__live or channel not in self.__seen):
+                # also closes a session left open by a previous run
+                await self.__dbm.stream_ended(channel, datetime.now(UTC))
+                if self.__live.pop(channel, None) is not None:
+                    self.__live_event(channel).clear()
+                    print(f"#{channel}: offline")
+            self.__seen.add(channel)